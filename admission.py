@@ -0,0 +1,186 @@
+"""
+分析接口的准入控制
+按本进程进行中的分析数和最近的处理耗时决定是否接受新请求，超出容量时快速拒绝
+（带 Retry-After），不让请求排在慢的大模型调用后面直到客户端超时；
+大模型升级任务积压时，新请求只返回本地特征报告，不再排入注定超时的升级任务
+
+容量按优先级分配：交互上传可用全部容量，批量和演示只能用其中一部分，
+负载升高时低优先级流量先被拒绝（429），整体满载时所有请求都被拒绝（503）
+
+环境变量：
+    ADMISSION_MAX_IN_FLIGHT=16     本进程同时进行的分析数上限
+    ADMISSION_TARGET_SECONDS=2     目标处理耗时（秒），最近耗时超过时按比例收缩上限
+    ADMISSION_MAX_BACKLOG=32       排队的升级任务超过该数时新请求降级为本地报告（0 表示不降级）
+"""
+
+import math
+import os
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from metrics import ADMISSION_DECISIONS
+
+# 流量优先级
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+DEMO = 'demo'
+
+# 各优先级可使用的容量比例
+PRIORITY_SHARES: Dict[str, float] = {INTERACTIVE: 1.0, BATCH: 0.5, DEMO: 0.25}
+
+# 准入结果
+ADMIT = 'admit'
+DEGRADE = 'degrade'
+REJECT = 'reject'
+
+# 最近耗时的指数加权平均系数
+_LATENCY_ALPHA = 0.2
+
+
+class Ticket:
+    """一次准入判断的结果；被接受的请求结束时必须 release"""
+
+    def __init__(
+        self,
+        controller: 'AdmissionController',
+        priority: str,
+        outcome: str,
+        status_code: int = 200,
+        retry_after: int = 0,
+        reason: str = ''
+    ):
+        self.controller = controller
+        self.priority = priority
+        self.outcome = outcome
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+        self._released = outcome == REJECT
+        # 流式响应在生成器结束和连接关闭时各释放一次，可能在不同线程中并发
+        self._release_lock = threading.Lock()
+
+    @property
+    def admitted(self) -> bool:
+        return self.outcome != REJECT
+
+    @property
+    def degraded(self) -> bool:
+        return self.outcome == DEGRADE
+
+    def release(self, latency: Optional[float] = None):
+        """
+        请求结束，归还容量（重复或并发调用只归还一次）
+
+        Args:
+            latency: 计入最近耗时的处理时间（秒）；流式、批量等耗时取决于客户端的请求不提供
+        """
+        with self._release_lock:
+            if self._released:
+                return
+            self._released = True
+        self.controller._release(latency)
+
+
+class AdmissionController:
+    """按进行中的请求数和最近耗时动态调整上限的准入控制（线程安全）"""
+
+    def __init__(
+        self,
+        max_in_flight: Optional[int] = None,
+        target_seconds: Optional[float] = None,
+        max_backlog: Optional[int] = None,
+        backlog: Optional[Callable[[], int]] = None
+    ):
+        """
+        Args:
+            max_in_flight: 同时进行的分析数上限，默认读取 ADMISSION_MAX_IN_FLIGHT
+            target_seconds: 目标处理耗时（秒），默认读取 ADMISSION_TARGET_SECONDS
+            max_backlog: 升级任务积压阈值，默认读取 ADMISSION_MAX_BACKLOG
+            backlog: 返回当前排队的升级任务数（不提供则不按积压降级）
+        """
+        if max_in_flight is None:
+            max_in_flight = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', '16'))
+        if target_seconds is None:
+            target_seconds = float(os.getenv('ADMISSION_TARGET_SECONDS', '2'))
+        if max_backlog is None:
+            max_backlog = int(os.getenv('ADMISSION_MAX_BACKLOG', '32'))
+        self.max_in_flight = max_in_flight
+        self.target_seconds = target_seconds
+        self.max_backlog = max_backlog
+        self.backlog = backlog
+        self.in_flight = 0
+        self.latency = 0.0  # 最近耗时的指数加权平均（秒），0 表示尚无样本
+        self._lock = threading.Lock()
+
+    def limit(self) -> int:
+        """
+        当前的并发上限：最近耗时超过目标时按比例收缩（至少为 1），
+        处理变慢时少接受请求，让已接受的请求更快完成
+        """
+        if self.latency <= self.target_seconds:
+            return self.max_in_flight
+        return max(1, int(self.max_in_flight * self.target_seconds / self.latency))
+
+    def retry_after(self) -> int:
+        """建议客户端的重试间隔（秒）：按最近耗时估计腾出容量的时间"""
+        return max(1, math.ceil(self.latency or self.target_seconds))
+
+    def acquire(self, priority: str = INTERACTIVE) -> Ticket:
+        """
+        判断是否接受新请求
+
+        Args:
+            priority: INTERACTIVE、BATCH 或 DEMO
+
+        Returns:
+            Ticket：outcome 为 ADMIT、DEGRADE（只返回本地报告）或 REJECT（status_code 为 429/503）
+        """
+        with self._lock:
+            limit = self.limit()
+            allowed = max(1, int(limit * PRIORITY_SHARES.get(priority, 1.0)))
+            if self.in_flight >= allowed:
+                ticket = Ticket(
+                    self, priority, REJECT,
+                    status_code=503 if self.in_flight >= limit else 429,
+                    retry_after=self.retry_after(),
+                    reason=f'服务繁忙（进行中 {self.in_flight}/{limit}），请稍后重试'
+                )
+            else:
+                self.in_flight += 1
+                ticket = None
+
+        if ticket is None:
+            if self.backlogged():
+                ticket = Ticket(self, priority, DEGRADE, reason='大模型分析排队过多，仅返回本地报告')
+            else:
+                ticket = Ticket(self, priority, ADMIT)
+        ADMISSION_DECISIONS.inc(priority=priority, outcome=ticket.outcome)
+        return ticket
+
+    def backlogged(self) -> bool:
+        """排队的升级任务是否超过阈值（此时新的升级任务很可能排队超时）"""
+        if not self.max_backlog or self.backlog is None:
+            return False
+        try:
+            return self.backlog() >= self.max_backlog
+        except Exception as e:
+            print(f"⚠️  读取升级任务积压失败: {e}")
+            return False
+
+    def _release(self, latency: Optional[float]):
+        with self._lock:
+            self.in_flight -= 1
+            if latency is not None:
+                if self.latency == 0.0:
+                    self.latency = latency
+                else:
+                    self.latency += _LATENCY_ALPHA * (latency - self.latency)
+
+    def stats(self) -> Dict[str, Any]:
+        """当前进行中的请求数、上限和最近耗时"""
+        with self._lock:
+            return {
+                'in_flight': self.in_flight,
+                'limit': self.limit(),
+                'latency_seconds': round(self.latency, 4)
+            }
@@ -10,6 +10,13 @@ from datetime import datetime
 from typing import Dict, Any, List
 from zhipuai import ZhipuAI
 
+from json_utils import extract_json
+from resilience import get_guard
+from deadline import request_timeout
+
+# Per-call timeout cap (seconds); under a request deadline the remaining budget wins
+PROVIDER_TIMEOUT = 60.0
+
 
 class AIContentGenerator:
     """AI-powered content generator for professional health platform"""
@@ -126,7 +133,9 @@ class AIContentGenerator:
 
         try:
             # 调用 GLM-4 生成文章
-            response = self.client.chat.completions.create(
+            response = get_guard('zhipu').call(
+                self.client.chat.completions.create,
+                timeout=request_timeout(PROVIDER_TIMEOUT),
                 model="glm-4-flash",  # 使用 GLM-4 文本模型
                 messages=[
                     {
@@ -225,7 +234,9 @@ class AIContentGenerator:
 """
 
         try:
-            response = self.client.chat.completions.create(
+            response = get_guard('zhipu').call(
+                self.client.chat.completions.create,
+                timeout=request_timeout(PROVIDER_TIMEOUT),
                 model="glm-4-flash",
                 messages=[
                     {
@@ -287,7 +298,9 @@ class AIContentGenerator:
 """
 
             try:
-                response = self.client.chat.completions.create(
+                response = get_guard('zhipu').call(
+                    self.client.chat.completions.create,
+                    timeout=request_timeout(PROVIDER_TIMEOUT),
                     model="glm-4-flash",
                     messages=[{"role": "user", "content": prompt}],
                     temperature=0.7,
@@ -312,21 +325,9 @@ class AIContentGenerator:
     def _parse_json_response(self, response: str) -> Dict[str, Any]:
         """Parse JSON from AI response"""
         try:
-            # 尝试提取 JSON 部分
-            if "```json" in response:
-                json_start = response.find("```json") + 7
-                json_end = response.find("```", json_start)
-                json_str = response[json_start:json_end].strip()
-            elif "{" in response and "}" in response:
-                json_start = response.find("{")
-                json_end = response.rfind("}") + 1
-                json_str = response[json_start:json_end]
-            else:
-                json_str = response
-
-            return json.loads(json_str)
-
-        except json.JSONDecodeError as e:
+            return extract_json(response)
+
+        except ValueError as e:
             print(f"⚠️ JSON parsing failed: {e}")
             return {
                 'error': 'JSON解析失败',
@@ -3,32 +3,290 @@ AI舌象分析Demo Web应用
 支持图片上传、AI分析、动画展示
 """
 
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import (Flask, Request, Response, abort, g, render_template, request, jsonify,
+                   send_from_directory, stream_with_context, url_for)
+import itertools
 import os
-import base64
-from datetime import datetime
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from admission import BATCH, DEMO, INTERACTIVE, AdmissionController
 from analyzer import TongueAnalyzer
+from batch import default_workers, follow_upgrades, iter_completed, iter_uploads, submit_all, summarize
+from cassette import get_cassette
+from content_store import ContentStore, Sweeper
+from deadline import Deadline, deadline_scope
+from derivatives import DerivativeStore
+from ingest import UploadRejected, ingest_image
+from job_queue import DONE as JOB_DONE, FAILED as JOB_FAILED, SQLiteJobQueue, create_queue
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, HTTP_REQUEST_SECONDS, REGISTRY
+from precomputed import PrecomputedResponse
+from progressive import (COMPLETE, FAILED, PENDING, PENDING_UPGRADE, ProgressiveAnalyzer, ResultStore,
+                         SQLiteResultStore)
+from response_encoding import FastJSONProvider, ResponseCache, compress_response, dumps
+from streaming import format_sse, result_events
+from tcm_knowledge import typical_report
+import profiling
+import tracing
+
+# 抽样剖析（PROFILE_SAMPLE_RATE / PROFILE_SLOW_SECONDS）覆盖的接口
+PROFILED_ENDPOINTS = {'analyze_tongue', 'analyze_tongue_stream'}
+
+# 批量分析（/api/analyze/batch）的限制：单张图片仍受 MAX_CONTENT_LENGTH 约束
+BATCH_MAX_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', '200'))
+BATCH_MAX_BYTES = int(os.getenv('BATCH_MAX_BYTES', str(512 * 1024 * 1024)))
+BATCH_WAIT_SECONDS = float(os.getenv('BATCH_WAIT_SECONDS', '120'))
+
+
+class TongueRequest(Request):
+    """批量接口允许更大的请求体，其余接口沿用 MAX_CONTENT_LENGTH"""
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'analyze_batch':
+            return BATCH_MAX_BYTES
+        return super().max_content_length
+
 
 app = Flask(__name__)
+app.request_class = TongueRequest
+app.json = FastJSONProvider(app)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads/tongues'
 
 # 确保上传目录存在
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# 初始化分析器 - 使用免费的智谱AI GLM-4V
-# 优先使用环境变量，如果没有则使用FreeTongueAnalyzer
-api_key = os.getenv('ZHIPU_API_KEY') or os.getenv('GLM_API_KEY')
 
-if api_key:
-    # 使用免费的智谱AI GLM-4V
-    from free_analyzer import FreeTongueAnalyzer
-    analyzer = FreeTongueAnalyzer()
-    print("✅ 使用智谱AI GLM-4V 免费分析器")
-else:
-    # 如果没有API密钥，使用规则引擎
-    analyzer = TongueAnalyzer()
-    print("⚠️  使用规则引擎模式")
+def _upload_store():
+    """上传图片的内容寻址存储（按内容哈希分片存放）"""
+    return ContentStore(app.config['UPLOAD_FOLDER'])
+
+
+def _derivative_store():
+    """派生图片（缩略图、模型输入、存档）存储（与原图同样按内容哈希分片）"""
+    if derivatives is not None and derivatives.store.root == _derivative_root():
+        return derivatives
+    return DerivativeStore(_derivative_root())
+
+
+def _derivative_root():
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'derivatives')
+
+
+# 进程级服务：分析器（含提供商客户端连接池）、任务队列和后台线程
+# 不在导入时创建：线程和连接不能跨 fork 使用，预派生模式下由每个 worker 在 fork 后各自创建
+analyzer = None
+progressive = None
+admission = None
+derivatives = None
+upload_sweeper = None
+_services_lock = threading.Lock()
+
+
+def create_analyzer():
+    """按环境变量创建分析器：有智谱AI密钥时使用免费的 GLM-4V，否则使用规则引擎"""
+    api_key = os.getenv('ZHIPU_API_KEY') or os.getenv('GLM_API_KEY')
+
+    if api_key:
+        # 使用免费的智谱AI GLM-4V
+        from free_analyzer import FreeTongueAnalyzer
+        instance = FreeTongueAnalyzer()
+        print("✅ 使用智谱AI GLM-4V 免费分析器")
+    else:
+        # 如果没有API密钥，使用规则引擎
+        instance = TongueAnalyzer()
+        print("⚠️  使用规则引擎模式")
+    return instance
+
+
+def init_services(sweep_uploads: bool = True):
+    """
+    创建本进程的服务（已存在的不重复创建）
+
+    Args:
+        sweep_uploads: 是否在本进程运行上传清理线程（多进程部署时只需一个进程运行）
+    """
+    global analyzer, progressive, admission, derivatives, upload_sweeper
+    with _services_lock:
+        if analyzer is None:
+            analyzer = create_analyzer()
+
+        if progressive is None:
+            # 渐进式分析：先返回本地报告，大模型分析作为任务入队，由工作线程执行后推送
+            # JOB_QUEUE=sqlite 时任务和结果都存放在 SQLite，多个 worker 进程共享
+            job_queue = create_queue()
+            progressive = ProgressiveAnalyzer(
+                analyzer,
+                store=SQLiteResultStore(job_queue.path) if isinstance(job_queue, SQLiteJobQueue) else ResultStore(),
+                job_queue=job_queue,
+                max_workers=int(os.getenv('JOB_WORKERS', '4'))
+            )
+
+        if admission is None:
+            # 准入控制：按进行中的分析数和最近耗时拒绝或降级新请求（ADMISSION_*）
+            admission = AdmissionController(backlog=progressive.queue.depth)
+
+        if derivatives is None:
+            # 上传保存后在后台生成缩略图、模型输入和存档版本（DERIVATIVE_WORKERS）
+            derivatives = DerivativeStore(_derivative_root(), int(os.getenv('DERIVATIVE_WORKERS', '2')))
+
+        if sweep_uploads and upload_sweeper is None:
+            # 后台按保留期清理过期的上传和派生图片（UPLOAD_RETENTION_DAYS / UPLOAD_GC_INTERVAL）
+            upload_sweeper = Sweeper([_upload_store(), _derivative_store().store]).start()
+
+
+def preload():
+    """
+    预加载只读状态（预派生模式下在主进程调用，fork 后各 worker 以写时复制共享）
+    """
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    # 回放模式下的 cassette 只读，加载一次即可
+    get_cassette()
+    precompute_demo()
+
+
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.before_request
+def _start_trace():
+    """API 请求开启追踪（TRACE_EXPORTER），沿用请求头 traceparent 中的追踪ID"""
+    if request.path.startswith('/api/'):
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        g.trace = tracing.start_trace(
+            f"{request.method} {route}", request.headers.get('traceparent'),
+            request_bytes=request.content_length
+        )
+
+
+@app.teardown_request
+def _finish_trace(error):
+    """结束并按采样导出追踪；stream_with_context 的流式响应在流结束后才到这里，生成阶段也计入追踪"""
+    trace = g.pop('trace', None)
+    if trace is not None:
+        trace.finish(f"{type(error).__name__}: {error}" if error else None)
+
+
+@app.before_request
+def _start_profile():
+    """分析接口按比例抽样剖析（或保留慢请求的剖析），结果写入 PROFILE_DIR"""
+    if request.endpoint not in PROFILED_ENDPOINTS:
+        return
+    profiler = profiling.get_profiler()
+    if profiler is not None:
+        trace = g.get('trace')
+        g.profiler = profiler
+        g.profile = profiler.begin(
+            method=request.method,
+            path=request.path,
+            endpoint=request.endpoint,
+            request_bytes=request.content_length,
+            trace_id=trace.trace_id if trace is not None else None
+        )
+
+
+@app.teardown_request
+def _finish_profile(error):
+    """流式响应在流结束后才结束剖析，生成阶段也计入"""
+    profile = g.pop('profile', None)
+    if profile is not None:
+        g.profiler.finish(
+            profile, status=g.get('profile_status'), error=f"{type(error).__name__}: {error}" if error else None
+        )
+
+
+@app.before_request
+def _ensure_services():
+    """开发服务器和测试中首次请求时创建服务"""
+    if analyzer is None or progressive is None or admission is None:
+        init_services()
+
+
+@app.after_request
+def _compress(response):
+    """按 Accept-Encoding 压缩 JSON 和页面响应（COMPRESS_MIN_BYTES 以下不压缩）"""
+    return compress_response(response, request)
+
+
+@app.after_request
+def _trace_header(response):
+    """响应头返回追踪ID，便于按ID查找慢请求的追踪"""
+    trace = g.get('trace')
+    if trace is not None:
+        trace.root.set(status=response.status_code)
+        if response.status_code >= 500:
+            trace.root.error = f"HTTP {response.status_code}"
+        response.headers['X-Trace-Id'] = trace.trace_id
+    return response
+
+
+@app.after_request
+def _profile_status(response):
+    if g.get('profile') is not None:
+        g.profile_status = response.status_code
+    return response
+
+
+@app.after_request
+def _record_latency(response):
+    """按路由模板（而不是实际路径）记录请求耗时，标签数量有界"""
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start, route=route, method=request.method, status=response.status_code
+        )
+    return response
+
+
+def _collect_service_metrics():
+    """导出时读取任务队列、请求合并、对冲和分级的统计"""
+    samples = []
+    if progressive is not None:
+        stats = progressive.queue_stats()
+        samples += [
+            ('tongue_job_queue_depth', 'gauge', '排队中的大模型升级任务数', [({}, stats['depth'])]),
+            ('tongue_job_running', 'gauge', '本进程执行中的任务数', [({}, stats['running'])]),
+            ('tongue_jobs_total', 'counter', '本进程执行结束的任务数',
+             [({'state': 'done'}, stats['done']), ({'state': 'failed'}, stats['failed'])]),
+            ('tongue_singleflight_total', 'counter', '相同图片升级请求的合并情况',
+             [({'result': name}, value) for name, value in sorted(progressive.flight.stats().items())])
+        ]
+    if admission is not None:
+        stats = admission.stats()
+        samples += [
+            ('tongue_admission_in_flight', 'gauge', '本进程进行中的分析请求数', [({}, stats['in_flight'])]),
+            ('tongue_admission_limit', 'gauge', '当前的并发分析上限（随最近耗时收缩）', [({}, stats['limit'])]),
+            ('tongue_admission_latency_seconds', 'gauge', '最近分析耗时的指数加权平均',
+             [({}, stats['latency_seconds'])])
+        ]
+    if analyzer is not None:
+        hedge = analyzer.hedge_stats() if hasattr(analyzer, 'hedge_stats') else {}
+        if hedge:
+            samples.append(('tongue_hedge_total', 'counter', '对冲请求统计', [
+                ({'kind': kind}, hedge[kind])
+                for kind in ('requests', 'hedged', 'primary_wins', 'hedge_wins', 'failures')
+            ]))
+        tiers = analyzer.tier_stats()['tiers'] if hasattr(analyzer, 'tier_stats') else {}
+        if tiers:
+            samples.append(('tongue_tier_requests_total', 'counter', '分级分析各层的请求数', [
+                ({'tier': tier}, info['count']) for tier, info in sorted(tiers.items())
+            ]))
+    return samples
+
+
+REGISTRY.register_collector(_collect_service_metrics)
+
+# 单个请求的时限预算（秒）：/api/analyze 和演示分析在此时间内必须返回，
+# 本地报告不可用时最多同步等待大模型到此为止，之后由前端继续轮询
+ANALYSIS_DEADLINE_SECONDS = float(os.getenv('ANALYSIS_DEADLINE_SECONDS', '8'))
+# 流式分析的时限预算（秒）：逐段推送，需要容纳大模型的完整生成
+STREAM_DEADLINE_SECONDS = float(os.getenv('STREAM_DEADLINE_SECONDS', '30'))
 
 
 @app.route('/')
@@ -43,101 +301,257 @@ def upload():
     return render_template('tongue_demo/index.html')
 
 
+# 演示页面的典型舌象案例（内容只随部署变化，页面和报告在启动时预先生成）
+DEMO_CASES = [
+    {
+        'id': 'healthy',
+        'name': '🌕 健康星球',
+        'emoji': '😊',
+        'description': '舌质淡红，舌苔薄白 · 完美的健康状态',
+        'score': 95,
+        'color': '#4CAF50',
+        'population': '2.3万',
+        'stories': '1,234'
+    },
+    {
+        'id': 'qi_deficiency',
+        'name': '🪐 气虚星球',
+        'emoji': '😮‍💨',
+        'description': '舌体胖大，舌边齿痕 · 需要补气健脾',
+        'score': 72,
+        'color': '#FFC107',
+        'population': '15.7万',
+        'stories': '8,901'
+    },
+    {
+        'id': 'blood_stasis',
+        'name': '🔴 血瘀星球',
+        'emoji': '😰',
+        'description': '舌质暗紫，有瘀点 · 活血化瘀进行中',
+        'score': 65,
+        'color': '#FF5722',
+        'population': '8.9万',
+        'stories': '5,678'
+    },
+    {
+        'id': 'yin_deficiency',
+        'name': '🌙 阴虚星球',
+        'emoji': '🥵',
+        'description': '舌红少苔，有裂纹 · 滋阴润燥社区',
+        'score': 68,
+        'color': '#FF9800',
+        'population': '11.2万',
+        'stories': '6,543'
+    },
+    {
+        'id': 'damp_heat',
+        'name': '🌑 湿热星球',
+        'emoji': '😓',
+        'description': '舌苔黄腻，舌质红 · 清热祛湿互助组',
+        'score': 60,
+        'color': '#F44336',
+        'population': '12.1万',
+        'stories': '9,876'
+    }
+]
+
+# 演示案例对应的体质（报告由规则引擎按典型舌象生成，不读取图片、不调用大模型）
+DEMO_CONSTITUTIONS = {
+    'healthy': '平和质',
+    'qi_deficiency': '气虚质',
+    'blood_stasis': '血瘀质',
+    'yin_deficiency': '阴虚质',
+    'damp_heat': '湿热质'
+}
+
+_demo_page = None
+_demo_reports = None
+
+
+def _json_bytes(payload):
+    return dumps(payload)
+
+
+def precompute_demo():
+    """
+    生成演示页面和演示报告的响应字节（已生成的不重复生成）
+
+    预派生模式下在主进程调用，各 worker 以写时复制共享
+    """
+    global _demo_page, _demo_reports
+    if _demo_page is None:
+        with app.app_context():
+            html = render_template('tongue_demo/demo.html', cases=DEMO_CASES)
+        _demo_page = PrecomputedResponse(html.encode('utf-8'), 'text/html')
+    if _demo_reports is None:
+        _demo_reports = {
+            case_id: PrecomputedResponse(
+                _json_bytes({'success': True, 'data': typical_report(constitution)}), 'application/json'
+            )
+            for case_id, constitution in DEMO_CONSTITUTIONS.items()
+        }
+
+
 @app.route('/demo')
 def demo():
     """演示页面 - 典型舌象案例"""
-    typical_cases = [
-        {
-            'id': 'healthy',
-            'name': '🌕 健康星球',
-            'emoji': '😊',
-            'description': '舌质淡红，舌苔薄白 · 完美的健康状态',
-            'score': 95,
-            'color': '#4CAF50',
-            'population': '2.3万',
-            'stories': '1,234'
-        },
-        {
-            'id': 'qi_deficiency',
-            'name': '🪐 气虚星球',
-            'emoji': '😮‍💨',
-            'description': '舌体胖大，舌边齿痕 · 需要补气健脾',
-            'score': 72,
-            'color': '#FFC107',
-            'population': '15.7万',
-            'stories': '8,901'
-        },
-        {
-            'id': 'blood_stasis',
-            'name': '🔴 血瘀星球',
-            'emoji': '😰',
-            'description': '舌质暗紫，有瘀点 · 活血化瘀进行中',
-            'score': 65,
-            'color': '#FF5722',
-            'population': '8.9万',
-            'stories': '5,678'
-        },
-        {
-            'id': 'yin_deficiency',
-            'name': '🌙 阴虚星球',
-            'emoji': '🥵',
-            'description': '舌红少苔，有裂纹 · 滋阴润燥社区',
-            'score': 68,
-            'color': '#FF9800',
-            'population': '11.2万',
-            'stories': '6,543'
-        },
-        {
-            'id': 'damp_heat',
-            'name': '🌑 湿热星球',
-            'emoji': '😓',
-            'description': '舌苔黄腻，舌质红 · 清热祛湿互助组',
-            'score': 60,
-            'color': '#F44336',
-            'population': '12.1万',
-            'stories': '9,876'
-        }
-    ]
-    return render_template('tongue_demo/demo.html', cases=typical_cases)
+    precompute_demo()
+    return _demo_page.respond(request)
 
 
-@app.route('/api/analyze', methods=['POST'])
-def analyze_tongue():
-    """
-    API: 分析上传的舌象图片
+def _overloaded(status_code, retry_after, reason):
+    """过载时的快速拒绝：429（该类流量的份额已满）或 503（整体满载），带 Retry-After"""
+    response = jsonify({'success': False, 'error': reason, 'retry_after': retry_after})
+    response.status_code = status_code
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def _rejected(ticket):
+    return _overloaded(ticket.status_code, ticket.retry_after, ticket.reason)
+
+
+def _save_upload():
     """
-    if 'tongue_image' not in request.files:
-        return jsonify({'success': False, 'error': '未上传图片'}), 400
+    校验并保存上传的舌象图片
+
+    支持两种上传方式：
+    - 原始请求体（Content-Type: image/* 或 application/octet-stream）：边接收边校验，
+      首块不是图片时立即拒绝，不读取剩余内容
+    - multipart 表单字段 tongue_image（Werkzeug 将较大的文件暂存到磁盘）
 
-    file = request.files['tongue_image']
+    Returns:
+        (文件路径, 内容哈希, 错误响应)，出错时前两项为None
+    """
+    if request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        stream = request.stream
+    else:
+        if 'tongue_image' not in request.files:
+            return None, None, (jsonify({'success': False, 'error': '未上传图片'}), 400)
 
-    if file.filename == '':
-        return jsonify({'success': False, 'error': '未选择文件'}), 400
+        file = request.files['tongue_image']
 
-    # 检查文件类型
-    allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-    if not ('.' in file.filename and
-            file.filename.rsplit('.', 1)[1].lower() in allowed_extensions):
-        return jsonify({'success': False, 'error': '不支持的文件格式'}), 400
+        if file.filename == '':
+            return None, None, (jsonify({'success': False, 'error': '未选择文件'}), 400)
+        stream = file.stream
 
+    # 按魔数识别格式、分块写入并计算哈希、检查像素预算，通过后按内容哈希保存
     try:
-        # 保存上传的文件
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"tongue_{timestamp}.{file.filename.rsplit('.', 1)[1].lower()}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        with tracing.span('ingest') as span:
+            filepath, digest, _ = ingest_image(stream, _upload_store(), max_bytes=app.config['MAX_CONTENT_LENGTH'])
+            span.set(image_bytes=os.path.getsize(filepath))
+    except UploadRejected as e:
+        return None, None, (jsonify({'success': False, 'error': str(e)}), e.status_code)
+
+    _derivative_store().submit(filepath)
+    return filepath, digest, None
+
+
+# 上传对象名 <内容哈希>.<扩展名>：同名文件内容不变，可长期缓存
+UPLOAD_NAME = re.compile(r'^([0-9a-f]{64})\.(png|jpg|jpeg|gif|webp)$')
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+
+def _image_urls(filepath):
+    """已保存图片的存档图和缩略图地址（用于显示）"""
+    filename = os.path.basename(filepath)
+    return {
+        'image_url': url_for('uploaded_image', filename=filename),
+        'thumbnail_url': url_for('uploaded_derivative', filename=filename, kind='thumbnail')
+    }
+
+
+def _send_immutable(path, etag):
+    """发送不可变文件：内容哈希作 ETag，If-None-Match 命中时返回 304"""
+    response = send_from_directory(os.path.dirname(path), os.path.basename(path), etag=etag, conditional=True)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE
+    return response
+
+
+def _send_derivative(filename, kind):
+    """发送派生图片（缺失时生成）；无法生成缩放版本（如GIF）时改发存档图"""
+    match = UPLOAD_NAME.match(filename)
+    if not match:
+        abort(404)
+
+    source = _upload_store().path_for(filename)
+    store = _derivative_store()
+    for candidate in (kind, 'archive'):
+        path = store.ensure(source, candidate)
+        if path is not None:
+            return _send_immutable(path, f"{match.group(1)}-{candidate}")
+    abort(404)
+
+
+@app.route('/api/images/<filename>')
+def uploaded_image(filename):
+    """
+    API: 上传的舌象图片（去除 EXIF 等元数据的存档版本，可被浏览器和CDN长期缓存）
+    """
+    return _send_derivative(filename, 'archive')
+
 
-        # AI分析
-        result = analyzer.analyze_image(filepath)
+@app.route('/api/images/<filename>/<any(thumbnail, model):kind>')
+def uploaded_derivative(filename, kind):
+    """
+    API: 上传图片的缩略图（WebP）或模型输入尺寸的 JPEG（首次请求时生成并缓存）
+    """
+    return _send_derivative(filename, kind)
 
-        # 添加图片URL（用于显示）
-        with open(filepath, 'rb') as img_file:
-            img_data = base64.b64encode(img_file.read()).decode('utf-8')
-            result['image_url'] = f"data:image/jpeg;base64,{img_data}"
+
+@app.route('/api/analyze', methods=['POST'])
+def analyze_tongue():
+    """
+    API: 分析上传的舌象图片
+
+    立即返回本地特征分类的报告（status=pending_upgrade），大模型分析作为任务入队，
+    完成后通过 /api/jobs/<job_id> 轮询或 /api/jobs/<job_id>/events 获取差异
+
+    超出容量时不读取上传内容，直接返回 429/503 和 Retry-After；大模型升级任务积压时
+    只返回本地报告（status=complete，degraded=true），不再入队
+    """
+    ticket = admission.acquire(INTERACTIVE)
+    if not ticket.admitted:
+        return _rejected(ticket)
+
+    deadline = Deadline(ANALYSIS_DEADLINE_SECONDS)
+    started = None
+    try:
+        filepath, digest, error = _save_upload()
+        if error:
+            return error
+
+        # 最近耗时只计处理时间，不含客户端上传的时间
+        started = time.perf_counter()
+        with deadline_scope(deadline):
+            result_id, report, status = progressive.start(filepath, digest, upgrade=not ticket.degraded)
+        version = 1
+
+        if status == FAILED:
+            # 降级时本地无法解析（如GIF），不能等待大模型
+            return _overloaded(503, admission.retry_after(), ticket.reason)
+
+        if report is None:
+            # 本地无法解析（如GIF），在剩余预算内等待大模型结果
+            view = progressive.store.wait(result_id, 0, timeout=deadline.remaining())
+            if view['status'] == FAILED:
+                return jsonify({'success': False, 'error': view['error']}), 500
+            status, version = view['status'], view['version']
+            report = view['diff']['changed'] if view['diff'] else None
+
+        data = None
+        if report is not None:
+            # 添加图片URL（用于显示）
+            data = dict(report, **_image_urls(filepath))
 
         return jsonify({
             'success': True,
-            'data': result
+            'job_id': result_id,
+            'result_id': result_id,
+            'status': status,
+            'version': version if data else 0,
+            'degraded': ticket.degraded,
+            'data': data
         })
 
     except Exception as e:
@@ -145,29 +559,277 @@ def analyze_tongue():
             'success': False,
             'error': str(e)
         }), 500
+    finally:
+        ticket.release(time.perf_counter() - started if started is not None else None)
 
 
-@app.route('/api/demo-analyze/<case_id>')
-def demo_analyze(case_id):
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
     """
-    API: 分析典型案例（用于演示）
+    API: 批量分析一次就诊的多张舌象图片
+
+    请求体为 multipart（多个 images 字段）、tar（可 gzip 压缩）或 zip。每张图片与
+    /api/analyze 走相同的流程：校验入库、本地报告、大模型升级任务入队。
+    响应为 NDJSON，每张图片本地报告完成即输出一行（event=report），升级结束再输出一行
+    （event=upgrade，查询参数 wait 为最长等待秒数，0 表示不等待），最后一行为汇总
+
+    批量流量的优先级低于交互上传，只能使用部分容量；升级任务积压时后续图片只返回本地报告
     """
+    ticket = admission.acquire(BATCH)
+    if not ticket.admitted:
+        return _rejected(ticket)
     try:
-        # 使用规则引擎生成对应的分析结果
-        fake_path = f"demo_{case_id}.jpg"
-        result = analyzer.analyze_image(fake_path)
+        response = app.make_response(_analyze_batch(ticket))
+    except BaseException:
+        ticket.release()
+        raise
+    if not response.is_streamed:
+        ticket.release()
+    else:
+        # NDJSON 逐行返回，最后一行发出或客户端断开时才归还容量
+        response.call_on_close(ticket.release)
+    return response
+
+
+def _analyze_batch(ticket):
+    """批量分析的处理过程（准入判断之后）"""
+    started = time.perf_counter()
+    wait_seconds = request.args.get('wait', BATCH_WAIT_SECONDS, type=float)
+    store = _upload_store()
+    derivative_store = _derivative_store()
+    max_bytes = app.config['MAX_CONTENT_LENGTH']
+
+    def ingest(stream):
+        filepath, digest, _ = ingest_image(stream, store, max_bytes=max_bytes)
+        derivative_store.submit(filepath)
+        return filepath, digest
+
+    def analyze(filepath, digest):
+        # 每张图片单独计算时限预算，从开始处理时算起；批量本身也会造成积压，逐张判断是否降级
+        with deadline_scope(Deadline(ANALYSIS_DEADLINE_SECONDS)):
+            result_id, report, status = progressive.start(filepath, digest, upgrade=not admission.backlogged())
+        if status == FAILED:
+            raise RuntimeError('大模型分析排队过多，本地无法解析的图片未分析')
+        return {'job_id': result_id, 'status': status, 'version': 1 if report is not None else 0, 'data': report}
+
+    files = []
+    if request.mimetype == 'multipart/form-data':
+        files = request.files.getlist('images') + request.files.getlist('tongue_image')
+
+    pool = ThreadPoolExecutor(max_workers=default_workers(), thread_name_prefix='batch')
+    try:
+        rejected, pending = submit_all(
+            iter_uploads(request.mimetype, request.stream, files), ingest, analyze, pool, BATCH_MAX_IMAGES
+        )
+    except UploadRejected as e:
+        pool.shutdown(cancel_futures=True)
+        return jsonify({'success': False, 'error': str(e)}), e.status_code
+    if not rejected and not pending:
+        pool.shutdown()
+        return jsonify({'success': False, 'error': '未上传图片'}), 400
 
-        return jsonify({
-            'success': True,
-            'data': result
-        })
+    def finish(line, filepath):
+        if line['data'] is not None:
+            line['data'] = dict(line['data'], **_image_urls(filepath))
+        return line
+
+    def generate():
+        lines = []
+        upgrading = {}
+        try:
+            for line in itertools.chain(rejected, iter_completed(pending, finish)):
+                lines.append(line)
+                if line['success'] and line['status'] in (PENDING, PENDING_UPGRADE):
+                    upgrading[line['job_id']] = line
+                yield dumps(dict(line, event='report')) + b'\n'
+        finally:
+            # 客户端中途断开时取消尚未开始的分析
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        for update in follow_upgrades(progressive.store, upgrading, wait_seconds):
+            yield dumps(dict(update, event='upgrade')) + b'\n'
+
+        summary = summarize(lines, time.perf_counter() - started)
+        summary['summary']['pending_upgrades'] = len(upgrading)
+        ticket.release()
+        yield dumps(summary) + b'\n'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+# 已结束的分析结果的响应缓存（按结果ID和客户端版本号）
+_finished_results = ResponseCache(int(os.getenv('RESULT_RESPONSE_CACHE', '512')), name='finished_results')
+
+
+@app.route('/api/jobs/<result_id>')
+@app.route('/api/results/<result_id>')
+def get_result(result_id):
+    """
+    API: 轮询分析任务的结果
+
+    查询参数 since 为客户端已有的版本号，只返回之后变化的字段；
+    job 字段为升级任务的状态（queued/running/done/failed）和排队、执行时刻
+    """
+    since = request.args.get('since', 0, type=int)
+    cached = _finished_results.get((result_id, since))
+    if cached is not None:
+        return cached.respond(request)
+
+    view = progressive.store.get(result_id, since)
+    if view is None:
+        return jsonify({'success': False, 'error': '结果不存在或已过期'}), 404
+    payload = dict(view, success=True, job_id=result_id, result_id=result_id,
+                   job=progressive.job_info(result_id))
+
+    # 已结束的结果不再变化：序列化和压缩一次，之后的轮询直接发送缓存的字节
+    job = payload['job']
+    if view['status'] in (COMPLETE, FAILED) and (job is None or job['state'] in (JOB_DONE, JOB_FAILED)):
+        cached = PrecomputedResponse(dumps(payload), 'application/json', cache_control='private, no-cache')
+        _finished_results.put((result_id, since), cached)
+        return cached.respond(request)
+    return jsonify(payload)
+
+
+@app.route('/api/queue/stats')
+def queue_stats():
+    """
+    API: 任务队列统计（队列深度、执行中任务数、排队和执行耗时分位数）
+    """
+    return jsonify({'success': True, 'data': progressive.queue_stats()})
+
+
+@app.route('/api/jobs/<result_id>/events')
+@app.route('/api/results/<result_id>/events')
+def result_events_stream(result_id):
+    """
+    API: 以SSE推送结果升级
+
+    每出现新版本推送一条 upgrade 事件（只含差异），结果结束时推送 done 事件
+    """
+    since = request.args.get('since', 0, type=int)
+    if progressive.store.get(result_id, since) is None:
+        return jsonify({'success': False, 'error': '结果不存在或已过期'}), 404
+
+    def generate():
+        version = since
+        deadline = time.monotonic() + 300
+        while time.monotonic() < deadline:
+            view = progressive.store.wait(result_id, version, timeout=15)
+            if view is None:
+                yield format_sse({'event': 'error', 'error': '结果已过期'})
+                return
+            if view['version'] > version:
+                version = view['version']
+                yield format_sse({
+                    'event': 'upgrade',
+                    'version': version,
+                    'status': view['status'],
+                    'diff': view['diff']
+                })
+            if view['status'] in (COMPLETE, FAILED):
+                yield format_sse({'event': 'done', 'status': view['status'], 'error': view['error']})
+                return
+            # 心跳，防止代理断开空闲连接
+            yield ': keep-alive\n\n'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
 
+
+@app.route('/api/analyze/stream', methods=['POST'])
+def analyze_tongue_stream():
+    """
+    API: 流式分析上传的舌象图片（Server-Sent Events）
+
+    每完成一个顶层字段推送一条 section 事件，最后推送 done 事件携带完整结果；
+    升级任务积压（大模型过载）时直接推送本地报告。
+    供需要逐段展示的API客户端使用；上传页使用 /api/analyze 的即时本地报告和后台升级
+    """
+    ticket = admission.acquire(INTERACTIVE)
+    if not ticket.admitted:
+        return _rejected(ticket)
+
+    deadline = Deadline(STREAM_DEADLINE_SECONDS)
+    try:
+        filepath, _, error = _save_upload()
+        if error:
+            ticket.release()
+            return error
     except Exception as e:
+        ticket.release()
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+    def events():
+        if ticket.degraded:
+            return result_events(progressive.classifier.analyze(filepath))
+        return analyzer.analyze_image_stream(filepath)
+
+    def generate():
+        try:
+            # 生成器在 Flask 视图返回后才执行，需在这里进入时限作用域
+            with deadline_scope(deadline):
+                for event in events():
+                    if event['event'] == 'done':
+                        event['result'].update(_image_urls(filepath))
+                    yield format_sse(event)
+        except Exception as e:
+            yield format_sse({'event': 'error', 'error': str(e)})
+        finally:
+            ticket.release()
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # 关闭Nginx缓冲，保证事件即时送达
+        }
+    )
+    response.call_on_close(ticket.release)
+    return response
+
+
+@app.route('/api/demo-analyze/<case_id>')
+def demo_analyze(case_id):
+    """
+    API: 分析典型案例（用于演示），返回启动时生成的报告
+
+    演示流量优先级最低，负载升高时最先被拒绝，把容量留给真实上传
+    """
+    ticket = admission.acquire(DEMO)
+    if not ticket.admitted:
+        return _rejected(ticket)
+    try:
+        precompute_demo()
+        cached = _demo_reports.get(case_id)
+        if cached is None:
+            return jsonify({
+                'success': False,
+                'error': '未知的演示案例'
+            }), 404
+        return cached.respond(request)
+    finally:
+        ticket.release()
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 文本格式的指标（预派生模式下为处理本次请求的 worker 的数据）"""
+    return Response(REGISTRY.expose(), content_type=METRICS_CONTENT_TYPE)
+
 
 @app.route('/report')
 def report():
@@ -192,8 +854,11 @@ if __name__ == '__main__':
     print("🔬 AI舌象分析Demo启动中...")
     print("=" * 60)
 
+    init_services()
+    preload()
+
     # 检测分析器类型
-    if api_key and hasattr(analyzer, '__class__') and analyzer.__class__.__name__ == 'FreeTongueAnalyzer':
+    if analyzer.__class__.__name__ == 'FreeTongueAnalyzer':
         print(f"📊 分析引擎: 智谱AI GLM-4V (免费)")
     elif hasattr(analyzer, 'use_mock') and analyzer.use_mock:
         print(f"📊 分析引擎: 规则引擎")
@@ -202,8 +867,10 @@ if __name__ == '__main__':
     else:
         print(f"📊 分析引擎: 未知")
 
-    print(f"🌐 访问地址: http://localhost:5001")
+    port = int(os.getenv('PORT', '5001'))
+    print(f"🌐 访问地址: http://localhost:{port}")
     print(f"📁 上传目录: {app.config['UPLOAD_FOLDER']}")
+    print("💡 生产环境请使用预派生多进程模式: python serve.py")
     print("=" * 60)
 
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    app.run(debug=True, host='0.0.0.0', port=port)
@@ -0,0 +1,201 @@
+"""
+批量分析
+一次请求上传一次就诊的全部照片（multipart 多个文件、tar 或 zip 包），逐张校验入库后
+交给特征提取线程池，哪张先完成就先以 NDJSON 行返回；大模型升级仍走任务队列，
+并发受队列工作线程数（JOB_WORKERS）限制，升级结束后再追加一行
+
+环境变量：
+    BATCH_MAX_IMAGES=200       单次批量的图片数上限
+    BATCH_MAX_BYTES=536870912  批量请求体上限（字节）
+    BATCH_WORKERS=4            特征提取线程数（默认取 CPU 核数，最多 8）
+    BATCH_WAIT_SECONDS=120     返回本地报告后继续等待大模型升级的时间（0 表示不等待）
+"""
+
+import os
+import posixpath
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from ingest import UploadRejected
+from progressive import COMPLETE, FAILED
+
+TAR_TYPES = {'application/x-tar', 'application/gzip', 'application/x-gzip', 'application/x-gtar'}
+ZIP_TYPES = {'application/zip', 'application/x-zip-compressed'}
+
+# zip 的目录在文件末尾，必须先落盘；小包留在内存
+_ZIP_SPOOL_BYTES = 8 * 1024 * 1024
+
+
+def default_workers() -> int:
+    return int(os.getenv('BATCH_WORKERS', str(min(8, os.cpu_count() or 4))))
+
+
+def _skipped(name: str) -> bool:
+    """目录、隐藏文件和 macOS 压缩时附带的元数据"""
+    base = posixpath.basename(name)
+    return not base or base.startswith('.') or name.startswith('__MACOSX/')
+
+
+def iter_tar(stream: BinaryIO) -> Iterator[Tuple[str, BinaryIO]]:
+    """按顺序读取 tar（可 gzip 压缩）中的文件，不需要整个包落盘"""
+    with tarfile.open(fileobj=stream, mode='r|*') as archive:
+        for member in archive:
+            if member.isfile() and not _skipped(member.name):
+                yield member.name, archive.extractfile(member)
+
+
+def iter_zip(stream: BinaryIO) -> Iterator[Tuple[str, BinaryIO]]:
+    """读取 zip 中的文件（先写入临时文件，zip 需要随机访问）"""
+    with tempfile.SpooledTemporaryFile(max_size=_ZIP_SPOOL_BYTES) as spool:
+        shutil.copyfileobj(stream, spool, 1024 * 1024)
+        spool.seek(0)
+        with zipfile.ZipFile(spool) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and not _skipped(info.filename):
+                    with archive.open(info) as member:
+                        yield info.filename, member
+
+
+def iter_uploads(mimetype: str, stream: BinaryIO, files: Iterable[Any]) -> Iterator[Tuple[str, BinaryIO]]:
+    """
+    按请求类型枚举上传的图片
+
+    Args:
+        mimetype: 请求的内容类型
+        stream: 请求体（tar / zip）
+        files: multipart 中的文件（FileStorage）
+
+    Raises:
+        UploadRejected: 不支持的请求类型（415）或压缩包损坏（400）
+    """
+    try:
+        if mimetype in TAR_TYPES:
+            yield from iter_tar(stream)
+        elif mimetype in ZIP_TYPES:
+            yield from iter_zip(stream)
+        elif mimetype == 'multipart/form-data':
+            for file in files:
+                if file.filename:
+                    yield file.filename, file.stream
+        else:
+            raise UploadRejected('请以 multipart 表单、tar 或 zip 上传图片', 415)
+    except (tarfile.TarError, zipfile.BadZipFile) as e:
+        raise UploadRejected(f'压缩包无法读取: {e}', 400)
+
+
+def submit_all(
+    uploads: Iterable[Tuple[str, BinaryIO]],
+    ingest: Callable[[BinaryIO], Tuple[str, str]],
+    analyze: Callable[[str, str], Dict[str, Any]],
+    pool: ThreadPoolExecutor,
+    max_images: int
+) -> Tuple[List[Dict[str, Any]], Dict[Future, Tuple[int, str, str]]]:
+    """
+    逐张校验入库并提交分析：接收后面的图片时，前面的已经在线程池中提取特征
+
+    在开始返回响应前读完请求体：边上传边下发结果时，不读响应的客户端会与服务端互相阻塞
+
+    Args:
+        uploads: (文件名, 内容流)
+        ingest: 校验并保存一张图片，返回 (路径, 内容哈希)；抛出 UploadRejected 表示该张被拒
+        analyze: 分析已保存的图片，返回结果字段
+        pool: 分析线程池
+        max_images: 图片数上限，超出的部分不再读取
+
+    Returns:
+        (被拒绝图片的结果行, 分析中的任务 -> (序号, 文件名, 路径))
+    """
+    rejected: List[Dict[str, Any]] = []
+    pending: Dict[Future, Tuple[int, str, str]] = {}
+    for index, (filename, stream) in enumerate(uploads):
+        if index >= max_images:
+            rejected.append({'index': index, 'filename': filename, 'success': False,
+                             'error': f'超过单次批量上限 {max_images} 张，其余图片未处理'})
+            break
+        try:
+            filepath, digest = ingest(stream)
+        except UploadRejected as e:
+            rejected.append({'index': index, 'filename': filename, 'success': False, 'error': str(e)})
+            continue
+        pending[pool.submit(analyze, filepath, digest)] = (index, filename, filepath)
+    return rejected, pending
+
+
+def iter_completed(
+    pending: Dict[Future, Tuple[int, str, str]],
+    finish: Callable[[Dict[str, Any], str], Dict[str, Any]]
+) -> Iterator[Dict[str, Any]]:
+    """
+    按完成顺序产出分析结果
+
+    Args:
+        pending: submit_all 返回的分析中任务
+        finish: 在调用方线程中补充结果行（如生成图片地址），参数为 (结果行, 图片路径)
+
+    Yields:
+        每张图片一行：{'index', 'filename', 'success', ...}
+    """
+    for future in as_completed(list(pending)):
+        index, filename, filepath = pending.pop(future)
+        try:
+            line = finish(dict(future.result(), index=index, filename=filename, success=True), filepath)
+        except Exception as e:
+            line = {'index': index, 'filename': filename, 'success': False, 'error': str(e)}
+        yield line
+
+
+def follow_upgrades(
+    store: Any,
+    pending: Dict[str, Dict[str, Any]],
+    timeout: float,
+    poll_interval: float = 0.2
+) -> Iterator[Dict[str, Any]]:
+    """
+    等待批量中各张图片的大模型升级，哪张结束就产出哪张
+
+    Args:
+        store: 结果存储（ResultStore / SQLiteResultStore）
+        pending: 结果ID -> 该图片已返回的行（含 index、filename、version）
+        timeout: 最长等待时间（秒）
+        poll_interval: 轮询间隔（秒）
+
+    Yields:
+        升级结束的图片：{'index', 'filename', 'job_id', 'status', 'version', 'data' 或 'error'}
+    """
+    deadline = time.monotonic() + timeout
+    while pending:
+        for result_id in list(pending):
+            line = pending[result_id]
+            view = store.get(result_id, 0)
+            if view is None or view['status'] not in (COMPLETE, FAILED):
+                continue
+            del pending[result_id]
+            update = {'index': line['index'], 'filename': line['filename'], 'job_id': result_id,
+                      'status': view['status'], 'version': view['version']}
+            if view['version'] > line['version'] and view['diff'] is not None:
+                update['data'] = view['diff']['changed']
+            if view['error']:
+                update['error'] = view['error']
+            yield update
+
+        remaining = deadline - time.monotonic()
+        if not pending or remaining <= 0:
+            return
+        time.sleep(min(poll_interval, remaining))
+
+
+def summarize(lines: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    """批量结束时的汇总行"""
+    return {
+        'summary': {
+            'images': len(lines),
+            'succeeded': sum(1 for line in lines if line.get('success')),
+            'failed': sum(1 for line in lines if not line.get('success')),
+            'elapsed_ms': round(elapsed * 1000, 1)
+        }
+    }
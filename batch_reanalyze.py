@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+批量重分析工具 - 离线对已上传的舌象图片重新生成报告
+多张图片打包进一次 DeepSeek 请求，分摊提示词开销和网络往返
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from analyzer import TongueAnalyzer
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+
+
+def find_images(directory: str):
+    """列出目录（含按内容哈希分片的子目录，不含派生图片）下的所有图片（按路径排序）"""
+    images = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [name for name in dirs if name not in ('thumbnails', 'derivatives')]
+        images.extend(os.path.join(root, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量重分析舌象图片（DeepSeek 批量模式）')
+    parser.add_argument('directory', nargs='?', default='uploads/tongues', help='图片目录')
+    parser.add_argument('--batch-size', type=int, default=8, help='每次请求打包的图片数')
+    parser.add_argument('--suffix', default='_deepseek_analysis.json', help='结果文件后缀')
+    parser.add_argument('--skip-existing', action='store_true', help='跳过已有结果的图片')
+    args = parser.parse_args()
+
+    images = find_images(args.directory)
+    if args.skip_existing:
+        images = [
+            path for path in images
+            if not os.path.exists(path.rsplit('.', 1)[0] + args.suffix)
+        ]
+
+    if not images:
+        print("⚠️  没有需要分析的图片")
+        sys.exit(0)
+
+    print(f"📸 待分析图片: {len(images)} 张，每批 {args.batch_size} 张")
+
+    analyzer = TongueAnalyzer(provider="deepseek")
+    start = time.time()
+    results = analyzer.analyze_batch(images, batch_size=args.batch_size)
+    elapsed = time.time() - start
+
+    for path, result in results.items():
+        output_file = path.rsplit('.', 1)[0] + args.suffix
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    stats = analyzer.last_batch_stats
+    print("=" * 60)
+    print(f"✅ 完成 {len(results)} 张，耗时 {elapsed:.1f}s")
+    print(f"   请求次数: {stats['requests']}（拆分重试 {stats['splits']} 次）")
+    if stats['fallbacks']:
+        print(f"   ⚠️  提供商不可用，{stats['fallbacks']} 张回退为本地报告")
+    print(f"   Token用量: 输入 {stats['prompt_tokens']}，输出 {stats['completion_tokens']}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+本地体质分类器基准测试
+以已保存的LLM报告（*_free_analysis.json 等）为参照，统计本地分类器的
+Top-1/Top-3 一致率、校准误差（ECE）和单张耗时；可选拟合 softmax 温度
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from batch_reanalyze import find_images
+from constitution_classifier import ConstitutionClassifier, ranked_constitutions, softmax
+from tcm_knowledge import CONSTITUTIONS, normalize_constitution
+
+REPORT_SUFFIXES = (
+    '_free_analysis.json',
+    '_deepseek_analysis.json',
+    '_professional_analysis.json',
+    '_analysis.json',
+)
+
+
+def reference_label(image_path: str) -> Optional[str]:
+    """读取图片对应的LLM报告，返回标准化的主体质；没有报告时返回 None"""
+    base = image_path.rsplit('.', 1)[0]
+    for suffix in REPORT_SUFFIXES:
+        report_file = base + suffix
+        if not os.path.exists(report_file):
+            continue
+        with open(report_file, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+        # 专业版报告的体质在 tcm_diagnosis 下
+        constitution = report.get('constitution') or report.get('tcm_diagnosis', {}).get('constitution') or {}
+        label = normalize_constitution(constitution.get('primary', ''))
+        if label in CONSTITUTIONS:
+            return label
+    return None
+
+
+def expected_calibration_error(samples: List[Tuple[float, bool]], bins: int = 10) -> float:
+    """ECE：按置信度分桶，比较平均置信度与实际一致率"""
+    total = len(samples)
+    error = 0.0
+    for i in range(bins):
+        low, high = i / bins, (i + 1) / bins
+        bucket = [(c, ok) for c, ok in samples if low < c <= high]
+        if not bucket:
+            continue
+        confidence = sum(c for c, _ in bucket) / len(bucket)
+        accuracy = sum(ok for _, ok in bucket) / len(bucket)
+        error += len(bucket) / total * abs(confidence - accuracy)
+    return error
+
+
+def fit_temperature(logits_list: List[Dict[str, float]], labels: List[str]) -> float:
+    """网格搜索使负对数似然最小的温度"""
+    best_t, best_nll = 1.0, float('inf')
+    for step in range(5, 51):
+        t = step / 10
+        nll = -sum(math.log(max(1e-12, softmax(logits, t)[label])) for logits, label in zip(logits_list, labels))
+        if nll < best_nll:
+            best_t, best_nll = t, nll
+    return best_t
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地体质分类器基准测试（对照已保存的LLM报告）')
+    parser.add_argument('directory', nargs='?', default='uploads/tongues', help='图片目录')
+    parser.add_argument('--fit-temperature', action='store_true', help='拟合 softmax 温度')
+    args = parser.parse_args()
+
+    classifier = ConstitutionClassifier()
+    pairs = [(path, reference_label(path)) for path in find_images(args.directory)]
+    pairs = [(path, label) for path, label in pairs if label]
+
+    if not pairs:
+        print("⚠️  没有找到带LLM报告的图片")
+        sys.exit(0)
+
+    print(f"📸 参照样本: {len(pairs)} 张（温度 {classifier.temperature}）")
+
+    latencies: List[float] = []
+    calibration: List[Tuple[float, bool]] = []
+    logits_list: List[Dict[str, float]] = []
+    labels: List[str] = []
+    top1 = top3 = 0
+
+    for path, label in pairs:
+        start = time.perf_counter()
+        features = classifier.extractor.extract_features(path)
+        classification = classifier.classify(features)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        ranked = ranked_constitutions(classification['probabilities'])
+        top1 += ranked[0] == label
+        top3 += label in ranked[:3]
+        calibration.append((classification['confidence'], ranked[0] == label))
+
+        logits_list.append(classification['logits'])
+        labels.append(label)
+
+    n = len(pairs)
+    print("=" * 60)
+    print(f"Top-1 一致率: {top1 / n:.1%}")
+    print(f"Top-3 一致率: {top3 / n:.1%}")
+    print(f"ECE: {expected_calibration_error(calibration):.3f}")
+    print(f"耗时: p50 {percentile(latencies, 0.5):.1f}ms，p95 {percentile(latencies, 0.95):.1f}ms")
+
+    if args.fit_temperature:
+        t = fit_temperature(logits_list, labels)
+        print(f"🌡️  建议温度: CLASSIFIER_TEMPERATURE={t}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+响应序列化与压缩基准测试
+以各体质的典型报告为样本，对比 Flask 默认编码器（sort_keys、ASCII 转义）与
+response_encoding.dumps 的耗时和体积，以及 gzip / brotli 各级别的压缩耗时和节省的字节
+"""
+
+import argparse
+import json
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from response_encoding import brotli, compress, dumps, orjson
+from tcm_knowledge import CONSTITUTIONS, typical_report
+
+
+def sample_payloads() -> List[Dict[str, Any]]:
+    """与 /api/analyze 响应结构相同的样本"""
+    return [
+        {'success': True, 'data': dict(typical_report(name), image_url='/api/images/' + 'a' * 64 + '.jpg')}
+        for name in CONSTITUTIONS
+    ]
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> float:
+    """单次调用的平均耗时（秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def flask_default(obj: Any) -> bytes:
+    # Flask DefaultJSONProvider 的默认参数
+    return json.dumps(obj, ensure_ascii=True, sort_keys=True).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='响应序列化与压缩基准测试')
+    parser.add_argument('--repeat', type=int, default=500, help='每项重复次数')
+    args = parser.parse_args()
+
+    payloads = sample_payloads()
+
+    print("=" * 64)
+    print(f"序列化（{len(payloads)} 份报告，orjson {'已安装' if orjson else '未安装，使用标准库'}）")
+    print("-" * 64)
+    print(f"{'编码器':<20}{'平均字节':>12}{'平均耗时':>14}")
+    serializers = [('Flask 默认', flask_default), ('response_encoding', dumps)]
+    bodies: Dict[str, List[bytes]] = {}
+    for name, fn in serializers:
+        bodies[name] = [fn(p) for p in payloads]
+        seconds = sum(measure(lambda p=p: fn(p), args.repeat) for p in payloads) / len(payloads)
+        size = sum(len(b) for b in bodies[name]) / len(payloads)
+        print(f"{name:<20}{size:>12.0f}{seconds * 1e6:>12.1f}µs")
+
+    print("=" * 64)
+    print(f"压缩（brotli {'已安装' if brotli else '未安装'}）")
+    print("-" * 64)
+    print(f"{'编码':<20}{'平均字节':>12}{'节省':>8}{'平均耗时':>14}")
+    encodings: List[Tuple[str, int]] = [('gzip', 1), ('gzip', 6), ('gzip', 9)]
+    if brotli is not None:
+        encodings += [('br', 4), ('br', 11)]
+
+    for source in ('Flask 默认', 'response_encoding'):
+        originals = bodies[source]
+        original = sum(len(b) for b in originals) / len(originals)
+        print(f"{source + ' 未压缩':<20}{original:>12.0f}{'':>8}{'':>14}")
+        for encoding, level in encodings:
+            compressed = [compress(b, encoding, level) for b in originals]
+            size = sum(len(c) for c in compressed) / len(compressed)
+            repeat = max(1, args.repeat // (20 if level >= 9 else 1))
+            seconds = sum(measure(lambda b=b: compress(b, encoding, level), repeat) for b in originals) / len(originals)
+            label = f"  {encoding}-{level}"
+            print(f"{label:<20}{size:>12.0f}{1 - size / original:>8.1%}{seconds * 1e6:>12.1f}µs")
+    print("=" * 64)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+开发服务器与预派生生产服务的对比压测
+启动本地桩大模型服务，依次以 `python app.py`（单进程开发服务器）和
+`python serve.py --workers N` 启动应用，用 load_test 以相同的RPS和场景发压，
+打印两者的延迟分位数和吞吐量
+
+用法：
+    python benchmark_server.py --workers 4 --rps 40 --duration 20 --mix analyze:1,demo-analyze:3,demo:1
+"""
+
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Dict, List, Tuple
+
+from load_test import LoadGenerator, Results, parse_mix, percentile, print_report, sample_image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url: str, timeout: float = 30.0):
+    """等待服务可以响应请求"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=2):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"服务未能在 {timeout:.0f}s 内启动: {url}")
+            time.sleep(0.2)
+
+
+def start(command: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    # 独立进程组：结束时连同 worker 子进程一起停止
+    return subprocess.Popen(
+        command, cwd=HERE, env=env, start_new_session=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def stop(process: subprocess.Popen):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=40)
+    except ProcessLookupError:
+        pass
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def run_target(name: str, command: List[str], env: Dict[str, str], port: int,
+               mix: Dict[str, float], image: bytes, rps: float, duration: float) -> Tuple[Results, float]:
+    """启动一种服务并发压，返回压测结果"""
+    print(f"\n▶️  {name}: {' '.join(command)}")
+    process = start(command, env)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        wait_ready(f"{base_url}/api/demo-analyze/healthy")
+        generator = LoadGenerator(base_url, mix, image=image)
+        elapsed = generator.run(rps, duration)
+        print_report(generator.results, elapsed)
+        return generator.results, elapsed
+    finally:
+        stop(process)
+
+
+def print_comparison(rows: List[Tuple[str, Results, float]]):
+    print("\n" + "=" * 72)
+    print(f"{'服务':<18}{'吞吐/s':>9}{'错误率':>8}{'p50':>10}{'p90':>10}{'p99':>10}")
+    print("-" * 72)
+    for name, results, elapsed in rows:
+        latencies = [v for values in results.latencies.values() for v in values]
+        errors = sum(sum(e.values()) for e in results.errors.values())
+        if not latencies:
+            print(f"{name:<18}{'无数据':>9}")
+            continue
+        print(
+            f"{name:<18}{len(latencies) / elapsed:>9.1f}{errors / len(latencies):>8.1%}"
+            f"{percentile(latencies, 0.5) * 1000:>8.0f}ms{percentile(latencies, 0.9) * 1000:>8.0f}ms"
+            f"{percentile(latencies, 0.99) * 1000:>8.0f}ms"
+        )
+    print("=" * 72)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='开发服务器与预派生服务对比压测')
+    parser.add_argument('--workers', type=int, default=4, help='预派生服务的 worker 数')
+    parser.add_argument('--rps', type=float, default=40, help='目标每秒请求数')
+    parser.add_argument('--duration', type=float, default=20, help='每种服务的发压时长（秒）')
+    parser.add_argument('--mix', default='analyze:1,demo-analyze:3,demo:1', help='场景权重')
+    parser.add_argument('--latency', default='lognormal:2.0,0.5', help='桩大模型服务的延迟分布')
+    args = parser.parse_args()
+
+    stub_port = free_port()
+    stub = subprocess.Popen(
+        [sys.executable, 'stub_llm_server.py', '--port', str(stub_port), '--latency', args.latency],
+        cwd=HERE, start_new_session=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    env = dict(os.environ, DEEPSEEK_BASE_URL=f"http://127.0.0.1:{stub_port}", DEEPSEEK_API_KEY='stub')
+
+    mix = parse_mix(args.mix)
+    image = sample_image() if 'analyze' in mix else None
+    rows = []
+    try:
+        port = free_port()
+        results, elapsed = run_target(
+            '开发服务器', [sys.executable, 'app.py'], dict(env, PORT=str(port)),
+            port, mix, image, args.rps, args.duration
+        )
+        rows.append(('开发服务器', results, elapsed))
+
+        port = free_port()
+        name = f"预派生 ×{args.workers}"
+        results, elapsed = run_target(
+            name, [sys.executable, 'serve.py', '--host', '127.0.0.1', '--port', str(port),
+                   '--workers', str(args.workers)],
+            env, port, mix, image, args.rps, args.duration
+        )
+        rows.append((name, results, elapsed))
+    finally:
+        stop(stub)
+
+    print_comparison(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+提供商调用的录制/回放（cassette）
+录制模式下把每次请求/响应（含流式分片和原始耗时）追加到压缩的 JSON Lines 文件；
+回放模式下不访问网络，按请求内容匹配并返回录制的响应，可选按原始耗时等待。
+用于在断网的构建机上用真实响应数据可重复地做端到端性能测试
+
+环境变量：
+    CASSETTE_MODE=record|replay    默认关闭
+    CASSETTE_PATH=cassettes/providers.jsonl.gz
+    CASSETTE_TIMING=instant|recorded   回放时是否按录制的耗时等待
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+OFF = 'off'
+RECORD = 'record'
+REPLAY = 'replay'
+
+DEFAULT_PATH = 'cassettes/providers.jsonl.gz'
+
+# 超过该长度的字符串（如 base64 图片）在录制的请求中只保留摘要
+_MAX_INLINE = 512
+
+
+class CassetteMissError(KeyError):
+    """回放时找不到匹配的录制"""
+
+
+class ReplayedError(RuntimeError):
+    """回放录制时的提供商错误（保留状态码，重试与熔断逻辑照常生效）"""
+
+    def __init__(self, error_type: str, message: str, status_code: Optional[int] = None):
+        super().__init__(f"{error_type}: {message}")
+        self.error_type = error_type
+        self.status_code = status_code
+
+
+def to_plain(obj: Any) -> Any:
+    """把SDK响应对象转换为可JSON序列化的结构"""
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    if isinstance(obj, dict):
+        return {str(k): to_plain(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_plain(v) for v in obj]
+    if hasattr(obj, 'model_dump'):
+        return to_plain(obj.model_dump())
+    if hasattr(obj, '__dict__'):
+        return {k: to_plain(v) for k, v in vars(obj).items() if not k.startswith('_')}
+    return repr(obj)
+
+
+class Replayed(dict):
+    """回放的响应：同时支持 response.choices[0].message.content 和 response['choices'] 两种访问"""
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def from_plain(obj: Any) -> Any:
+    """把录制的结构还原为支持属性访问的对象"""
+    if isinstance(obj, dict):
+        return Replayed({k: from_plain(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return [from_plain(v) for v in obj]
+    return obj
+
+
+def _compact(obj: Any) -> Any:
+    """压缩请求：长字符串替换为摘要，保证cassette体积小"""
+    if isinstance(obj, str) and len(obj) > _MAX_INLINE:
+        return f"<sha256:{hashlib.sha256(obj.encode('utf-8')).hexdigest()[:16]} len={len(obj)}>"
+    if isinstance(obj, dict):
+        return {k: _compact(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_compact(v) for v in obj]
+    if obj is None or isinstance(obj, (int, float, bool)):
+        return obj
+    return f"<{type(obj).__name__}>"
+
+
+def request_key(provider: str, fn: Callable, args: Tuple, kwargs: Dict[str, Any]) -> Tuple[str, str, Any]:
+    """
+    计算请求的匹配键
+
+    Returns:
+        (键, 方法名, 压缩后的请求)
+    """
+    # 只用方法名：提供商名已区分SDK，SDK内部类名随版本变化时录制仍可用
+    method = getattr(fn, '__name__', type(fn).__name__)
+    # 位置参数中的客户端对象等只保留类型名；超时随剩余预算变化，不参与匹配
+    kwargs = {k: v for k, v in kwargs.items() if k != 'timeout'}
+    request = {'args': _compact(list(args)), 'kwargs': _compact(kwargs)}
+    payload = json.dumps([provider, method, request], ensure_ascii=False, sort_keys=True, default=repr)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest(), method, request
+
+
+class Cassette:
+    """录制/回放提供商调用"""
+
+    def __init__(self, path: str = DEFAULT_PATH, mode: str = OFF, timing: str = 'instant'):
+        """
+        Args:
+            path: cassette 文件路径（gzip 压缩的 JSON Lines）
+            mode: 'off'、'record' 或 'replay'
+            timing: 回放时 'instant'（不等待）或 'recorded'（按录制的耗时等待）
+        """
+        self.path = path
+        self.mode = mode
+        self.timing = timing
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[str, int] = {}
+
+        if mode == REPLAY:
+            self._load()
+        elif mode == RECORD:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def call(self, provider: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """按当前模式调用提供商（关闭时直接调用）"""
+        if self.mode == OFF:
+            return fn(*args, **kwargs)
+
+        key, method, request = request_key(provider, fn, args, kwargs)
+        if self.mode == REPLAY:
+            return self._replay(key, method)
+        return self._record(key, provider, method, request, fn, args, kwargs)
+
+    # ---- 录制 ----
+
+    def _record(self, key, provider, method, request, fn, args, kwargs) -> Any:
+        entry = {'key': key, 'provider': provider, 'method': method, 'request': request}
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            entry['latency'] = time.perf_counter() - start
+            entry['error'] = {
+                'type': type(e).__name__,
+                'message': str(e),
+                'status_code': getattr(e, 'status_code', None)
+            }
+            self._append(entry)
+            raise
+
+        entry['latency'] = time.perf_counter() - start
+        if kwargs.get('stream') is True:
+            return _RecordingStream(self, entry, result)
+        if method == 'stream':
+            return _RecordingStreamManager(self, entry, result)
+
+        entry['response'] = to_plain(result)
+        self._append(entry)
+        return result
+
+    def _append(self, entry: Dict[str, Any]):
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self._lock:
+            # 每条记录写成独立的 gzip 成员，进程中途退出也不会损坏已有记录
+            with gzip.open(self.path, 'at', encoding='utf-8') as f:
+                f.write(line)
+
+    # ---- 回放 ----
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"cassette 不存在: {self.path}")
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry['key'], []).append(entry)
+        count = sum(len(v) for v in self._entries.values())
+        print(f"📼 已加载 cassette: {self.path}（{count} 条录制）")
+
+    def _next_entry(self, key: str, method: str) -> Dict[str, Any]:
+        """同一请求录制了多次时按顺序轮流返回（如重试前后的响应）"""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMissError(f"cassette 中没有匹配的录制: {method} ({key[:12]})")
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+            return entries[index % len(entries)]
+
+    def _replay(self, key: str, method: str) -> Any:
+        entry = self._next_entry(key, method)
+        self._wait(entry['latency'])
+
+        if 'error' in entry:
+            error = entry['error']
+            raise ReplayedError(error['type'], error['message'], error.get('status_code'))
+        if 'chunks' in entry:
+            return _ReplayedStream(self, entry['chunks'])
+        if 'texts' in entry:
+            return _ReplayedStreamManager(self, entry['texts'])
+        return from_plain(entry['response'])
+
+    def _wait(self, seconds: float):
+        if self.timing == 'recorded' and seconds > 0:
+            time.sleep(seconds)
+
+
+class _RecordingStream:
+    """录制 chat.completions 流式分片，完整读完后写入 cassette"""
+
+    def __init__(self, cassette: Cassette, entry: Dict[str, Any], stream: Any):
+        self.cassette = cassette
+        self.entry = entry
+        self.stream = stream
+
+    def __iter__(self) -> Iterator[Any]:
+        chunks = []
+        last = time.perf_counter()
+        for chunk in self.stream:
+            now = time.perf_counter()
+            chunks.append([now - last, to_plain(chunk)])
+            last = now
+            yield chunk
+        # 被取消（如对冲落败）的流不完整，不录制
+        self.entry['chunks'] = chunks
+        self.cassette._append(self.entry)
+
+    def close(self):
+        close = getattr(self.stream, 'close', None)
+        if close:
+            close()
+
+
+class _RecordingStreamManager:
+    """录制 Anthropic messages.stream 的文本流"""
+
+    def __init__(self, cassette: Cassette, entry: Dict[str, Any], manager: Any):
+        self.cassette = cassette
+        self.entry = entry
+        self.manager = manager
+        self._texts: List[List[Any]] = []
+        self._complete = False
+
+    def __enter__(self):
+        stream = self.manager.__enter__()
+        recorder = self
+
+        class _Stream:
+            @property
+            def text_stream(self):
+                last = time.perf_counter()
+                for text in stream.text_stream:
+                    now = time.perf_counter()
+                    recorder._texts.append([now - last, text])
+                    last = now
+                    yield text
+                recorder._complete = True
+
+        return _Stream()
+
+    def __exit__(self, *exc):
+        result = self.manager.__exit__(*exc)
+        if self._complete:
+            self.entry['texts'] = self._texts
+            self.cassette._append(self.entry)
+        return result
+
+
+class _ReplayedStream:
+    """回放 chat.completions 流式分片"""
+
+    def __init__(self, cassette: Cassette, chunks: List[List[Any]]):
+        self.cassette = cassette
+        self.chunks = chunks
+        self._closed = False
+
+    def __iter__(self) -> Iterator[Any]:
+        for delay, chunk in self.chunks:
+            if self._closed:
+                return
+            self.cassette._wait(delay)
+            yield from_plain(chunk)
+
+    def close(self):
+        self._closed = True
+
+
+class _ReplayedStreamManager:
+    """回放 Anthropic messages.stream"""
+
+    def __init__(self, cassette: Cassette, texts: List[List[Any]]):
+        self.cassette = cassette
+        self.texts = texts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def text_stream(self) -> Iterator[str]:
+        for delay, text in self.texts:
+            self.cassette._wait(delay)
+            yield text
+
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Cassette:
+    """进程内共享的 cassette（按环境变量配置）"""
+    global _cassette
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(
+                path=os.getenv('CASSETTE_PATH', DEFAULT_PATH),
+                mode=os.getenv('CASSETTE_MODE', OFF).lower(),
+                timing=os.getenv('CASSETTE_TIMING', 'instant').lower()
+            )
+        return _cassette
+
+
+def use_cassette(cassette: Optional[Cassette]):
+    """替换进程内的 cassette（None 表示重新按环境变量配置）"""
+    global _cassette
+    with _cassette_lock:
+        _cassette = cassette
@@ -0,0 +1,272 @@
+"""
+本地体质分类器
+根据 TongueFeatureExtractor 提取的舌象特征判断九种体质，给出各体质的 softmax 概率作为置信度，
+并从本地知识库组装完整报告。全程不访问网络，用作规则引擎和快速通道
+
+置信度未经校准：证据权重为人工设定，温度也没有在真实数据上拟合，
+概率只用于比较高低，不代表实际的判断准确率
+"""
+
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from tcm_knowledge import CONSTITUTION_KNOWLEDGE
+from tongue_feature_extractor import TongueFeatureExtractor
+
+# 快速通道的分析分辨率（长边像素）
+FAST_MAX_SIDE = 640
+
+# softmax 温度：未经拟合的中性默认值；可用 benchmark_classifier.py --fit-temperature
+# 在已存LLM报告上拟合，再通过环境变量 CLASSIFIER_TEMPERATURE 设置
+DEFAULT_TEMPERATURE = 1.0
+
+# 舌象证据 → 各体质的对数几率加分
+# bias 反映先验：特禀质、气郁质主要靠问诊判断，舌象证据弱，先验较低
+EVIDENCE: Dict[str, Dict[str, float]] = {
+    "平和质": {
+        "bias": 0.5,
+        "color:淡红舌": 2.0,
+        "color:红舌": -0.6,
+        "color:紫舌": -1.0,
+        "coating:薄": 0.6,
+        "coating_color:白苔": 0.6,
+        "coating_color:黄苔": -0.8,
+        "shape:正常": 0.6,
+        "texture:smooth": 0.4,
+    },
+    "气虚质": {
+        "bias": 0.0,
+        "color:淡白舌": 1.5,
+        "teeth_marks": 1.6,
+        "shape:胖": 1.0,
+        "coating_color:白苔": 0.3,
+        "saturation:low": 0.4,
+    },
+    "阳虚质": {
+        "bias": -0.2,
+        "color:淡白舌": 1.8,
+        "shape:胖": 0.8,
+        "teeth_marks": 0.8,
+        "coating_color:白苔": 0.5,
+        "saturation:low": 0.6,
+    },
+    "阴虚质": {
+        "bias": -0.2,
+        "color:红舌": 1.5,
+        "color:绛舌": 1.0,
+        "shape:瘦": 1.2,
+        "coating:薄": 0.5,
+        "texture:rough": 0.8,
+    },
+    "痰湿质": {
+        "bias": -0.2,
+        "coating:厚": 1.5,
+        "coating_color:白苔": 0.5,
+        "shape:胖": 1.0,
+        "teeth_marks": 0.5,
+    },
+    "湿热质": {
+        "bias": -0.2,
+        "coating:厚": 1.0,
+        "coating_color:黄苔": 1.5,
+        "coating_color:淡黄苔": 0.7,
+        "color:红舌": 0.8,
+        "color:绛舌": 0.5,
+    },
+    "血瘀质": {
+        "bias": -0.3,
+        "color:紫舌": 2.6,
+        "color:绛舌": 0.5,
+        "texture:rough": 0.3,
+    },
+    "气郁质": {
+        "bias": -0.8,
+        "color:红舌": 0.3,
+        "color:淡红舌": 0.3,
+    },
+    "特禀质": {
+        "bias": -1.5,
+    },
+}
+
+
+class ConstitutionClassifier:
+    """基于舌象特征的九种体质分类器"""
+
+    def __init__(
+        self,
+        temperature: Optional[float] = None,
+        extractor: Optional[TongueFeatureExtractor] = None
+    ):
+        """
+        Args:
+            temperature: softmax 温度（>1 置信度更保守），默认读取环境变量 CLASSIFIER_TEMPERATURE
+            extractor: 特征提取器，默认使用缩小分辨率的快速提取器
+
+        Raises:
+            ValueError: 温度不是正数
+        """
+        if temperature is None:
+            temperature = float(os.getenv('CLASSIFIER_TEMPERATURE', DEFAULT_TEMPERATURE))
+        if temperature <= 0:
+            raise ValueError(f"softmax 温度必须为正数: {temperature}")
+        self.temperature = temperature
+        self.extractor = extractor or TongueFeatureExtractor(max_side=FAST_MAX_SIDE)
+
+    def analyze(self, image_path: str) -> Dict[str, Any]:
+        """
+        提取特征、分类并组装报告
+
+        Args:
+            image_path: 图片路径
+
+        Returns:
+            与AI分析结果格式一致的报告
+        """
+        start = time.perf_counter()
+        features = self.extractor.extract_features(image_path)
+        classification = self.classify(features)
+        report = self.build_report(features, classification)
+        report['latency_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return report
+
+    def classify(self, features: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        根据特征计算九种体质的概率
+
+        Returns:
+            {'primary', 'probabilities'（按概率降序）, 'confidence', 'margin', 'evidence', 'logits'}
+        """
+        evidence = self.evidence_tokens(features)
+        logits = evidence_logits(evidence)
+        probabilities = softmax(logits, self.temperature)
+        ranked = sorted(probabilities.items(), key=lambda item: item[1], reverse=True)
+
+        return {
+            'primary': ranked[0][0],
+            'probabilities': dict(ranked),
+            'confidence': ranked[0][1],
+            'margin': ranked[0][1] - ranked[1][1],
+            'evidence': sorted(evidence),
+            'logits': logits
+        }
+
+    @staticmethod
+    def evidence_tokens(features: Dict[str, Any]) -> Set[str]:
+        """把提取器输出转换为离散的证据标记"""
+        color = features['tongue_color']
+        coating = features['coating']
+        shape_type = features['shape'].get('type', '')
+        texture = features['texture']
+
+        tokens = {
+            f"color:{color['type']}",
+            f"coating_color:{coating['color']}",
+            "coating:厚" if '厚' in coating['thickness'] else "coating:薄",
+        }
+
+        if '圆润' in shape_type or '胖' in shape_type:
+            tokens.add("shape:胖")
+        elif '瘦' in shape_type:
+            tokens.add("shape:瘦")
+        else:
+            tokens.add("shape:正常")
+
+        if texture.get('has_teeth_marks'):
+            tokens.add("teeth_marks")
+        tokens.add("texture:rough" if texture.get('complexity', 0) > 100 else "texture:smooth")
+
+        if color.get('saturation', 255) < 60:
+            tokens.add("saturation:low")
+
+        return tokens
+
+    def build_report(self, features: Dict[str, Any], classification: Dict[str, Any]) -> Dict[str, Any]:
+        """从本地知识库组装报告"""
+        probabilities = classification['probabilities']
+        primary = classification['primary']
+        entry = CONSTITUTION_KNOWLEDGE[primary]
+
+        # 次要体质：概率不低于 0.2 的其他体质
+        secondary = [
+            CONSTITUTION_KNOWLEDGE[name]['name']
+            for name, p in probabilities.items()
+            if name != primary and p >= 0.2
+        ]
+
+        # 健康评分取各体质典型评分的概率加权
+        score = round(sum(p * CONSTITUTION_KNOWLEDGE[name]['health_score'] for name, p in probabilities.items()))
+
+        coating = features['coating']
+        texture = features['texture']
+
+        return {
+            "tongue_body": {
+                "color": features['tongue_color']['type'],
+                "shape": features['shape']['description'],
+                "features": [features['tongue_color']['description']] + list(texture['features'])
+            },
+            "tongue_coating": {
+                "color": coating['color'],
+                "thickness": "厚" if '厚' in coating['thickness'] else "薄",
+                "texture": coating['description']
+            },
+            "constitution": {
+                "primary": entry['name'],
+                "secondary": secondary,
+                "description": entry['description'],
+                "confidence": round(classification['confidence'], 3)
+            },
+            "constitution_scores": {name: round(p, 3) for name, p in probabilities.items()},
+            "health_score": score,
+            "score_level": score_level(score),
+            "advice": _copy_advice(entry['advice']),
+            "herbs": list(entry['herbs']),
+            "summary": entry['summary'],
+            "extracted_features": features,
+            "provider": "规则引擎",
+            "model": "feature-classifier"
+        }
+
+
+def evidence_logits(evidence: Set[str]) -> Dict[str, float]:
+    """按证据表累加各体质的对数几率"""
+    return {
+        name: table.get('bias', 0.0) + sum(table.get(token, 0.0) for token in evidence)
+        for name, table in EVIDENCE.items()
+    }
+
+
+def softmax(logits: Dict[str, float], temperature: float = 1.0) -> Dict[str, float]:
+    """带温度的 softmax"""
+    peak = max(logits.values())
+    exps = {name: math.exp((value - peak) / temperature) for name, value in logits.items()}
+    total = sum(exps.values())
+    return {name: value / total for name, value in exps.items()}
+
+
+def score_level(score: int) -> str:
+    """健康评分等级"""
+    if score >= 85:
+        return "优秀"
+    if score >= 68:
+        return "良好"
+    if score >= 55:
+        return "一般"
+    return "较差"
+
+
+def _copy_advice(advice: Dict[str, Any]) -> Dict[str, Any]:
+    """复制建议（避免调用方修改知识库）"""
+    return {
+        key: ({k: list(v) for k, v in value.items()} if isinstance(value, dict) else list(value))
+        for key, value in advice.items()
+    }
+
+
+def ranked_constitutions(probabilities: Dict[str, float]) -> List[str]:
+    """按概率降序排列的体质名称"""
+    return [name for name, _ in sorted(probabilities.items(), key=lambda item: item[1], reverse=True)]
+
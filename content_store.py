@@ -0,0 +1,236 @@
+"""
+按内容寻址的上传存储
+对象以内容的 SHA-256 命名，按哈希前缀分两级目录存放（ab/cd/abcd….jpg），
+单个目录的文件数保持在可控范围；写入先落临时文件再原子改名，相同内容只存一份；
+后台清理线程按保留期删除过期对象
+
+环境变量：
+    UPLOAD_RETENTION_DAYS=30    上传保留天数（0 表示永久保留）
+    UPLOAD_GC_INTERVAL=3600     清理间隔（秒）
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+_SHARD = re.compile(r'^[0-9a-f]{2}$')
+
+# 未完成的临时文件超过该时间（秒）视为写入中断，清理时删除
+_STALE_TMP_SECONDS = 3600
+
+
+class ContentStore:
+    """按内容哈希命名、分片存放的对象存储"""
+
+    def __init__(self, root: str, retention_days: Optional[float] = None):
+        """
+        Args:
+            root: 存储根目录
+            retention_days: 对象保留天数（从最后一次写入算起，0 表示永久保留），
+                默认读取环境变量 UPLOAD_RETENTION_DAYS
+        """
+        if retention_days is None:
+            retention_days = float(os.getenv('UPLOAD_RETENTION_DAYS', '30'))
+        self.root = root
+        self.retention = retention_days * 86400
+
+    def path_for(self, name: str) -> str:
+        """对象文件名对应的分片路径"""
+        return os.path.join(self.root, name[:2], name[2:4], name)
+
+    def put(self, content: bytes, ext: str, digest: Optional[str] = None) -> Tuple[str, str, bool]:
+        """
+        保存对象（相同内容已存在时不再写入）
+
+        Args:
+            content: 文件内容
+            ext: 扩展名（不含点）
+            digest: 已算好的内容哈希（默认重新计算）
+
+        Returns:
+            (文件路径, 内容哈希, 是否新写入)
+        """
+        digest = digest or hashlib.sha256(content).hexdigest()
+        path = self.path_for(f"{digest}.{ext}")
+
+        if os.path.exists(path):
+            # 重复上传：刷新时间戳，保留期从这次上传重新计算
+            try:
+                os.utime(path)
+                return path, digest, False
+            except FileNotFoundError:
+                pass  # 恰好被清理线程删除，重新写入
+
+        self.write_atomic(path, content)
+        return path, digest, True
+
+    def put_stream(
+        self,
+        chunks: Iterable[bytes],
+        ext: str,
+        validate: Optional[Callable[[str], None]] = None
+    ) -> Tuple[str, str, bool]:
+        """
+        边接收边写入并计算哈希，内存占用与文件大小无关
+
+        内容先写入 incoming/ 下的临时文件，哈希确定后再改名到分片路径
+
+        Args:
+            chunks: 内容分块（迭代中抛出的异常会终止写入并删除临时文件）
+            ext: 扩展名（不含点）
+            validate: 改名前对完整临时文件的校验，抛出异常即放弃写入
+
+        Returns:
+            (文件路径, 内容哈希, 是否新写入)
+        """
+        incoming = os.path.join(self.root, 'incoming')
+        os.makedirs(incoming, exist_ok=True)
+        tmp_path = os.path.join(incoming, f"{uuid.uuid4().hex}.tmp")
+        hasher = hashlib.sha256()
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    f.write(chunk)
+            if validate is not None:
+                validate(tmp_path)
+
+            digest = hasher.hexdigest()
+            path = self.path_for(f"{digest}.{ext}")
+            try:
+                # 重复上传：刷新已有对象的保留期，丢弃临时文件
+                os.utime(path)
+                os.remove(tmp_path)
+                return path, digest, False
+            except FileNotFoundError:
+                pass
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+            return path, digest, True
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def write_atomic(path: str, content: bytes):
+        """先写同目录的临时文件再改名，读者不会看到写了一半的文件"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def sweep(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        删除超过保留期的对象和中断遗留的临时文件，并移除空的分片目录
+
+        Returns:
+            {'scanned', 'removed', 'freed_bytes'}
+        """
+        now = now if now is not None else time.time()
+        stats = {'scanned': 0, 'removed': 0, 'freed_bytes': 0}
+
+        for shard, entries in self._shards():
+            if shard is None:
+                # incoming/ 中只有临时文件，目录本身保留
+                entries = [e for e in entries if e.name.endswith('.tmp')]
+            for entry in entries:
+                stats['scanned'] += 1
+                try:
+                    info = entry.stat()
+                    age = now - info.st_mtime
+                    if entry.name.endswith('.tmp'):
+                        expired = age > _STALE_TMP_SECONDS
+                    else:
+                        expired = self.retention > 0 and age > self.retention
+                    if expired:
+                        os.remove(entry.path)
+                        stats['removed'] += 1
+                        stats['freed_bytes'] += info.st_size
+                except OSError:
+                    continue
+            if shard is not None:
+                self._remove_if_empty(shard)
+
+        return stats
+
+    def _shards(self) -> Iterator[Tuple[Optional[str], List[os.DirEntry]]]:
+        """遍历 incoming/（目录记为 None）和两级分片目录（不进入其他目录，旧的平铺文件不受影响）"""
+        yield None, _scan_files(os.path.join(self.root, 'incoming'))
+        for outer in _scan_dirs(self.root):
+            if not _SHARD.match(outer.name):
+                continue
+            for inner in _scan_dirs(outer.path):
+                if not _SHARD.match(inner.name):
+                    continue
+                yield inner.path, _scan_files(inner.path)
+            self._remove_if_empty(outer.path)
+
+    @staticmethod
+    def _remove_if_empty(path: str):
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass  # 非空或已被其他进程删除
+
+
+def _scan_dirs(path: str) -> List[os.DirEntry]:
+    try:
+        with os.scandir(path) as it:
+            return [e for e in it if e.is_dir(follow_symlinks=False)]
+    except OSError:
+        return []
+
+
+def _scan_files(path: str) -> List[os.DirEntry]:
+    try:
+        with os.scandir(path) as it:
+            return [e for e in it if e.is_file(follow_symlinks=False)]
+    except OSError:
+        return []
+
+
+class Sweeper:
+    """后台定期清理过期对象的守护线程"""
+
+    def __init__(self, stores, interval: Optional[float] = None):
+        """
+        Args:
+            stores: 要清理的 ContentStore 列表
+            interval: 清理间隔（秒），默认读取环境变量 UPLOAD_GC_INTERVAL
+        """
+        if interval is None:
+            interval = float(os.getenv('UPLOAD_GC_INTERVAL', '3600'))
+        self.stores = list(stores)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='upload-gc', daemon=True)
+
+    def start(self) -> 'Sweeper':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for store in self.stores:
+                try:
+                    stats = store.sweep()
+                except Exception as e:
+                    print(f"⚠️  上传清理失败: {e}")
+                    continue
+                if stats['removed']:
+                    print(f"🧹 已清理 {stats['removed']} 个过期文件，释放 {stats['freed_bytes'] / 1024 / 1024:.1f} MB")
@@ -0,0 +1,106 @@
+"""
+端到端时限预算
+每个分析请求携带一个截止时间，沿解码 → 特征提取 → 图片编码 → 提供商调用逐级传递，
+各阶段以剩余预算作为超时；预算将尽时由调用方降级到更便宜的路径，而不是超时等待
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+
+class DeadlineExceeded(TimeoutError):
+    """时限预算已用完"""
+
+
+class Deadline:
+    """一次请求的截止时间"""
+
+    def __init__(self, seconds: float):
+        """
+        Args:
+            seconds: 总预算（秒）
+        """
+        self.budget = seconds
+        self.started = time.monotonic()
+        self.expires_at = self.started + seconds
+        self.stages: List[Tuple[str, float]] = []
+
+    def remaining(self) -> float:
+        """剩余预算（秒），不小于 0"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def check(self, stage: str):
+        """
+        进入下一阶段前检查预算，并记录阶段时刻
+
+        Raises:
+            DeadlineExceeded: 预算已用完
+        """
+        self.stages.append((stage, round(self.elapsed(), 3)))
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(f"时限预算 {self.budget:.1f}s 已用完（阶段: {stage}）")
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """
+        本阶段可用的超时
+
+        Args:
+            cap: 本阶段自身的超时上限
+
+        Raises:
+            DeadlineExceeded: 预算已用完
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"时限预算 {self.budget:.1f}s 已用完")
+        return min(remaining, cap) if cap else remaining
+
+
+_current: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar('deadline', default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """当前上下文的截止时间（没有时返回 None）"""
+    return _current.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """在代码块内设置截止时间（嵌套时取更早的那个）"""
+    outer = _current.get()
+    if outer is not None and (deadline is None or outer.expires_at < deadline.expires_at):
+        deadline = outer
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def request_timeout(default: float) -> float:
+    """
+    SDK调用的超时：有截止时间时取剩余预算与默认值的较小者
+
+    Args:
+        default: 没有截止时间时的超时（秒）
+    """
+    deadline = _current.get()
+    return deadline.timeout(default) if deadline else default
+
+
+def check_stage(stage: str):
+    """在当前截止时间下进入某阶段（没有截止时间时不做任何事）"""
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check(stage)
+
+
+def budget_below(seconds: float) -> bool:
+    """剩余预算是否已不足 seconds（用于决定是否降级）"""
+    deadline = _current.get()
+    return deadline is not None and deadline.remaining() < seconds
@@ -0,0 +1,194 @@
+"""
+上传图片的派生版本
+每张上传图片派生三种版本，以原图内容哈希命名缓存（<哈希>_<种类>.<扩展名>）：
+- thumbnail：长边 256 像素的 WebP，供页面显示
+- model：长边 DERIVATIVE_MODEL_SIDE 像素的 JPEG，作为视觉大模型的输入
+- archive：去除 EXIF、XMP 等元数据的原图（拍摄时间、GPS 位置不随图片外发），像素不重新编码
+上传保存后由后台线程预先生成；缺失时（尚未生成或已被清理）在首次使用时同步生成
+
+环境变量：
+    DERIVATIVE_MODEL_SIDE=1024   发送给大模型的图片长边像素数
+    DERIVATIVE_WORKERS=2         后台生成线程数（0 表示只在首次使用时生成）
+"""
+
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Set, Tuple
+
+from content_store import ContentStore
+from image_utils import resize_encode, strip_metadata
+from metrics import DERIVATIVE_SECONDS
+
+# 内容寻址的上传文件名 <内容哈希>.<扩展名>
+_SOURCE_NAME = re.compile(r'^([0-9a-f]{64})\.(png|jpg|jpeg|gif|webp)$')
+
+THUMBNAIL_SIDE = 256
+THUMBNAIL_QUALITY = 80
+MODEL_QUALITY = 85
+# 方向需要转正的存档图片重新编码时的质量
+ARCHIVE_QUALITY = 95
+
+KINDS = ('thumbnail', 'model', 'archive')
+
+# 正在生成的派生图片路径 -> 锁：同一张图的并发请求（含后台线程）只生成一次
+_generating: Dict[str, threading.Lock] = {}
+_generating_lock = threading.Lock()
+
+
+def model_side() -> int:
+    return int(os.getenv('DERIVATIVE_MODEL_SIDE', '1024'))
+
+
+def parse_source(source: str) -> Optional[Tuple[str, str]]:
+    """
+    解析内容寻址的上传路径
+
+    Returns:
+        (内容哈希, 扩展名)；不是内容寻址的文件返回 None
+    """
+    match = _SOURCE_NAME.match(os.path.basename(source))
+    if not match:
+        return None
+    return match.group(1), match.group(2)
+
+
+def render(kind: str, source: str) -> Optional[bytes]:
+    """
+    生成派生图片
+
+    Args:
+        kind: 'thumbnail'、'model' 或 'archive'
+        source: 原图路径
+
+    Returns:
+        派生图片内容；OpenCV 无法解码的格式（如 GIF）缩放版本返回 None
+    """
+    if kind == 'thumbnail':
+        return resize_encode(source, THUMBNAIL_SIDE, 'webp', THUMBNAIL_QUALITY)
+    if kind == 'model':
+        return resize_encode(source, model_side(), 'jpg', MODEL_QUALITY)
+
+    ext = os.path.splitext(source)[1].lstrip('.').lower()
+    with open(source, 'rb') as f:
+        data = f.read()
+    try:
+        stripped, orientation = strip_metadata(data, ext)
+    except ValueError:
+        orientation = 0  # 结构无法解析：重新编码
+    if orientation == 1:
+        return stripped
+    # 去掉 EXIF 后方向信息随之丢失：解码时已按方向转正，按原格式重新编码（不含元数据）；
+    # OpenCV 无法解码时返回 None，不提供带元数据的原图
+    return resize_encode(source, 1 << 30, 'webp' if ext == 'webp' else 'jpg', ARCHIVE_QUALITY)
+
+
+class DerivativeStore:
+    """派生图片的缓存目录和后台生成线程"""
+
+    def __init__(self, root: str, workers: int = 0):
+        """
+        Args:
+            root: 缓存目录（按原图哈希分片存放）
+            workers: 后台生成线程数，0 表示不启动后台线程
+        """
+        self.store = ContentStore(root)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='derivatives') if workers else None
+        # 已提交后台生成、尚未完成的原图
+        self._queued: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def path_for(self, digest: str, kind: str, source_ext: str) -> str:
+        """派生图片的缓存路径"""
+        ext = {'thumbnail': 'webp', 'model': 'jpg'}.get(kind, source_ext)
+        return self.store.path_for(f"{digest}_{kind}.{ext}")
+
+    def ensure(self, source: str, kind: str) -> Optional[str]:
+        """
+        返回派生图片路径，缺失时同步生成
+
+        Args:
+            source: 内容寻址的原图路径
+            kind: 派生种类
+
+        Returns:
+            派生图片路径；原图不存在或无法生成时返回 None
+        """
+        parsed = parse_source(source)
+        if parsed is None or kind not in KINDS:
+            return None
+        path = self.path_for(parsed[0], kind, parsed[1])
+        if os.path.exists(path):
+            return path
+
+        with _generating_lock:
+            lock = _generating.setdefault(path, threading.Lock())
+        try:
+            with lock:
+                if os.path.exists(path):
+                    return path  # 等待期间已由其他线程生成
+                if not os.path.exists(source):
+                    return None
+                with DERIVATIVE_SECONDS.time(kind=kind):
+                    content = render(kind, source)
+                if content is None:
+                    return None
+                self.store.write_atomic(path, content)
+                return path
+        finally:
+            with _generating_lock:
+                _generating.pop(path, None)
+
+    def submit(self, source: str):
+        """在后台生成全部派生图片（已在队列中的原图不重复提交）"""
+        if self._pool is None or parse_source(source) is None:
+            return
+        with self._lock:
+            if source in self._queued:
+                return
+            self._queued.add(source)
+        self._pool.submit(self._generate_all, source)
+
+    def _generate_all(self, source: str):
+        try:
+            for kind in KINDS:
+                self.ensure(source, kind)
+        except Exception as e:
+            print(f"⚠️  派生图片生成失败 {os.path.basename(source)}: {e}")
+        finally:
+            with self._lock:
+                self._queued.discard(source)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+
+def store_for(source: str) -> Optional[DerivativeStore]:
+    """
+    上传路径对应的派生图片缓存：上传存储 <根目录>/ab/cd/<哈希>.<扩展名> 的派生图片
+    存放在 <根目录>/derivatives
+
+    Returns:
+        非内容寻址的路径返回 None
+    """
+    parsed = parse_source(source)
+    inner = os.path.dirname(os.path.abspath(source))
+    outer = os.path.dirname(inner)
+    if parsed is None or (os.path.basename(outer), os.path.basename(inner)) != (parsed[0][:2], parsed[0][2:4]):
+        return None
+    return DerivativeStore(os.path.join(os.path.dirname(outer), 'derivatives'))
+
+
+def model_input_path(source: str) -> str:
+    """
+    发送给视觉大模型的图片路径：缩小后的 JPEG，无法生成时使用原图
+
+    Args:
+        source: 上传图片路径
+    """
+    store = store_for(source)
+    if store is None:
+        return source
+    return store.ensure(source, 'model') or source
@@ -7,7 +7,18 @@
 import os
 import json
 import base64
-from typing import Dict, Any
+from typing import Dict, Any, Iterator
+
+from streaming import stream_report
+from json_utils import extract_json
+from resilience import get_guard
+from derivatives import model_input_path
+from deadline import DeadlineExceeded, check_stage, current_deadline, request_timeout
+from metrics import JSON_PARSE
+from tracing import open_span, span, usage_attributes
+
+# 单次调用的超时上限（秒），有请求时限时取剩余预算与之的较小者
+PROVIDER_TIMEOUT = 60.0
 
 class FreeTongueAnalyzer:
     """免费舌象分析器 - 使用智谱AI GLM-4V"""
@@ -55,9 +66,94 @@ class FreeTongueAnalyzer:
         """
         print(f"\n🔬 使用智谱AI GLM-4V 免费分析舌象...")
 
+        with span('analyze_image', provider='zhipu'):
+            request = self._build_request(image_path)
+
+            try:
+                # 调用智谱AI API (使用正确的格式)
+                check_stage('provider')
+                response = get_guard('zhipu').call(
+                    self.client.chat.completions.create, timeout=request_timeout(PROVIDER_TIMEOUT), **request
+                )
+
+                ai_response = response.choices[0].message.content
+
+                # 解析JSON
+                result = self._parse_json_response(ai_response)
+                result['provider'] = 'zhipu-ai'
+                result['model'] = 'glm-4v-flash'
+                result['cost'] = '免费'
+
+                print("✅ 智谱AI 免费分析完成！")
+                print("💰 本次分析使用免费额度，无需付费")
+
+                return result
+
+            except Exception as e:
+                print(f"❌ API调用失败: {e}")
+                raise
+
+    def analyze_image_stream(self, image_path: str) -> Iterator[Dict[str, Any]]:
+        """
+        流式分析舌象图片（免费），每完成一个顶层字段立即产出
+
+        Args:
+            image_path: 图片路径
+
+        Returns:
+            事件迭代器，格式见 streaming.stream_report
+        """
+        print(f"\n🔬 使用智谱AI GLM-4V 免费流式分析舌象...")
+
+        request = self._build_request(image_path)
+        check_stage('provider')
+        deadline = current_deadline()
+        stream = get_guard('zhipu').call(
+            self.client.chat.completions.create, stream=True, timeout=request_timeout(PROVIDER_TIMEOUT), **request
+        )
+
+        def text_stream():
+            stream_span = open_span('provider.stream', provider='zhipu')
+            chars = 0
+            error = None
+            try:
+                for chunk in stream:
+                    if deadline is not None and deadline.remaining() <= 0:
+                        raise DeadlineExceeded(f"时限预算 {deadline.budget:.1f}s 在生成过程中用完")
+                    stream_span.set(**usage_attributes(chunk))
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        chars += len(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                stream_span.set(completion_chars=chars)
+                stream_span.finish(error)
+
+        try:
+            yield from stream_report(
+                text_stream(),
+                self._parse_json_response,
+                {'provider': 'zhipu-ai', 'model': 'glm-4v-flash', 'cost': '免费'}
+            )
+        finally:
+            # 客户端断开（GeneratorExit）或出错时关闭HTTP流，不再占着连接等模型生成完
+            close = getattr(stream, 'close', None)
+            if close:
+                close()
+
+    def _build_request(self, image_path: str) -> Dict[str, Any]:
+        """构建智谱AI请求参数"""
+
         # 读取并编码图片
-        with open(image_path, 'rb') as f:
-            image_data = base64.b64encode(f.read()).decode('utf-8')
+        check_stage('encode_image')
+        with span('encode_image') as encode_span:
+            # 发送缩小后的 JPEG（长边 DERIVATIVE_MODEL_SIDE），而不是数 MB 的原图
+            with open(model_input_path(image_path), 'rb') as f:
+                raw = f.read()
+            image_data = base64.b64encode(raw).decode('utf-8')
+            encode_span.set(image_bytes=len(raw), payload_bytes=len(image_data))
 
         # 专业中医舌诊提示词
         prompt = """你是一位经验丰富的中医舌诊专家。请详细分析这张舌象照片，从中医角度给出专业评估。
@@ -145,69 +241,44 @@ class FreeTongueAnalyzer:
 
 请基于图片实际特征分析，使用通俗易懂的语言，提供安全可操作的建议。"""
 
-        try:
-            # 调用智谱AI API (使用正确的格式)
-            response = self.client.chat.completions.create(
-                model="glm-4v-flash",  # 免费的视觉模型
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": image_data  # 直接使用base64字符串，不需要data:前缀
-                                }
-                            },
-                            {
-                                "type": "text",
-                                "text": prompt
+        return {
+            "model": "glm-4v-flash",  # 免费的视觉模型
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": image_data  # 直接使用base64字符串，不需要data:前缀
                             }
-                        ]
-                    }
-                ]
-            )
-
-            ai_response = response.choices[0].message.content
-
-            # 解析JSON
-            result = self._parse_json_response(ai_response)
-            result['provider'] = 'zhipu-ai'
-            result['model'] = 'glm-4v-flash'
-            result['cost'] = '免费'
-
-            print("✅ 智谱AI 免费分析完成！")
-            print("💰 本次分析使用免费额度，无需付费")
-
-            return result
-
-        except Exception as e:
-            print(f"❌ API调用失败: {e}")
-            raise
+                        },
+                        {
+                            "type": "text",
+                            "text": prompt
+                        }
+                    ]
+                }
+            ]
+        }
 
     def _parse_json_response(self, response: str) -> Dict[str, Any]:
         """从AI响应中提取JSON"""
-        try:
-            # 尝试提取JSON部分
-            if "```json" in response:
-                json_start = response.find("```json") + 7
-                json_end = response.find("```", json_start)
-                json_str = response[json_start:json_end].strip()
-            elif "{" in response and "}" in response:
-                json_start = response.find("{")
-                json_end = response.rfind("}") + 1
-                json_str = response[json_start:json_end]
-            else:
-                json_str = response
-
-            return json.loads(json_str)
-
-        except json.JSONDecodeError as e:
-            print(f"⚠️ JSON解析失败，返回原始文本")
-            return {
-                'raw_response': response,
-                'note': '请查看raw_response字段获取完整分析'
-            }
+        with span('parse_json', response_chars=len(response or '')) as parse_span:
+            try:
+                result = extract_json(response)
+                JSON_PARSE.inc(result='ok')
+                parse_span.set(result='ok')
+                return result
+
+            except ValueError as e:
+                JSON_PARSE.inc(result='failed')
+                parse_span.set(result='failed')
+                print(f"⚠️ JSON解析失败，返回原始文本")
+                return {
+                    'raw_response': response,
+                    'note': '请查看raw_response字段获取完整分析'
+                }
 
     def check_balance(self):
         """检查剩余免费额度"""
@@ -0,0 +1,270 @@
+"""
+跨提供商的对冲请求（Hedged Requests）
+主提供商在自适应的分位数时限内没有返回时，向下一个提供商补发请求，
+先返回合法结果的一方胜出，另一方被取消
+"""
+
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+
+# 提供商调用：接收取消事件，返回解析后的结果
+Attempt = Callable[[threading.Event], Any]
+
+# 估计被取消的主请求结束时刻所用的耗时分位数
+SAVED_QUANTILE = 0.95
+
+
+class HedgeError(RuntimeError):
+    """所有提供商都失败"""
+
+
+class HedgeCancelled(Exception):
+    """对冲请求已被取消（另一提供商先返回）"""
+
+
+class LatencyTracker:
+    """记录各提供商最近的耗时，给出自适应的对冲时限"""
+
+    def __init__(
+        self,
+        percentile: float = 0.9,
+        window: int = 100,
+        min_samples: int = 10,
+        initial_delay: float = 3.0,
+        min_delay: float = 0.05,
+        max_delay: float = 10.0
+    ):
+        """
+        Args:
+            percentile: 取最近耗时的哪个分位数作为时限
+            window: 每个提供商保留的样本数
+            min_samples: 样本不足时使用 initial_delay
+            initial_delay: 冷启动时的时限（秒）
+            min_delay: 时限下限（秒）
+            max_delay: 时限上限（秒）
+        """
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, seconds: float):
+        """记录一次调用的耗时（被取消的请求记录取消前已耗费的时间，作为耗时下限）"""
+        with self._lock:
+            samples = self._samples.setdefault(provider, deque(maxlen=self.window))
+            samples.append(seconds)
+
+    def quantile(self, provider: str, q: float) -> Optional[float]:
+        """该提供商最近耗时的分位数（秒）；样本不足时返回 None"""
+        with self._lock:
+            samples = sorted(self._samples.get(provider, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+    def deadline(self, provider: str) -> float:
+        """该提供商的对冲时限（秒）"""
+        delay = self.quantile(provider, self.percentile)
+        if delay is None:
+            delay = self.initial_delay
+        return max(self.min_delay, min(self.max_delay, delay))
+
+
+class HedgeMetrics:
+    """对冲统计：对冲率、胜出方、节省的时间"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.primary_wins = 0
+        self.hedge_wins = 0
+        self.failures = 0
+        self.latency_saved = 0.0
+        self.wins_by_provider: Dict[str, int] = {}
+
+    def record(self, hedged: bool, winner: Optional[str], winner_is_primary: bool):
+        """记录一次请求的结果"""
+        with self._lock:
+            self.requests += 1
+            if hedged:
+                self.hedged += 1
+            if winner is None:
+                self.failures += 1
+                return
+            self.wins_by_provider[winner] = self.wins_by_provider.get(winner, 0) + 1
+            if winner_is_primary:
+                self.primary_wins += 1
+            else:
+                self.hedge_wins += 1
+
+    def record_saved(self, seconds: float):
+        """记录对冲胜出节省的时间（主请求预计结束时刻 - 胜出时刻）"""
+        with self._lock:
+            self.latency_saved += max(0.0, seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """导出统计数据"""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hedged': self.hedged,
+                'hedge_rate': self.hedged / self.requests if self.requests else 0.0,
+                'primary_wins': self.primary_wins,
+                'hedge_wins': self.hedge_wins,
+                'failures': self.failures,
+                'latency_saved_seconds': round(self.latency_saved, 3),
+                'wins_by_provider': dict(self.wins_by_provider)
+            }
+
+
+class HedgedExecutor:
+    """按顺序对冲执行多个提供商的调用"""
+
+    def __init__(
+        self,
+        tracker: Optional[LatencyTracker] = None,
+        max_workers: int = 8
+    ):
+        self.tracker = tracker or LatencyTracker()
+        self.metrics = HedgeMetrics()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+
+    def run(
+        self,
+        attempts: List[Tuple[str, Attempt]],
+        validate: Callable[[Any], bool] = lambda result: True
+    ) -> Tuple[str, Any]:
+        """
+        执行对冲调用
+
+        Args:
+            attempts: [(提供商名, 调用函数), ...]，第一个为主提供商
+            validate: 判断结果是否合法（如JSON解析成功）
+
+        Returns:
+            (胜出的提供商名, 结果)
+
+        Raises:
+            HedgeError: 所有提供商都失败或结果不合法
+        """
+        start = time.monotonic()
+        pending = {}        # future -> (provider, cancel_event, [开始执行的时刻])
+        remaining = list(attempts)
+        last_error: Optional[BaseException] = None
+        hedged = False
+
+        def launch():
+            provider, attempt = remaining.pop(0)
+            cancel = threading.Event()
+            # 复制上下文，让时限预算等上下文变量传到对冲线程
+            context = contextvars.copy_context()
+            started: List[float] = []
+
+            def execute():
+                # 从真正开始执行时计时：在共享线程池中排队的时间不是提供商的耗时
+                started.append(time.monotonic())
+                return context.run(attempt, cancel)
+
+            future = self._pool.submit(execute)
+            pending[future] = (provider, cancel, started)
+
+        launch()
+        primary = attempts[0][0]
+
+        while pending:
+            timeout = self._hedge_delay(pending) if remaining else None
+
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                if self._hedge_delay(pending) > 0:
+                    # 请求等待期间才开始执行（此前在线程池排队），按开始时刻重新计时
+                    continue
+                # 超过时限仍未返回，补发对冲请求
+                hedged = True
+                launch()
+                continue
+
+            for future in done:
+                provider, _, started = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    print(f"⚠️  {provider} 调用失败: {e}")
+                    continue
+
+                if not validate(result):
+                    last_error = HedgeError(f"{provider} 返回结果不合法")
+                    print(f"⚠️  {provider} 返回结果不合法")
+                    continue
+
+                winner_at = time.monotonic()
+                self.tracker.record(provider, winner_at - started[0])
+                if provider != primary:
+                    self._record_saved(pending, primary, winner_at)
+                self._record_losers(pending, winner_at)
+                self._cancel_losers(pending)
+                self.metrics.record(hedged, provider, provider == primary)
+                return provider, result
+
+            # 已完成的都失败了：立即尝试下一个提供商，不再等待时限
+            if not pending and remaining:
+                launch()
+
+        self.metrics.record(hedged, None, False)
+        raise HedgeError(f"所有提供商均失败（耗时 {time.monotonic() - start:.2f}s）: {last_error}")
+
+    def _hedge_delay(self, pending: Dict) -> float:
+        """距离补发下一个对冲请求的时间：进行中的请求都超过各自的时限才补发，还在排队的请求尚未计时"""
+        now = time.monotonic()
+        delays = []
+        for provider, _, started in pending.values():
+            deadline = self.tracker.deadline(provider)
+            delays.append(started[0] + deadline - now if started else deadline)
+        return max(0.0, max(delays))
+
+    def _record_losers(self, pending: Dict, winner_at: float):
+        """
+        记录落败请求已耗费的时间
+
+        被对冲的慢请求如果不计入样本，分位数只剩胜出的快请求，时限会越来越短、对冲越来越多；
+        实际耗时不会少于取消前已耗费的时间
+        """
+        for provider, _, started in pending.values():
+            if started:
+                self.tracker.record(provider, winner_at - started[0])
+
+    def _record_saved(self, pending: Dict, primary: str, winner_at: float):
+        """
+        对冲胜出时估计节省的时间：主请求按其最近耗时的 P95 预计结束的时刻 - 胜出时刻
+
+        被取消的主请求在下一个流式分片就退出，它的实际退出时刻反映不了节省的时间；
+        主请求的耗时样本不足时不做估计
+        """
+        for provider, _, started in pending.values():
+            if provider != primary or not started:
+                continue
+            expected = self.tracker.quantile(primary, SAVED_QUANTILE)
+            if expected is not None:
+                self.metrics.record_saved(started[0] + expected - winner_at)
+
+    def _cancel_losers(self, pending: Dict):
+        """取消仍在进行的请求"""
+        for future, (_, cancel, _) in pending.items():
+            cancel.set()
+            future.cancel()
+
+    def shutdown(self):
+        """关闭线程池"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
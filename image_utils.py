@@ -0,0 +1,288 @@
+"""
+图片工具
+只读文件头识别格式、获取图片尺寸，不做完整解码；生成缩小尺寸的版本，无损去除元数据
+（JPEG、PNG、WebP、GIF）
+"""
+
+import struct
+from typing import BinaryIO, Optional, Tuple
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """
+    按文件头的魔数判断图片格式（不信任文件扩展名）
+
+    Returns:
+        'jpg'、'png'、'gif'、'webp'；不是支持的图片时返回 None
+    """
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def probe_image_size(path: str) -> Optional[Tuple[int, int]]:
+    """
+    读取图片文件头，返回 (宽, 高)
+
+    支持 JPEG、PNG、GIF、WebP；无法识别时返回 None
+    """
+    try:
+        with open(path, 'rb') as f:
+            return _probe(f)
+    except (OSError, struct.error):
+        return None
+
+
+def _probe(f: BinaryIO) -> Optional[Tuple[int, int]]:
+    head = f.read(32)
+
+    if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+        width, height = struct.unpack('>II', head[16:24])
+        return width, height
+
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        width, height = struct.unpack('<HH', head[6:10])
+        return width, height
+
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        chunk = head[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', head[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b'VP8L':
+            bits = struct.unpack('<I', head[21:25])[0]
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b'VP8X':
+            width = int.from_bytes(head[24:27], 'little') + 1
+            height = int.from_bytes(head[27:30], 'little') + 1
+            return width, height
+        return None
+
+    if head[:2] == b'\xff\xd8':
+        return _probe_jpeg(f)
+
+    return None
+
+
+def _probe_jpeg(f: BinaryIO) -> Optional[Tuple[int, int]]:
+    """沿JPEG段结构查找SOF段（跳过可能很大的EXIF段）"""
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':
+            byte = f.read(1)
+        if not byte:
+            return None
+
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            continue  # 无长度字段的标记
+        if marker == 0xD9:
+            return None
+
+        length = struct.unpack('>H', f.read(2))[0]
+        # SOF0-SOF15，排除 DHT(C4)、JPG(C8)、DAC(CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>xHH', f.read(5))
+            return width, height
+        f.seek(length - 2, 1)
+
+
+def resize_encode(src: str, max_side: int, ext: str = 'jpg', quality: int = 80) -> Optional[bytes]:
+    """
+    按长边缩小并重新编码（解码时已按 EXIF 方向旋转，输出不含元数据）
+
+    Args:
+        src: 原图路径
+        max_side: 输出长边像素数（原图更小时不放大）
+        ext: 输出格式 'jpg' 或 'webp'
+        quality: 编码质量
+
+    Returns:
+        编码后的字节；OpenCV 无法解码的格式（如 GIF）返回 None
+    """
+    import cv2
+
+    image = cv2.imread(src, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+
+    flag = cv2.IMWRITE_WEBP_QUALITY if ext == 'webp' else cv2.IMWRITE_JPEG_QUALITY
+    ok, encoded = cv2.imencode(f'.{ext}', image, [flag, quality])
+    return encoded.tobytes() if ok else None
+
+
+# JPEG 中要去掉的段：APP1（EXIF/XMP，含拍摄时间、GPS）、APP13（IPTC）、COM（注释）
+# ICC 色彩配置（APP2）和 Adobe 色彩变换（APP14）影响显示，保留
+_JPEG_METADATA_MARKERS = {0xE1, 0xED, 0xFE}
+# PNG 中要去掉的块
+_PNG_METADATA_CHUNKS = {b'eXIf', b'tEXt', b'iTXt', b'zTXt', b'tIME'}
+# WebP 中要去掉的块，以及 VP8X 头中对应的标志位
+_WEBP_METADATA_CHUNKS = {b'EXIF': 0x08, b'XMP ': 0x04}
+# GIF 中保留的应用扩展（循环播放设置），其余应用扩展（如 XMP）和注释扩展去掉
+_GIF_KEPT_APPLICATIONS = (b'NETSCAPE2.0', b'ANIMEXTS1.0')
+
+
+def strip_metadata(data: bytes, ext: str) -> Tuple[bytes, int]:
+    """
+    无损去除图片元数据（不重新编码像素）
+
+    Args:
+        data: 图片内容
+        ext: 格式扩展名
+
+    Returns:
+        (去除元数据后的内容, EXIF 方向)；方向不为 1 时去掉 EXIF 会让图片显示方向错误，
+        调用方应改为重新编码
+
+    Raises:
+        ValueError: 不支持的格式或结构损坏（调用方应改为重新编码）
+    """
+    kind = sniff_image_type(data[:12])
+    if ext in ('jpg', 'jpeg') and kind == 'jpg':
+        return _strip_jpeg(data)
+    if ext == 'png' and kind == 'png':
+        return _strip_png(data), 1
+    if ext == 'webp' and kind == 'webp':
+        return _strip_webp(data)
+    if ext == 'gif' and kind == 'gif':
+        return _strip_gif(data), 1
+    raise ValueError(f'无法无损去除元数据: {ext}')
+
+
+def _strip_jpeg(data: bytes) -> Tuple[bytes, int]:
+    out = [data[:2]]
+    orientation = 1
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise ValueError('JPEG 段结构损坏')
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1  # 填充字节
+            continue
+        if marker in (0xDA, 0xD9):
+            break  # 扫描数据开始（之后不再有元数据段）或图像结束
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            out.append(data[pos:pos + 2])
+            pos += 2
+            continue
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        segment = data[pos:pos + 2 + length]
+        if marker == 0xE1 and segment[4:10] == b'Exif\x00\x00':
+            orientation = _exif_orientation(segment[10:])
+        if marker not in _JPEG_METADATA_MARKERS:
+            out.append(segment)
+        pos += 2 + length
+    out.append(data[pos:])
+    return b''.join(out), orientation
+
+
+def _exif_orientation(tiff: bytes) -> int:
+    """读取 EXIF（TIFF 结构）IFD0 中的方向标签，读不到时返回 1"""
+    try:
+        order = {b'II': '<', b'MM': '>'}[tiff[:2]]
+        offset = struct.unpack(order + 'I', tiff[4:8])[0]
+        count = struct.unpack(order + 'H', tiff[offset:offset + 2])[0]
+        for index in range(count):
+            entry = offset + 2 + index * 12
+            tag, _, _, value = struct.unpack(order + 'HHI4s', tiff[entry:entry + 12])
+            if tag == 0x0112:
+                return struct.unpack(order + 'H', value[:2])[0]
+    except (KeyError, struct.error):
+        pass
+    return 1
+
+
+def _strip_png(data: bytes) -> bytes:
+    out = [data[:8]]
+    pos = 8
+    while pos + 12 <= len(data):
+        length = struct.unpack('>I', data[pos:pos + 4])[0]
+        chunk_type = data[pos + 4:pos + 8]
+        end = pos + 12 + length
+        if chunk_type not in _PNG_METADATA_CHUNKS:
+            out.append(data[pos:end])
+        pos = end
+        if chunk_type == b'IEND':
+            break
+    return b''.join(out)
+
+
+def _strip_webp(data: bytes) -> Tuple[bytes, int]:
+    chunks = []
+    orientation = 1
+    removed_flags = 0
+    pos = 12
+    end = min(len(data), 8 + struct.unpack('<I', data[4:8])[0])
+    while pos + 8 <= end:
+        chunk_type = data[pos:pos + 4]
+        length = struct.unpack('<I', data[pos + 4:pos + 8])[0]
+        chunk_end = pos + 8 + length + (length & 1)  # 块按偶数字节对齐
+        if chunk_end > end + 1:
+            raise ValueError('WebP 块结构损坏')
+        if chunk_type in _WEBP_METADATA_CHUNKS:
+            removed_flags |= _WEBP_METADATA_CHUNKS[chunk_type]
+            if chunk_type == b'EXIF':
+                payload = data[pos + 8:pos + 8 + length]
+                orientation = _exif_orientation(payload[6:] if payload.startswith(b'Exif\x00\x00') else payload)
+        else:
+            chunks.append(bytearray(data[pos:chunk_end]))
+        pos = chunk_end
+
+    for chunk in chunks:
+        if chunk[:4] == b'VP8X':
+            # 元数据块已去掉，清除头中声明它们存在的标志
+            chunk[8] &= ~(_WEBP_METADATA_CHUNKS[b'EXIF'] | _WEBP_METADATA_CHUNKS[b'XMP '])
+    body = b'WEBP' + b''.join(chunks)
+    return b'RIFF' + struct.pack('<I', len(body)) + body, orientation
+
+
+def _strip_gif(data: bytes) -> bytes:
+    try:
+        flags = data[10]
+        pos = 13 + ((3 << ((flags & 0x07) + 1)) if flags & 0x80 else 0)  # 全局颜色表
+        out = [data[:pos]]
+        while True:
+            block = data[pos]
+            if block == 0x3B:  # 结尾
+                out.append(data[pos:pos + 1])
+                return b''.join(out)
+            if block == 0x21:  # 扩展：标签 + 数据子块
+                start = pos
+                label = data[pos + 1]
+                pos = _skip_gif_sub_blocks(data, pos + 2)
+                application = data[start + 3:start + 14] if label == 0xFF else b''
+                if label != 0xFE and (label != 0xFF or application in _GIF_KEPT_APPLICATIONS):
+                    out.append(data[start:pos])
+            elif block == 0x2C:  # 图像：描述符 + 局部颜色表 + LZW 最小码长 + 数据子块
+                start = pos
+                flags = data[pos + 9]
+                pos += 10 + ((3 << ((flags & 0x07) + 1)) if flags & 0x80 else 0)
+                pos = _skip_gif_sub_blocks(data, pos + 1)
+                out.append(data[start:pos])
+            else:
+                raise ValueError('GIF 块结构损坏')
+    except IndexError:
+        raise ValueError('GIF 数据不完整') from None
+
+
+def _skip_gif_sub_blocks(data: bytes, pos: int) -> int:
+    """跳过以长度 0 结束的数据子块，返回其后的位置"""
+    while data[pos]:
+        pos += data[pos] + 1
+    return pos + 1
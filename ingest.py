@@ -0,0 +1,117 @@
+"""
+上传图片的流式接收
+按块读取请求体：首块即按魔数校验格式，非图片立即拒绝；边写入边计算哈希，
+内存占用与文件大小无关；落盘后只读文件头检查像素数，超出预算的图片不会进入完整解码
+
+环境变量：
+    MAX_IMAGE_PIXELS=40000000    解码后像素数上限（约 3 字节/像素）
+"""
+
+import os
+from typing import BinaryIO, Callable, Iterator, Optional, Tuple
+
+from content_store import ContentStore
+from image_utils import probe_image_size, sniff_image_type
+
+DEFAULT_MAX_PIXELS = 40_000_000
+CHUNK_SIZE = 64 * 1024
+
+# 识别格式所需的文件头长度
+_SNIFF_BYTES = 32
+
+
+class UploadRejected(ValueError):
+    """上传被拒绝（附带应返回的HTTP状态码）"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def read_chunks(stream: BinaryIO, max_bytes: Optional[int] = None,
+                chunk_size: int = CHUNK_SIZE) -> Tuple[str, Iterator[bytes]]:
+    """
+    读取文件头识别格式，返回格式和完整内容的分块迭代器
+
+    Args:
+        stream: 请求体或上传文件流
+        max_bytes: 内容大小上限（None 表示不限制）
+        chunk_size: 每块大小
+
+    Returns:
+        (扩展名, 分块迭代器)
+
+    Raises:
+        UploadRejected: 不是支持的图片格式（415）；迭代过程中超过大小上限（413）
+    """
+    head = b''
+    while len(head) < _SNIFF_BYTES:
+        chunk = stream.read(_SNIFF_BYTES - len(head))
+        if not chunk:
+            break
+        head += chunk
+
+    ext = sniff_image_type(head)
+    if ext is None:
+        raise UploadRejected('不支持的文件格式，请上传 JPEG、PNG、GIF 或 WebP 图片', 415)
+
+    def chunks() -> Iterator[bytes]:
+        total = len(head)
+        yield head
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                return
+            total += len(chunk)
+            if max_bytes is not None and total > max_bytes:
+                raise UploadRejected('图片过大', 413)
+            yield chunk
+
+    return ext, chunks()
+
+
+def pixel_budget(max_pixels: int) -> Callable[[str], None]:
+    """
+    像素预算校验：只读文件头获取尺寸
+
+    Raises:
+        UploadRejected: 无法识别尺寸（400）或像素数超出预算（413）
+    """
+    def validate(path: str):
+        size = probe_image_size(path)
+        if size is None or 0 in size:
+            raise UploadRejected('无法识别图片尺寸，文件可能已损坏', 400)
+        width, height = size
+        if width * height > max_pixels:
+            raise UploadRejected(f'图片分辨率过高（{width}×{height}），请缩小后再上传', 413)
+
+    return validate
+
+
+def ingest_image(
+    stream: BinaryIO,
+    store: ContentStore,
+    max_bytes: Optional[int] = None,
+    max_pixels: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE
+) -> Tuple[str, str, bool]:
+    """
+    校验并保存上传的图片
+
+    Args:
+        stream: 请求体或上传文件流
+        store: 内容寻址存储
+        max_bytes: 内容大小上限
+        max_pixels: 像素数上限，默认读取环境变量 MAX_IMAGE_PIXELS
+        chunk_size: 每块大小
+
+    Returns:
+        (文件路径, 内容哈希, 是否新写入)
+
+    Raises:
+        UploadRejected: 格式、大小或像素数不符合要求
+    """
+    if max_pixels is None:
+        max_pixels = int(os.getenv('MAX_IMAGE_PIXELS', str(DEFAULT_MAX_PIXELS)))
+    ext, chunks = read_chunks(stream, max_bytes, chunk_size)
+    return store.put_stream(chunks, ext, validate=pixel_budget(max_pixels))
@@ -0,0 +1,356 @@
+"""
+分析任务队列与工作线程池
+/api/analyze 只负责入队，固定数量的工作线程从队列取任务执行特征提取和大模型调用，
+请求并发与执行并发解耦，突发流量在队列中排队而不是占满请求线程
+
+两种后端，都不需要外部消息中间件：
+- MemoryJobQueue：进程内队列（单进程部署）
+- SQLiteJobQueue：SQLite 表（多个 worker 进程共享同一个数据库文件）
+
+环境变量：
+    JOB_QUEUE=memory|sqlite    默认 memory
+    JOB_QUEUE_PATH=/tmp/tongue-jobs.sqlite3
+    JOB_WORKERS=4
+    JOB_RETENTION_SECONDS=3600    SQLite 队列中已结束任务的保留时间
+    JOB_STALE_SECONDS=600         SQLite 队列中执行超过该时间的任务视为所在进程已退出，重新入队
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), 'tongue-jobs.sqlite3')
+
+
+class Job:
+    """一个排队的任务"""
+
+    def __init__(self, job_id: str, payload: Dict[str, Any], enqueued_at: float):
+        """
+        Args:
+            job_id: 任务ID（与结果ID相同）
+            payload: 任务参数（需可JSON序列化）
+            enqueued_at: 入队时刻（time.time()，多进程间可比较）
+        """
+        self.id = job_id
+        self.payload = payload
+        self.enqueued_at = enqueued_at
+
+
+class QueueMetrics:
+    """队列统计：排队时间和执行时间的分位数、成功/失败数"""
+
+    def __init__(self, window: int = 500):
+        """
+        Args:
+            window: 保留的耗时样本数
+        """
+        self._lock = threading.Lock()
+        self._wait: Deque[float] = deque(maxlen=window)
+        self._run: Deque[float] = deque(maxlen=window)
+        self._counts = {DONE: 0, FAILED: 0}
+        self.running = 0
+
+    def started(self, wait_seconds: float):
+        with self._lock:
+            self._wait.append(wait_seconds)
+            self.running += 1
+
+    def finished(self, run_seconds: float, ok: bool):
+        with self._lock:
+            self._run.append(run_seconds)
+            self._counts[DONE if ok else FAILED] += 1
+            self.running -= 1
+
+    def snapshot(self, depth: int) -> Dict[str, Any]:
+        """导出统计数据"""
+        with self._lock:
+            return {
+                'depth': depth,
+                'running': self.running,
+                'done': self._counts[DONE],
+                'failed': self._counts[FAILED],
+                'wait': _summary(self._wait),
+                'run': _summary(self._run)
+            }
+
+
+def _summary(samples: Deque[float]) -> Dict[str, float]:
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 1),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+        'max_ms': round(ordered[-1] * 1000, 1)
+    }
+
+
+class MemoryJobQueue:
+    """进程内任务队列"""
+
+    def __init__(self, max_tracked: int = 10000):
+        """
+        Args:
+            max_tracked: 最多保留状态的任务数（超出时丢弃最早结束的）
+        """
+        self._queue: 'queue.Queue[Job]' = queue.Queue()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._finished: Deque[str] = deque()
+        self._lock = threading.Lock()
+        self.max_tracked = max_tracked
+
+    def put(self, job_id: str, payload: Dict[str, Any]):
+        """任务入队"""
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = {'state': QUEUED, 'enqueued_at': now, 'started_at': None, 'finished_at': None}
+        self._queue.put(Job(job_id, payload, now))
+
+    def take(self, timeout: float = 1.0) -> Optional[Job]:
+        """取出最早的任务并标记为执行中，超时返回 None"""
+        try:
+            job = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            info = self._jobs.get(job.id)
+            if info is not None:
+                info.update(state=RUNNING, started_at=time.time())
+        return job
+
+    def finish(self, job_id: str, ok: bool):
+        """标记任务结束"""
+        with self._lock:
+            info = self._jobs.get(job_id)
+            if info is None:
+                return
+            info.update(state=DONE if ok else FAILED, finished_at=time.time())
+            self._finished.append(job_id)
+            while len(self._jobs) > self.max_tracked and self._finished:
+                self._jobs.pop(self._finished.popleft(), None)
+
+    def info(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """任务状态和时刻；任务不存在时返回 None"""
+        with self._lock:
+            info = self._jobs.get(job_id)
+            return dict(info) if info is not None else None
+
+    def depth(self) -> int:
+        """排队中的任务数"""
+        return self._queue.qsize()
+
+    def maintain(self):
+        """定期维护（已结束任务的状态在 finish 时按数量淘汰，这里无事可做）"""
+
+
+class SQLiteJobQueue:
+    """SQLite 任务队列：多个进程共享同一个数据库文件，任意进程的工作线程都能取任务"""
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH, stale_after: float = 600.0, retention: float = 3600.0):
+        """
+        Args:
+            path: 数据库文件路径
+            stale_after: 执行超过该时间（秒）仍未结束的任务视为所在进程已退出，重新入队
+            retention: 已结束任务的保留时间（秒），由 maintain 定期删除
+        """
+        self.path = path
+        self.stale_after = stale_after
+        self.retention = retention
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._lock = threading.Lock()
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' id TEXT PRIMARY KEY, payload TEXT NOT NULL, state TEXT NOT NULL,'
+            ' enqueued_at REAL NOT NULL, started_at REAL, finished_at REAL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (state, enqueued_at)')
+        self._requeue_stale(stale_after)
+
+    def put(self, job_id: str, payload: Dict[str, Any]):
+        """任务入队"""
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO jobs (id, payload, state, enqueued_at) VALUES (?, ?, ?, ?)',
+                (job_id, json.dumps(payload, ensure_ascii=False), QUEUED, time.time())
+            )
+
+    def take(self, timeout: float = 1.0) -> Optional[Job]:
+        """取出最早的任务并标记为执行中（跨进程原子），超时返回 None"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self._claim()
+            if job is not None or time.monotonic() >= deadline:
+                return job
+            time.sleep(min(0.1, max(0.0, deadline - time.monotonic())))
+
+    def _claim(self) -> Optional[Job]:
+        with self._lock:
+            # BEGIN IMMEDIATE 取得写锁，保证同一任务只被一个进程取走
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT id, payload, enqueued_at FROM jobs WHERE state = ? ORDER BY enqueued_at LIMIT 1',
+                    (QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        'UPDATE jobs SET state = ?, started_at = ? WHERE id = ?', (RUNNING, time.time(), row[0])
+                    )
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return Job(row[0], json.loads(row[1]), row[2])
+
+    def finish(self, job_id: str, ok: bool):
+        """标记任务结束"""
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET state = ?, finished_at = ? WHERE id = ?',
+                (DONE if ok else FAILED, time.time(), job_id)
+            )
+
+    def info(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """任务状态和时刻；任务不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT state, enqueued_at, started_at, finished_at FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('state', 'enqueued_at', 'started_at', 'finished_at'), row))
+
+    def depth(self) -> int:
+        """排队中的任务数（所有进程）"""
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM jobs WHERE state = ?', (QUEUED,)).fetchone()[0]
+
+    def prune(self, ttl: float = 3600.0):
+        """删除结束超过 ttl 秒的任务"""
+        with self._lock:
+            self._conn.execute('DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?', (time.time() - ttl,))
+
+    def maintain(self):
+        """定期维护：重新入队中断的任务（所在进程崩溃），删除过期的已结束任务"""
+        self._requeue_stale(self.stale_after)
+        self.prune(self.retention)
+
+    def _requeue_stale(self, stale_after: float):
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE jobs SET state = ?, started_at = NULL WHERE state = ? AND started_at < ?',
+                (QUEUED, RUNNING, time.time() - stale_after)
+            )
+        if cursor.rowcount:
+            print(f"♻️  重新入队 {cursor.rowcount} 个中断的任务")
+
+
+class WorkerPool:
+    """从队列取任务执行的工作线程池"""
+
+    def __init__(
+        self,
+        job_queue: Any,
+        handler: Callable[[Job], bool],
+        workers: int = 4,
+        metrics: Optional[QueueMetrics] = None,
+        maintenance_interval: float = 60.0
+    ):
+        """
+        Args:
+            job_queue: MemoryJobQueue 或 SQLiteJobQueue
+            handler: 执行任务，返回是否成功（抛出异常视为失败）
+            workers: 工作线程数
+            metrics: 队列统计
+            maintenance_interval: 调用队列 maintain 的间隔（秒）
+        """
+        self.queue = job_queue
+        self.handler = handler
+        self.metrics = metrics or QueueMetrics()
+        self.maintenance_interval = maintenance_interval
+        self._next_maintenance = time.monotonic()
+        self._maintenance_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = [
+            threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._maintain()
+            job = self.queue.take(timeout=0.5)
+            if job is None:
+                continue
+
+            self.metrics.started(max(0.0, time.time() - job.enqueued_at))
+            start = time.perf_counter()
+            ok = False
+            try:
+                ok = bool(self.handler(job))
+            except Exception as e:
+                print(f"❌ 任务执行失败 ({job.id}): {e}")
+            finally:
+                self.metrics.finished(time.perf_counter() - start, ok)
+                self.queue.finish(job.id, ok)
+
+    def _maintain(self):
+        """到期时由一个工作线程执行队列维护，其余线程直接去取任务"""
+        if time.monotonic() < self._next_maintenance or not self._maintenance_lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() < self._next_maintenance:
+                return
+            self._next_maintenance = time.monotonic() + self.maintenance_interval
+            self.queue.maintain()
+        except Exception as e:
+            print(f"⚠️  任务队列维护失败: {e}")
+        finally:
+            self._maintenance_lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """队列深度、执行中任务数、排队/执行耗时分位数"""
+        return self.metrics.snapshot(self.queue.depth())
+
+    def stop(self):
+        """停止取新任务（执行中的任务会继续完成）"""
+        self._stop.set()
+
+
+def create_queue(backend: Optional[str] = None, path: Optional[str] = None) -> Any:
+    """
+    按环境变量创建任务队列
+
+    Args:
+        backend: 'memory' 或 'sqlite'，默认读取 JOB_QUEUE
+        path: SQLite 文件路径，默认读取 JOB_QUEUE_PATH
+    """
+    backend = (backend or os.getenv('JOB_QUEUE', 'memory')).lower()
+    if backend == 'sqlite':
+        return SQLiteJobQueue(
+            path or os.getenv('JOB_QUEUE_PATH', DEFAULT_SQLITE_PATH),
+            stale_after=float(os.getenv('JOB_STALE_SECONDS', '600')),
+            retention=float(os.getenv('JOB_RETENTION_SECONDS', '3600'))
+        )
+    if backend == 'memory':
+        return MemoryJobQueue()
+    raise ValueError(f"不支持的任务队列: {backend}")
@@ -0,0 +1,339 @@
+"""
+AI响应JSON工具
+- extract_json：单次前向扫描提取模型输出中的JSON，并就地修复常见缺陷
+- StreamingJSONParser：流式增量解析，边接收token边解析顶层字段
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class JSONExtractionError(ValueError):
+    """无法从模型输出中提取出合法JSON"""
+
+
+# 模型常把结构性引号、冒号、逗号写成中文/弯引号形式
+_SMART_QUOTES = '\u201c\u201d\uff02'      # “ ” ＂
+_FULLWIDTH_PUNCT = {'\uff1a': ':', '\uff0c': ','}   # ： ，
+
+
+def extract_json(text: str) -> Any:
+    """
+    从模型输出中提取JSON（对象或数组）
+
+    单次前向扫描，跟踪括号深度与字符串状态，兼容 ```json 围栏、
+    前后说明文字和无围栏输出。扫描过程中顺带修复：
+    - 尾随逗号：{"a": 1,} / [1, 2,]
+    - 结构位置上的弯引号/全角标点：{“a”： 1}
+    - 截断的结尾：未闭合的字符串和括号会被补齐
+
+    Args:
+        text: 模型原始输出
+
+    Returns:
+        解析后的 dict 或 list
+
+    Raises:
+        JSONExtractionError: 找不到可解析的JSON
+    """
+    pos = 0
+    length = len(text)
+
+    while pos < length:
+        # 定位下一个候选起点
+        start = _find_container_start(text, pos)
+        if start < 0:
+            break
+
+        candidate, end = _scan_candidate(text, start)
+        if candidate is not None:
+            try:
+                return json.loads(candidate, strict=False)
+            except json.JSONDecodeError:
+                pass
+
+        # 候选失败（如说明文字里的 {体质}），从它的结尾继续向前扫描，
+        # 不回头进入其内部，避免把嵌套的子对象误当成结果
+        pos = end
+
+    raise JSONExtractionError('未找到可解析的JSON')
+
+
+def _find_container_start(text: str, pos: int) -> int:
+    """返回 pos 之后第一个 '{' 或 '[' 的位置"""
+    brace = text.find('{', pos)
+    bracket = text.find('[', pos)
+    if brace < 0:
+        return bracket
+    if bracket < 0:
+        return brace
+    return min(brace, bracket)
+
+
+def _scan_candidate(text: str, start: int) -> Tuple[Optional[str], int]:
+    """
+    从 start 开始扫描一个完整的JSON值
+
+    Returns:
+        (JSON文本, 结束位置)。无需修复时直接返回原文切片，
+        只有遇到需要修复的字符才会开始构建新的字符列表
+    """
+    out: Optional[List[str]] = None   # 惰性创建：仅在需要修复时分配
+    stack: List[str] = []             # 容器栈：'{' 或 '['
+    expect: List[str] = []            # 每层期待的下一个记号：key/colon/value/comma
+    in_string = False
+    string_close = '"'
+    escape = False
+    last_sig = -1                     # 最近一个非空白输出字符在输出中的位置
+    out_len = 0                       # 输出长度（out 为 None 时即原文偏移）
+
+    def materialize(upto: int) -> List[str]:
+        return list(text[start:upto])
+
+    i = start
+    length = len(text)
+    while i < length:
+        ch = text[i]
+        emit = ch
+
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch in string_close:
+                in_string = False
+                emit = '"'
+                _after_value(stack, expect, is_key_candidate=True)
+            if emit != ch and out is None:
+                out = materialize(i)
+        else:
+            if ch in _FULLWIDTH_PUNCT:
+                emit = _FULLWIDTH_PUNCT[ch]
+                ch = emit
+                if out is None:
+                    out = materialize(i)
+
+            if ch == '"' or ch in _SMART_QUOTES:
+                in_string = True
+                string_close = '"' if ch == '"' else _SMART_QUOTES + '"'
+                if ch != '"':
+                    emit = '"'
+                    if out is None:
+                        out = materialize(i)
+            elif ch in '{[':
+                stack.append(ch)
+                expect.append('key' if ch == '{' else 'value')
+            elif ch in '}]':
+                if not stack:
+                    return None, i
+                if last_sig >= 0 and _char_at(text, start, out, last_sig) == ',':
+                    # 去掉尾随逗号
+                    if out is None:
+                        out = materialize(i)
+                    out[last_sig] = ' '
+                stack.pop()
+                expect.pop()
+                if not stack:
+                    if out is None:
+                        return text[start:i + 1], i + 1
+                    out.append(emit)
+                    return ''.join(out), i + 1
+                _after_value(stack, expect)
+            elif ch == ':':
+                if expect:
+                    expect[-1] = 'value'
+            elif ch == ',':
+                if expect:
+                    expect[-1] = 'key' if stack[-1] == '{' else 'value'
+            elif not ch.isspace():
+                if expect and expect[-1] == 'value':
+                    expect[-1] = 'comma'
+
+        if out is not None:
+            out.append(emit)
+            out_len = len(out)
+        else:
+            out_len = i - start + 1
+        if not emit.isspace():
+            last_sig = out_len - 1
+        i += 1
+
+    # 到达结尾仍未闭合：输出被截断，补齐字符串和括号
+    if not stack:
+        return None, length
+    if out is None:
+        out = materialize(length)
+    if in_string:
+        if escape:
+            out.pop()
+        out.append('"')
+        _after_value(stack, expect, is_key_candidate=True)
+    _close_truncated(out, stack, expect)
+    return ''.join(out), length
+
+
+def _char_at(text: str, start: int, out: Optional[List[str]], index: int) -> str:
+    """读取输出中 index 位置的字符"""
+    if out is None:
+        return text[start + index]
+    return out[index]
+
+
+def _after_value(stack: List[str], expect: List[str], is_key_candidate: bool = False):
+    """一个值（或对象的键）结束后更新期待状态"""
+    if not expect:
+        return
+    if is_key_candidate and stack[-1] == '{' and expect[-1] == 'key':
+        expect[-1] = 'colon'
+    else:
+        expect[-1] = 'comma'
+
+
+def _close_truncated(out: List[str], stack: List[str], expect: List[str]):
+    """补齐被截断的结尾"""
+    state = expect[-1]
+    if state == 'colon':
+        out.append(':null')
+    elif state == 'value' and stack[-1] == '{':
+        out.append('null')
+
+    # 去掉悬空的逗号
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ',':
+        out.pop()
+
+    for opener in reversed(stack):
+        out.append('}' if opener == '{' else ']')
+
+
+class StreamingJSONParser:
+    """
+    顶层JSON对象的增量解析器
+
+    逐段喂入模型输出的文本（可以带 ```json 围栏或前后说明文字），
+    每当根对象的一个顶层字段（如 tongue_body、constitution）完整结束时，
+    立即返回 (key, value)。只缓存当前正在接收的字段文本，不保留整段响应。
+    """
+
+    # 解析状态
+    _SEEK_ROOT = 0    # 寻找根对象的 '{'
+    _SEEK_KEY = 1     # 寻找字段名的起始引号
+    _IN_KEY = 2       # 读取字段名
+    _SEEK_COLON = 3   # 寻找 ':'
+    _SEEK_VALUE = 4   # 寻找字段值的起始字符
+    _IN_VALUE = 5     # 读取字段值
+    _DONE = 6         # 根对象已结束
+
+    def __init__(self):
+        self._state = self._SEEK_ROOT
+        self._key_chars: List[str] = []
+        self._value_chars: List[str] = []
+        self._key = ''
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.sections: Dict[str, Any] = {}
+        self.errors = 0
+
+    @property
+    def done(self) -> bool:
+        """根对象是否已经完整结束"""
+        return self._state == self._DONE
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        """
+        喂入一段文本
+
+        Args:
+            text: 新收到的模型输出片段
+
+        Returns:
+            本次新完成的顶层字段列表 [(key, value), ...]
+        """
+        completed = []
+
+        for ch in text:
+            state = self._state
+
+            if state == self._IN_VALUE:
+                if self._in_string:
+                    self._value_chars.append(ch)
+                    if self._escape:
+                        self._escape = False
+                    elif ch == '\\':
+                        self._escape = True
+                    elif ch == '"':
+                        self._in_string = False
+                    continue
+
+                if ch == '"':
+                    self._in_string = True
+                elif ch in '{[':
+                    self._depth += 1
+                elif ch in '}]':
+                    if self._depth == 0:
+                        # 根对象结束，最后一个字段随之完成
+                        self._finish_value(completed)
+                        self._state = self._DONE
+                        continue
+                    self._depth -= 1
+                elif ch == ',' and self._depth == 0:
+                    self._finish_value(completed)
+                    self._state = self._SEEK_KEY
+                    continue
+                self._value_chars.append(ch)
+
+            elif state == self._SEEK_ROOT:
+                if ch == '{':
+                    self._state = self._SEEK_KEY
+
+            elif state == self._SEEK_KEY:
+                if ch == '"':
+                    self._key_chars = []
+                    self._state = self._IN_KEY
+                elif ch == '}':
+                    self._state = self._DONE
+
+            elif state == self._IN_KEY:
+                if self._escape:
+                    self._key_chars.append(ch)
+                    self._escape = False
+                elif ch == '\\':
+                    self._key_chars.append(ch)
+                    self._escape = True
+                elif ch == '"':
+                    self._key = json.loads('"' + ''.join(self._key_chars) + '"')
+                    self._state = self._SEEK_COLON
+                else:
+                    self._key_chars.append(ch)
+
+            elif state == self._SEEK_COLON:
+                if ch == ':':
+                    self._state = self._SEEK_VALUE
+
+            elif state == self._SEEK_VALUE:
+                if not ch.isspace():
+                    self._value_chars = []
+                    self._depth = 0
+                    self._in_string = False
+                    self._escape = False
+                    self._state = self._IN_VALUE
+                    # 重新处理当前字符
+                    completed.extend(self.feed(ch))
+
+        return completed
+
+    def _finish_value(self, completed: List[Tuple[str, Any]]):
+        """结束当前字段，解析其值"""
+        value_text = ''.join(self._value_chars).strip()
+        self._value_chars = []
+        try:
+            value = json.loads(value_text)
+        except json.JSONDecodeError:
+            # 单个字段损坏不影响其他字段，整体结果由调用方兜底解析
+            self.errors += 1
+            return
+        self.sections[self._key] = value
+        completed.append((self._key, value))
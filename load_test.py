@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+压测工具 - 按目标RPS向 app.py 发送请求，统计延迟分位数、吞吐量和错误率
+
+开环发压：按固定节奏发出请求，延迟从计划发出时刻算起，服务变慢时不会
+自动降低压力（避免协调遗漏，coordinated omission）
+
+analyze 场景每个请求上传内容不同的图片（在角落写入随机噪声后重新编码）：服务端按内容哈希
+去重并合并相同图片的升级请求，重复上传同一张图只会命中缓存，测不到大模型调用路径。
+--same-image 单独压测缓存命中路径
+
+用法（DeepSeek 客户端需要 openai SDK：pip install -r requirements.txt）：
+    python stub_llm_server.py --latency lognormal:2.0,0.5 &
+    DEEPSEEK_BASE_URL=http://127.0.0.1:8900 DEEPSEEK_API_KEY=stub python app.py &
+    python load_test.py --url http://127.0.0.1:5001 --rps 20 --duration 30 --mix analyze:1,demo-analyze:3,demo:1
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+DEMO_CASES = ['healthy', 'qi_deficiency', 'blood_stasis', 'yin_deficiency', 'damp_heat']
+
+
+def sample_image() -> bytes:
+    """生成一张合成舌象图片（JPEG）"""
+    import cv2
+    import numpy as np
+
+    image = np.full((960, 1280, 3), 40, np.uint8)
+    cv2.ellipse(image, (640, 480), (420, 380), 0, 0, 360, (170, 160, 230), -1)
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return encoded.tobytes()
+
+
+class ImageVariants:
+    """为每个请求生成内容不同、画面几乎相同的上传图片"""
+
+    # 写入随机噪声的角落区域边长（像素），远离舌体，不影响特征提取
+    NOISE_SIDE = 8
+
+    def __init__(self, image: bytes, same: bool = False):
+        """
+        Args:
+            image: 原始图片
+            same: 每次都返回原图（压测缓存命中路径）
+        """
+        self.image = image
+        self.same = same
+        self._pixels = None
+        if not same:
+            try:
+                import cv2
+                import numpy as np
+                self._pixels = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+            except ImportError:
+                pass
+            if self._pixels is None and image[:2] != b'\xff\xd8':
+                print("⚠️  无法为非 JPEG 图片生成变体（需要 OpenCV），所有请求上传同一张图片")
+
+    def next(self) -> bytes:
+        """下一个请求上传的图片"""
+        if self.same:
+            return self.image
+        if self._pixels is not None:
+            import cv2
+            import numpy as np
+
+            pixels = self._pixels.copy()
+            side = self.NOISE_SIDE
+            pixels[:side, :side] = np.frombuffer(os.urandom(side * side * 3), np.uint8).reshape(side, side, 3)
+            ok, encoded = cv2.imencode('.jpg', pixels, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            if ok:
+                return encoded.tobytes()
+        if self.image[:2] == b'\xff\xd8':
+            # 没有 OpenCV：在 SOI 之后插入一个注释段（COM），像素不变、内容哈希不同
+            marker = uuid.uuid4().hex.encode('ascii')
+            return self.image[:2] + b'\xff\xfe' + (len(marker) + 2).to_bytes(2, 'big') + marker + self.image[2:]
+        return self.image
+
+
+def multipart(field: str, filename: str, content: bytes) -> Tuple[bytes, str]:
+    """编码 multipart/form-data 请求体"""
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f"Content-Type: image/jpeg\r\n\r\n"
+    ).encode('utf-8') + content + f"\r\n--{boundary}--\r\n".encode('utf-8')
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+class Results:
+    """按场景汇总请求结果（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+        self.bytes_received = 0
+
+    def record(self, scenario: str, seconds: float, error: Optional[str], size: int = 0):
+        with self._lock:
+            self.latencies.setdefault(scenario, []).append(seconds)
+            self.bytes_received += size
+            if error:
+                errors = self.errors.setdefault(scenario, {})
+                errors[error] = errors.get(error, 0) + 1
+
+
+class LoadGenerator:
+    """开环压测：按目标RPS调度请求"""
+
+    def __init__(
+        self,
+        base_url: str,
+        mix: Dict[str, float],
+        image: Optional[bytes] = None,
+        timeout: float = 60.0,
+        max_workers: int = 256,
+        same_image: bool = False
+    ):
+        """
+        Args:
+            base_url: 服务地址
+            mix: 场景权重，如 {'analyze': 1, 'demo-analyze': 3, 'demo': 1}
+            image: /api/analyze 上传的图片
+            timeout: 单个请求超时（秒）
+            max_workers: 最大并发请求数
+            same_image: 每个请求上传完全相同的图片（默认每个请求生成一个变体）
+        """
+        self.base_url = base_url.rstrip('/')
+        self.mix = mix
+        self.images = ImageVariants(image, same_image) if image is not None else None
+        self.timeout = timeout
+        self.results = Results()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='load')
+
+    def run(self, rps: float, duration: float) -> float:
+        """
+        发压
+
+        Returns:
+            实际发压时长（秒）
+        """
+        scenarios = list(self.mix)
+        weights = [self.mix[name] for name in scenarios]
+        interval = 1 / rps
+        start = time.monotonic()
+        sent = 0
+
+        while True:
+            scheduled = start + sent * interval
+            if scheduled - start >= duration:
+                break
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            scenario = random.choices(scenarios, weights)[0]
+            self._pool.submit(self._request, scenario, scheduled)
+            sent += 1
+
+        self._pool.shutdown(wait=True)
+        return time.monotonic() - start
+
+    def _request(self, scenario: str, scheduled: float):
+        if scenario == 'analyze':
+            body, content_type = multipart('tongue_image', 'tongue.jpg', self.images.next())
+            req = urllib.request.Request(
+                f"{self.base_url}/api/analyze", data=body, headers={'Content-Type': content_type}
+            )
+        elif scenario == 'demo-analyze':
+            req = urllib.request.Request(f"{self.base_url}/api/demo-analyze/{random.choice(DEMO_CASES)}")
+        elif scenario == 'demo':
+            req = urllib.request.Request(f"{self.base_url}/demo")
+        else:
+            raise ValueError(f"未知场景: {scenario}")
+
+        error = None
+        size = 0
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                size = len(response.read())
+        except urllib.error.HTTPError as e:
+            error = f"HTTP {e.code}"
+        except Exception as e:
+            error = type(e).__name__
+
+        # 延迟从计划发出时刻算起，包含在本地排队的时间
+        self.results.record(scenario, time.monotonic() - scheduled, error, size)
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def print_report(results: Results, elapsed: float):
+    """打印压测报告"""
+    total = sum(len(v) for v in results.latencies.values())
+    total_errors = sum(sum(e.values()) for e in results.errors.values())
+
+    print("=" * 78)
+    print(f"{'场景':<14}{'请求数':>8}{'吞吐/s':>9}{'错误率':>8}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+    print("-" * 78)
+    for scenario, latencies in sorted(results.latencies.items()):
+        errors = sum(results.errors.get(scenario, {}).values())
+        print(
+            f"{scenario:<14}{len(latencies):>8}{len(latencies) / elapsed:>9.1f}"
+            f"{errors / len(latencies):>8.1%}"
+            f"{percentile(latencies, 0.5) * 1000:>8.0f}ms{percentile(latencies, 0.9) * 1000:>7.0f}ms"
+            f"{percentile(latencies, 0.99) * 1000:>7.0f}ms{max(latencies) * 1000:>7.0f}ms"
+        )
+    print("-" * 78)
+    print(f"合计 {total} 个请求，{elapsed:.1f}s，吞吐 {total / elapsed:.1f}/s，"
+          f"错误率 {total_errors / total:.1%}，接收 {results.bytes_received / 1024 / 1024:.1f} MB")
+    for scenario, errors in sorted(results.errors.items()):
+        detail = '，'.join(f"{name} × {count}" for name, count in errors.items())
+        print(f"⚠️  {scenario}: {detail}")
+    print("=" * 78)
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """解析场景权重：analyze:1,demo-analyze:3,demo:1"""
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition(':')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='舌象分析服务压测')
+    parser.add_argument('--url', default='http://127.0.0.1:5001', help='服务地址')
+    parser.add_argument('--rps', type=float, default=10, help='目标每秒请求数')
+    parser.add_argument('--duration', type=float, default=30, help='发压时长（秒）')
+    parser.add_argument('--mix', default='analyze:1,demo-analyze:3,demo:1', help='场景权重')
+    parser.add_argument('--image', help='上传的舌象图片，默认生成合成图片')
+    parser.add_argument('--timeout', type=float, default=60, help='单个请求超时（秒）')
+    parser.add_argument('--same-image', action='store_true',
+                        help='每个请求上传同一张图片（压测去重缓存路径，默认每个请求上传不同的变体）')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    image = None
+    if 'analyze' in mix:
+        if args.image:
+            with open(args.image, 'rb') as f:
+                image = f.read()
+        else:
+            try:
+                image = sample_image()
+            except ImportError:
+                print("❌ 未安装 OpenCV，请用 --image 指定上传图片")
+                sys.exit(1)
+
+    print(f"🚀 压测 {args.url}：{args.rps} RPS × {args.duration}s，场景 {mix}")
+    generator = LoadGenerator(args.url, mix, image=image, timeout=args.timeout, same_image=args.same_image)
+    elapsed = generator.run(args.rps, args.duration)
+    print_report(generator.results, elapsed)
+
+
+if __name__ == "__main__":
+    main()
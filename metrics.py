@@ -0,0 +1,245 @@
+"""
+进程内指标与 Prometheus 文本格式导出
+计数器、直方图按标签组合累加，记录一次只是一次加锁的字典更新和二分查找；
+已有的统计对象（任务队列、请求合并、对冲、分级）通过采集函数在导出时读取
+
+预派生模式下每个 worker 进程各有一份指标，/metrics 返回处理该请求的 worker 的数据
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 默认直方图分桶（秒）：覆盖毫秒级的本地处理到数十秒的大模型调用
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 采集函数返回的样本：(指标名, 类型, 说明, [(标签, 值)])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """带标签的指标基类"""
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelKey:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    """分桶直方图（累计计数、总和）"""
+
+    kind = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签 -> [各桶计数（含 +Inf）, 总和]
+        self._values: Dict[LabelKey, List[Any]] = {}
+
+    def observe(self, value: float, **labels: Any):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """记录代码块的耗时（异常时同样记录）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: Any) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return sum(entry[0]) if entry else 0
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = self.header()
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], List[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric: _Metric) -> Any:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # 模块被重复导入时沿用已有的指标
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def register_collector(self, collector: Callable[[], List[Sample]]):
+        """
+        注册采集函数（导出时调用，读取已有统计对象的当前值）
+
+        Args:
+            collector: 返回 [(指标名, 'gauge'/'counter', 说明, [(标签, 值)])]
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def expose(self) -> str:
+        """Prometheus 文本格式（version 0.0.4）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        for collector in collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                print(f"⚠️  指标采集失败: {e}")
+                continue
+            for name, kind, documentation, values in samples:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in values:
+                    label_text = _format_labels(list(labels), list(labels.values()))
+                    lines.append(f"{name}{label_text} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# ---- 各模块共用的指标 ----
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'tongue_http_request_duration_seconds', '请求处理耗时（流式响应只计到响应头发出）',
+    ('route', 'method', 'status')
+)
+EXTRACTOR_STAGE_SECONDS = REGISTRY.histogram(
+    'tongue_extractor_stage_duration_seconds', '特征提取各阶段耗时', ('stage',)
+)
+PROVIDER_CALL_SECONDS = REGISTRY.histogram(
+    'tongue_provider_call_duration_seconds', '提供商单次调用耗时（每次重试单独计）',
+    ('provider', 'model', 'outcome')
+)
+PROVIDER_ERRORS = REGISTRY.counter(
+    'tongue_provider_errors_total', '提供商调用错误数（按异常类型）', ('provider', 'model', 'error')
+)
+PROVIDER_REJECTED = REGISTRY.counter(
+    'tongue_provider_rejected_total', '未发出的提供商调用（熔断或本地限流）', ('provider', 'reason')
+)
+ANALYSIS_FALLBACKS = REGISTRY.counter(
+    'tongue_analysis_fallback_total', '大模型模式下回退到规则引擎报告的次数', ('provider', 'reason')
+)
+JSON_PARSE = REGISTRY.counter(
+    'tongue_llm_json_parse_total', '模型输出的JSON解析次数', ('result',)
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    'tongue_cache_requests_total', '响应缓存查询次数', ('cache', 'result')
+)
+DERIVATIVE_SECONDS = REGISTRY.histogram(
+    'tongue_derivative_duration_seconds', '派生图片（缩略图、模型输入、存档）生成耗时', ('kind',)
+)
+ADMISSION_DECISIONS = REGISTRY.counter(
+    'tongue_admission_total', '分析请求的准入结果（接受、降级为本地报告、拒绝）', ('priority', 'outcome')
+)
+PROFILES_WRITTEN = REGISTRY.counter(
+    'tongue_profiles_total', '写出的请求剖析（按比例抽中或超过耗时阈值）', ('reason',)
+)
@@ -0,0 +1,68 @@
+"""
+预先计算的静态响应
+演示报告、演示页面、已完成的分析结果等内容不再变化：序列化并按每种编码压缩一次，
+之后每个请求直接发送现成的字节；内容哈希作 ETag，浏览器重新验证时返回 304，不再传输响应体
+"""
+
+import hashlib
+from typing import Dict, Optional
+
+from flask import Request, Response
+
+from response_encoding import STATIC_LEVELS, available_encodings, compress, min_compress_bytes, negotiate
+
+# 演示内容只随部署变化：短期缓存，过期后凭 ETag 重新验证
+DEFAULT_CACHE_CONTROL = 'public, max-age=300'
+
+
+class PrecomputedResponse:
+    """序列化好的响应体及其各编码的压缩版本"""
+
+    def __init__(self, body: bytes, mimetype: str, cache_control: str = DEFAULT_CACHE_CONTROL):
+        """
+        Args:
+            body: 响应体
+            mimetype: 内容类型
+            cache_control: Cache-Control 响应头
+        """
+        self.body = body
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+
+        # 编码 -> 压缩后的字节（只保留确实变小的）
+        self.encoded: Dict[str, bytes] = {}
+        if len(body) >= min_compress_bytes():
+            for encoding in available_encodings():
+                compressed = compress(body, encoding, STATIC_LEVELS[encoding])
+                if len(compressed) < len(body):
+                    self.encoded[encoding] = compressed
+
+    def respond(self, request: Request) -> Response:
+        """
+        按请求头返回 304、压缩或原始响应
+
+        Args:
+            request: 当前请求（读取 If-None-Match 和 Accept-Encoding）
+        """
+        encoding: Optional[str] = negotiate(request, self.encoded) if self.encoded else None
+        # 不同编码是不同的表示，ETag 也要区分（否则缓存可能把压缩体发给不支持的客户端）
+        etag = f"{self.etag}-{encoding}" if encoding else self.etag
+
+        # 客户端持有任一编码的表示都说明内容未变
+        if any(request.if_none_match.contains(tag) for tag in self._etags()):
+            response = Response(status=304)
+        else:
+            response = Response(self.encoded[encoding] if encoding else self.body, mimetype=self.mimetype)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = self.cache_control
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def _etags(self):
+        yield self.etag
+        for encoding in self.encoded:
+            yield f"{self.etag}-{encoding}"
@@ -6,7 +6,17 @@
 import os
 import json
 import base64
-from typing import Dict, Any
+from typing import Dict, Any, Iterator
+
+from streaming import stream_report, result_events
+from json_utils import extract_json
+from resilience import get_guard
+from deadline import check_stage, request_timeout
+from derivatives import model_input_path
+from tracing import span
+
+# 单次调用的超时上限（秒），有请求时限时取剩余预算与之的较小者
+PROVIDER_TIMEOUT = 90.0
 
 class ProfessionalTongueAnalyzer:
     """专业级舌象分析器 - 使用视觉AI模型"""
@@ -72,17 +82,87 @@ class ProfessionalTongueAnalyzer:
         elif self.provider == "gemini":
             return self._analyze_with_gemini(image_path)
 
+    def analyze_image_stream(self, image_path: str) -> Iterator[Dict[str, Any]]:
+        """
+        流式专业级舌象分析，每完成一个顶层字段立即产出
+
+        Args:
+            image_path: 图片路径
+
+        Returns:
+            事件迭代器，格式见 streaming.stream_report
+        """
+        if self.provider != "claude":
+            yield from result_events(self.analyze_image(image_path))
+            return
+
+        print(f"\n🔬 使用 CLAUDE 进行流式专业级舌象分析...")
+
+        request = self._build_claude_request(image_path)
+
+        def text_stream():
+            check_stage('provider')
+            manager = get_guard('claude').call(
+                self.client.messages.stream, timeout=request_timeout(PROVIDER_TIMEOUT), **request
+            )
+            with manager as stream:
+                yield from stream.text_stream
+
+        yield from stream_report(
+            text_stream(),
+            self._parse_json_response,
+            {
+                'provider': 'claude-vision',
+                'model': 'claude-3-5-sonnet',
+                'analysis_type': 'professional'
+            }
+        )
+
     def _analyze_with_claude(self, image_path: str) -> Dict[str, Any]:
         """使用 Claude 3.5 Sonnet Vision 分析（最推荐）"""
 
-        # 读取并编码图片
-        with open(image_path, 'rb') as f:
-            image_data = base64.b64encode(f.read()).decode('utf-8')
+        request = self._build_claude_request(image_path)
+
+        try:
+            # 调用 Claude API
+            check_stage('provider')
+            message = get_guard('claude').call(
+                self.client.messages.create, timeout=request_timeout(PROVIDER_TIMEOUT), **request
+            )
+
+            # 解析响应
+            response_text = message.content[0].text
 
-        # 确定图片格式
-        if image_path.lower().endswith('.png'):
+            # 提取JSON
+            result = self._parse_json_response(response_text)
+            result['provider'] = 'claude-vision'
+            result['model'] = 'claude-3-5-sonnet'
+            result['analysis_type'] = 'professional'
+
+            print("✅ Claude Vision 专业分析完成")
+            return result
+
+        except Exception as e:
+            print(f"❌ Claude API 调用失败: {e}")
+            raise
+
+    def _build_claude_request(self, image_path: str) -> Dict[str, Any]:
+        """构建 Claude 请求参数"""
+
+        # 读取并编码图片
+        check_stage('encode_image')
+        with span('encode_image') as encode_span:
+            # 发送缩小后的 JPEG（长边 DERIVATIVE_MODEL_SIDE）：手机原图可能超过 Claude 约 5MB 的图片上限
+            model_input = model_input_path(image_path)
+            with open(model_input, 'rb') as f:
+                raw = f.read()
+            image_data = base64.b64encode(raw).decode('utf-8')
+            encode_span.set(image_bytes=len(raw), payload_bytes=len(image_data))
+
+        # 确定图片格式（派生图片为 JPEG；非上传目录的图片使用原图）
+        if model_input.lower().endswith('.png'):
             media_type = "image/png"
-        elif image_path.lower().endswith('.webp'):
+        elif model_input.lower().endswith('.webp'):
             media_type = "image/webp"
         else:
             media_type = "image/jpeg"
@@ -230,48 +310,30 @@ class ProfessionalTongueAnalyzer:
 4. 提供的建议必须安全、可操作
 5. 强调不能替代医生诊断"""
 
-        try:
-            # 调用 Claude API
-            message = self.client.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=4000,
-                temperature=0.3,  # 降低temperature提高准确性
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": media_type,
-                                    "data": image_data,
-                                },
+        return {
+            "model": "claude-3-5-sonnet-20241022",
+            "max_tokens": 4000,
+            "temperature": 0.3,  # 降低temperature提高准确性
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": media_type,
+                                "data": image_data,
                             },
-                            {
-                                "type": "text",
-                                "text": prompt
-                            }
-                        ],
-                    }
-                ],
-            )
-
-            # 解析响应
-            response_text = message.content[0].text
-
-            # 提取JSON
-            result = self._parse_json_response(response_text)
-            result['provider'] = 'claude-vision'
-            result['model'] = 'claude-3-5-sonnet'
-            result['analysis_type'] = 'professional'
-
-            print("✅ Claude Vision 专业分析完成")
-            return result
-
-        except Exception as e:
-            print(f"❌ Claude API 调用失败: {e}")
-            raise
+                        },
+                        {
+                            "type": "text",
+                            "text": prompt
+                        }
+                    ],
+                }
+            ],
+        }
 
     def _analyze_with_gpt4(self, image_path: str) -> Dict[str, Any]:
         """使用 GPT-4 Vision 分析"""
@@ -287,21 +349,9 @@ class ProfessionalTongueAnalyzer:
     def _parse_json_response(self, response: str) -> Dict[str, Any]:
         """从AI响应中提取JSON"""
         try:
-            # 尝试提取JSON部分
-            if "```json" in response:
-                json_start = response.find("```json") + 7
-                json_end = response.find("```", json_start)
-                json_str = response[json_start:json_end].strip()
-            elif "{" in response and "}" in response:
-                json_start = response.find("{")
-                json_end = response.rfind("}") + 1
-                json_str = response[json_start:json_end]
-            else:
-                json_str = response
-
-            return json.loads(json_str)
-
-        except json.JSONDecodeError as e:
+            return extract_json(response)
+
+        except ValueError as e:
             print(f"❌ JSON解析失败: {e}")
             return {
                 'error': 'JSON解析失败',
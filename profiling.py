@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+生产环境的抽样剖析
+对分析接口按比例抽样（或只保留慢请求），在进程内采集请求线程的调用栈和 tracemalloc
+内存分配快照，写成火焰图工具可直接读取的折叠栈文件（flamegraph.pl、speedscope、
+inferno 均支持），附带请求元数据。不需要在生产 worker 上挂调试器，就能在真实流量下
+找到特征提取、JSON 和 base64 处理中的热点
+
+- 调用栈：后台线程每 PROFILE_INTERVAL_MS 毫秒读取一次登记线程的当前栈（sys._current_frames），
+  请求线程本身不做额外工作；只覆盖请求线程，线程池中的工作（批量、对冲）不在其中
+- 内存分配：只对抽中的请求开启 tracemalloc（开销较大），请求结束时与开始时的快照比较；
+  tracemalloc 按进程统计，并发请求的分配会混在一起
+- 慢请求：PROFILE_SLOW_SECONDS > 0 时每个请求都采集调用栈，超过阈值才写文件（不含内存分配）
+
+每次剖析写三个文件（<目录>/<时间>_<ID>.*）：
+    .cpu.folded     调用栈折叠格式：每行 "栈帧;栈帧;... 样本数"
+    .alloc.folded   新增内存分配（字节数）的折叠栈，仅抽中的请求
+    .json           请求元数据（路径、状态码、耗时、追踪ID、样本数、分配最多的代码行）
+
+环境变量：
+    PROFILE_SAMPLE_RATE=0            剖析的请求比例（含内存分配），0 表示不抽样
+    PROFILE_SLOW_SECONDS=0           耗时超过该值的请求保留调用栈剖析，0 表示不按耗时保留
+    PROFILE_INTERVAL_MS=10           调用栈采样间隔（毫秒）
+    PROFILE_DIR=logs/profiles        输出目录
+    PROFILE_MAX_PROFILES=200         目录中保留的剖析数，超出时删除最早的
+    PROFILE_TRACEMALLOC_FRAMES=25    内存分配记录的栈深度
+
+生成火焰图：flamegraph.pl logs/profiles/<文件>.cpu.folded > cpu.svg
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from metrics import PROFILES_WRITTEN
+
+# 元数据中列出的分配最多的代码行数
+_TOP_ALLOCATIONS = 15
+
+
+def sample_rate() -> float:
+    return float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+
+
+def slow_seconds() -> float:
+    return float(os.getenv('PROFILE_SLOW_SECONDS', '0'))
+
+
+def enabled() -> bool:
+    return sample_rate() > 0 or slow_seconds() > 0
+
+
+def _frame_label(code: Any) -> str:
+    # 折叠格式以分号分隔栈帧、以最后一个空格分隔样本数，栈帧名中不能有分号
+    label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label.replace(';', ',')
+
+
+def collapse(frame: Any) -> str:
+    """把栈帧链转换为折叠栈（从最外层到当前帧，分号分隔）"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class Profile:
+    """一个请求的剖析数据"""
+
+    def __init__(self, thread_id: int, sampled: bool, metadata: Dict[str, Any]):
+        """
+        Args:
+            thread_id: 处理请求的线程（threading.get_ident）
+            sampled: 按比例抽中（同时采集内存分配）
+            metadata: 请求元数据
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.thread_id = thread_id
+        self.sampled = sampled
+        self.metadata = metadata
+        self.start = time.time()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.allocations_start: Optional[tracemalloc.Snapshot] = None
+
+
+class StackSampler:
+    """后台采样线程：定时读取登记线程的调用栈（没有登记线程时休眠）"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._profiles: Dict[int, Profile] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+        self._thread.start()
+
+    def add(self, profile: Profile):
+        with self._lock:
+            self._profiles[profile.thread_id] = profile
+        self._wake.set()
+
+    def remove(self, profile: Profile):
+        with self._lock:
+            if self._profiles.get(profile.thread_id) is profile:
+                del self._profiles[profile.thread_id]
+            if not self._profiles:
+                self._wake.clear()
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                profiles = list(self._profiles.values())
+            if not profiles:
+                continue
+            frames = sys._current_frames()
+            for profile in profiles:
+                frame = frames.get(profile.thread_id)
+                if frame is not None and profile.thread_id != own:
+                    profile.stacks[collapse(frame)] += 1
+                    profile.samples += 1
+            del frames
+
+
+# 开启 tracemalloc 的抽样请求数：第一个开启，最后一个结束时关闭（由本模块开启时）
+_allocation_users = 0
+_allocation_started = False
+_allocation_lock = threading.Lock()
+
+
+def _allocations_begin() -> Optional[tracemalloc.Snapshot]:
+    global _allocation_users, _allocation_started
+    with _allocation_lock:
+        if _allocation_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(int(os.getenv('PROFILE_TRACEMALLOC_FRAMES', '25')))
+            _allocation_started = True
+        _allocation_users += 1
+    return _filtered(tracemalloc.take_snapshot())
+
+
+def _allocations_end() -> Optional[tracemalloc.Snapshot]:
+    global _allocation_users, _allocation_started
+    snapshot = _filtered(tracemalloc.take_snapshot()) if tracemalloc.is_tracing() else None
+    with _allocation_lock:
+        _allocation_users -= 1
+        if _allocation_users == 0 and _allocation_started:
+            tracemalloc.stop()
+            _allocation_started = False
+    return snapshot
+
+
+def _filtered(snapshot: tracemalloc.Snapshot) -> tracemalloc.Snapshot:
+    # 去掉 tracemalloc 自身和剖析代码的分配
+    return snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__)
+    ])
+
+
+def allocation_stacks(end: tracemalloc.Snapshot, start: tracemalloc.Snapshot) -> List[str]:
+    """两个快照之间新增分配的折叠栈，权重为字节数"""
+    lines = []
+    for stat in end.compare_to(start, 'traceback'):
+        if stat.size_diff <= 0:
+            continue
+        # tracemalloc 的栈从最外层到最近一帧排列
+        stack = ';'.join(f"{os.path.basename(frame.filename)}:{frame.lineno}" for frame in stat.traceback)
+        lines.append(f"{stack} {stat.size_diff}")
+    return lines
+
+
+def top_allocations(end: tracemalloc.Snapshot, start: tracemalloc.Snapshot) -> List[Dict[str, Any]]:
+    """新增分配最多的代码行"""
+    top = []
+    for stat in end.compare_to(start, 'lineno')[:_TOP_ALLOCATIONS]:
+        if stat.size_diff <= 0:
+            break
+        frame = stat.traceback[0]
+        top.append({
+            'location': f"{frame.filename}:{frame.lineno}",
+            'size_kb': round(stat.size_diff / 1024, 1),
+            'count': stat.count_diff
+        })
+    return top
+
+
+class Profiler:
+    """按请求开始和结束剖析，结果在后台线程中写文件"""
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        rate: Optional[float] = None,
+        slow: Optional[float] = None,
+        interval: Optional[float] = None,
+        max_profiles: Optional[int] = None
+    ):
+        """
+        Args:
+            directory: 输出目录，默认读取 PROFILE_DIR
+            rate: 抽样比例，默认读取 PROFILE_SAMPLE_RATE
+            slow: 慢请求阈值（秒），默认读取 PROFILE_SLOW_SECONDS
+            interval: 调用栈采样间隔（秒），默认读取 PROFILE_INTERVAL_MS
+            max_profiles: 保留的剖析数，默认读取 PROFILE_MAX_PROFILES
+        """
+        self.directory = directory or os.getenv('PROFILE_DIR', 'logs/profiles')
+        self.rate = sample_rate() if rate is None else rate
+        self.slow = slow_seconds() if slow is None else slow
+        if interval is None:
+            interval = float(os.getenv('PROFILE_INTERVAL_MS', '10')) / 1000
+        self.max_profiles = max_profiles if max_profiles is not None else int(os.getenv('PROFILE_MAX_PROFILES', '200'))
+        self.sampler = StackSampler(interval)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='profile-writer')
+
+    def begin(self, **metadata: Any) -> Optional[Profile]:
+        """
+        开始剖析当前线程处理的请求
+
+        Args:
+            metadata: 请求元数据（方法、路径、追踪ID等）
+
+        Returns:
+            剖析对象（请求结束时传给 finish）；未抽中且不按耗时保留时返回 None
+        """
+        sampled = random.random() < self.rate
+        if not sampled and self.slow <= 0:
+            return None
+        profile = Profile(threading.get_ident(), sampled, metadata)
+        if sampled:
+            profile.allocations_start = _allocations_begin()
+        self.sampler.add(profile)
+        return profile
+
+    def finish(self, profile: Profile, **metadata: Any):
+        """
+        结束剖析，抽中或超过耗时阈值时提交写文件
+
+        Args:
+            profile: begin 返回的剖析对象
+            metadata: 结束时才知道的元数据（状态码、错误）
+        """
+        self.sampler.remove(profile)
+        duration = time.time() - profile.start
+        allocations_end = _allocations_end() if profile.sampled else None
+        slow = self.slow > 0 and duration >= self.slow
+        if not profile.sampled and not slow:
+            return
+        profile.metadata.update(metadata)
+        profile.metadata.update(
+            reason='sampled' if profile.sampled else 'slow',
+            duration_ms=round(duration * 1000, 1)
+        )
+        self._writer.submit(self._write, profile, allocations_end)
+
+    def _write(self, profile: Profile, allocations_end: Optional[tracemalloc.Snapshot]):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            base = os.path.join(
+                self.directory, f"{time.strftime('%Y%m%d_%H%M%S', time.localtime(profile.start))}_{profile.id}"
+            )
+            files = {'cpu': os.path.basename(base) + '.cpu.folded'}
+            with open(base + '.cpu.folded', 'w', encoding='utf-8') as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in profile.stacks.most_common())
+
+            metadata = dict(
+                profile.metadata,
+                id=profile.id,
+                pid=os.getpid(),
+                started=profile.start,
+                interval_ms=round(self.sampler.interval * 1000, 2),
+                samples=profile.samples
+            )
+            if profile.allocations_start is not None and allocations_end is not None:
+                files['alloc'] = os.path.basename(base) + '.alloc.folded'
+                with open(base + '.alloc.folded', 'w', encoding='utf-8') as f:
+                    f.writelines(line + '\n' for line in allocation_stacks(allocations_end, profile.allocations_start))
+                metadata['top_allocations'] = top_allocations(allocations_end, profile.allocations_start)
+            metadata['files'] = files
+            with open(base + '.json', 'w', encoding='utf-8') as f:
+                json.dump(metadata, f, ensure_ascii=False, indent=2)
+            PROFILES_WRITTEN.inc(reason=metadata['reason'])
+            self._prune()
+        except Exception as e:
+            print(f"⚠️  剖析文件写入失败: {e}")
+
+    def _prune(self):
+        """删除超出保留数的最早剖析"""
+        if self.max_profiles <= 0:
+            return
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        for name in names[:max(0, len(names) - self.max_profiles)]:
+            prefix = name[:-len('.json')]
+            for suffix in ('.json', '.cpu.folded', '.alloc.folded'):
+                try:
+                    os.remove(os.path.join(self.directory, prefix + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def flush(self):
+        """等待已提交的剖析写完（测试和退出前使用）"""
+        self._writer.submit(lambda: None).result()
+
+
+_profiler: Optional[Profiler] = None
+_profiler_pid: Optional[int] = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> Optional[Profiler]:
+    """
+    按环境变量创建剖析器（每个进程一个：采样线程在 fork 后的 worker 中各自创建）
+
+    Returns:
+        未开启剖析（PROFILE_SAMPLE_RATE 和 PROFILE_SLOW_SECONDS 均为 0）时返回 None
+    """
+    global _profiler, _profiler_pid
+    if not enabled():
+        return None
+    if _profiler is not None and _profiler_pid == os.getpid():
+        return _profiler
+    with _profiler_lock:
+        if _profiler is None or _profiler_pid != os.getpid():
+            _profiler = Profiler()
+            _profiler_pid = os.getpid()
+        return _profiler
+
+
+def reset_profiler():
+    """丢弃当前剖析器（配置变更后或测试中使用）"""
+    global _profiler, _profiler_pid
+    with _profiler_lock:
+        _profiler = None
+        _profiler_pid = None
@@ -0,0 +1,364 @@
+"""
+渐进式分析结果
+先用本地分类器在几十毫秒内给出报告，大模型分析作为任务进入队列由工作线程执行，
+完成后以差异（只含变化的顶层字段）的形式通过轮询或SSE推送给前端
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from constitution_classifier import ConstitutionClassifier
+from deadline import Deadline, deadline_scope
+from job_queue import Job, MemoryJobQueue, WorkerPool
+from singleflight import SingleFlight
+from tracing import current_traceparent, span, trace_scope
+
+# 结果状态
+PENDING = 'pending'                  # 本地报告不可用，等待大模型
+PENDING_UPGRADE = 'pending_upgrade'  # 已有本地报告，大模型分析进行中
+COMPLETE = 'complete'
+FAILED = 'failed'                    # 大模型分析失败，保留本地报告
+
+
+def diff_reports(old: Optional[Dict[str, Any]], new: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    计算两份报告的顶层差异
+
+    Returns:
+        {'changed': {字段: 新值}, 'removed': [字段]}
+    """
+    old = old or {}
+    return {
+        'changed': {key: value for key, value in new.items() if old.get(key) != value},
+        'removed': [key for key in old if key not in new]
+    }
+
+
+def file_digest(path: str) -> str:
+    """文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultStore:
+    """内存中的分析结果（线程安全），按版本保存报告以便计算差异"""
+
+    def __init__(self, ttl: float = 3600, max_items: int = 1000):
+        """
+        Args:
+            ttl: 结果保留时间（秒）
+            max_items: 最多保留的结果数
+        """
+        self.ttl = ttl
+        self.max_items = max_items
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._cond = threading.Condition()
+
+    def create(self, report: Optional[Dict[str, Any]], status: str) -> str:
+        """新建结果，返回结果ID"""
+        result_id = uuid.uuid4().hex
+        now = time.time()
+        with self._cond:
+            self._prune(now)
+            self._entries[result_id] = {
+                'status': status,
+                'versions': [report] if report is not None else [],
+                'error': None,
+                'created': now,
+                'updated': now
+            }
+        return result_id
+
+    def update(self, result_id: str, report: Optional[Dict[str, Any]], status: str, error: Optional[str] = None):
+        """写入新版本的报告（report 为 None 时只更新状态）"""
+        with self._cond:
+            entry = self._entries.get(result_id)
+            if entry is None:
+                return
+            if report is not None:
+                entry['versions'].append(report)
+            entry['status'] = status
+            entry['error'] = error
+            entry['updated'] = time.time()
+            self._cond.notify_all()
+
+    def get(self, result_id: str, since: int = 0) -> Optional[Dict[str, Any]]:
+        """
+        获取结果相对于客户端已有版本的差异
+
+        Args:
+            result_id: 结果ID
+            since: 客户端已有的版本号（0 表示还没有任何版本）
+
+        Returns:
+            {'status', 'version', 'diff', 'error'}；结果不存在时返回 None
+        """
+        with self._cond:
+            entry = self._entries.get(result_id)
+            if entry is None:
+                return None
+            return self._view(entry, since)
+
+    def wait(self, result_id: str, since: int = 0, timeout: float = 30.0) -> Optional[Dict[str, Any]]:
+        """
+        等待出现比 since 更新的版本或结果结束，超时后返回当前状态
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                entry = self._entries.get(result_id)
+                if entry is None:
+                    return None
+                if len(entry['versions']) > since or entry['status'] in (COMPLETE, FAILED):
+                    return self._view(entry, since)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return self._view(entry, since)
+                self._cond.wait(remaining)
+
+    @staticmethod
+    def _view(entry: Dict[str, Any], since: int) -> Dict[str, Any]:
+        versions: List[Dict[str, Any]] = entry['versions']
+        version = len(versions)
+        diff = None
+        if version > since:
+            old = versions[since - 1] if 0 < since <= version else None
+            diff = diff_reports(old, versions[-1])
+        return {
+            'status': entry['status'],
+            'version': version,
+            'diff': diff,
+            'error': entry['error']
+        }
+
+    def _prune(self, now: float):
+        """清理过期结果，超出上限时丢弃最旧的"""
+        expired = [rid for rid, entry in self._entries.items() if now - entry['updated'] > self.ttl]
+        for rid in expired:
+            del self._entries[rid]
+        overflow = len(self._entries) - self.max_items + 1
+        if overflow > 0:
+            oldest = sorted(self._entries, key=lambda rid: self._entries[rid]['created'])[:overflow]
+            for rid in oldest:
+                del self._entries[rid]
+
+
+class SQLiteResultStore(ResultStore):
+    """SQLite 中的分析结果：多个 worker 进程共享，任意进程都能查询其他进程写入的结果"""
+
+    def __init__(self, path: str, ttl: float = 3600, max_items: int = 1000, poll_interval: float = 0.2):
+        """
+        Args:
+            path: 数据库文件路径（可与 SQLiteJobQueue 共用）
+            ttl: 结果保留时间（秒）
+            max_items: 最多保留的结果数
+            poll_interval: wait() 轮询数据库的间隔（秒）
+        """
+        super().__init__(ttl, max_items)
+        self.poll_interval = poll_interval
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._lock = threading.Lock()
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            ' id TEXT PRIMARY KEY, status TEXT NOT NULL, versions TEXT NOT NULL, error TEXT,'
+            ' created REAL NOT NULL, updated REAL NOT NULL)'
+        )
+
+    def create(self, report: Optional[Dict[str, Any]], status: str) -> str:
+        result_id = uuid.uuid4().hex
+        now = time.time()
+        versions = [report] if report is not None else []
+        with self._lock:
+            self._prune(now)
+            self._conn.execute(
+                'INSERT INTO results (id, status, versions, error, created, updated) VALUES (?, ?, ?, NULL, ?, ?)',
+                (result_id, status, json.dumps(versions, ensure_ascii=False), now, now)
+            )
+        return result_id
+
+    def update(self, result_id: str, report: Optional[Dict[str, Any]], status: str, error: Optional[str] = None):
+        with self._lock:
+            # 读-改-写在同一个写事务中，避免与其他进程的更新交错
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                entry = self._load(result_id)
+                if entry is not None:
+                    if report is not None:
+                        entry['versions'].append(report)
+                    self._conn.execute(
+                        'UPDATE results SET status = ?, versions = ?, error = ?, updated = ? WHERE id = ?',
+                        (status, json.dumps(entry['versions'], ensure_ascii=False), error, time.time(), result_id)
+                    )
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def get(self, result_id: str, since: int = 0) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._load(result_id)
+        return self._view(entry, since) if entry is not None else None
+
+    def wait(self, result_id: str, since: int = 0, timeout: float = 30.0) -> Optional[Dict[str, Any]]:
+        # 其他进程的写入无法通知到本进程，只能轮询
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                entry = self._load(result_id)
+            if entry is None:
+                return None
+            if len(entry['versions']) > since or entry['status'] in (COMPLETE, FAILED):
+                return self._view(entry, since)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return self._view(entry, since)
+            time.sleep(min(self.poll_interval, remaining))
+
+    def _load(self, result_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            'SELECT status, versions, error FROM results WHERE id = ?', (result_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'status': row[0], 'versions': json.loads(row[1]), 'error': row[2]}
+
+    def _prune(self, now: float):
+        self._conn.execute('DELETE FROM results WHERE updated < ?', (now - self.ttl,))
+        self._conn.execute(
+            'DELETE FROM results WHERE id IN (SELECT id FROM results ORDER BY created DESC LIMIT -1 OFFSET ?)',
+            (self.max_items - 1,)
+        )
+
+
+class ProgressiveAnalyzer:
+    """先返回本地报告、后台用大模型升级的分析流程"""
+
+    def __init__(
+        self,
+        analyzer: Any,
+        store: Optional[ResultStore] = None,
+        classifier: Optional[ConstitutionClassifier] = None,
+        max_workers: int = 4,
+        flight: Optional[SingleFlight] = None,
+        upgrade_budget: Optional[float] = None,
+        job_queue: Optional[Any] = None
+    ):
+        """
+        Args:
+            analyzer: 大模型分析器（需提供 analyze_image）
+            store: 结果存储（多进程共享队列时应使用 SQLiteResultStore）
+            classifier: 本地分类器
+            max_workers: 执行升级任务的工作线程数
+            flight: 请求合并：相同图片内容的并发升级只调用一次大模型
+            upgrade_budget: 后台升级的时限预算（秒，从提交时算起，含排队时间），
+                默认读取环境变量 UPGRADE_DEADLINE_SECONDS
+            job_queue: 升级任务队列（MemoryJobQueue 或 SQLiteJobQueue），任务ID即结果ID
+        """
+        self.analyzer = analyzer
+        self.store = store or ResultStore()
+        self.classifier = classifier or ConstitutionClassifier()
+        self.flight = flight or SingleFlight()
+        if upgrade_budget is None:
+            upgrade_budget = float(os.getenv('UPGRADE_DEADLINE_SECONDS', '30'))
+        self.upgrade_budget = upgrade_budget
+        self.queue = job_queue or MemoryJobQueue()
+        self.workers = WorkerPool(self.queue, self._run_job, max_workers)
+
+    @property
+    def upgrades(self) -> bool:
+        """分析器是否会调用大模型（规则引擎模式下本地报告即最终结果）"""
+        return not getattr(self.analyzer, 'use_mock', False)
+
+    def start(
+        self,
+        image_path: str,
+        content_hash: Optional[str] = None,
+        upgrade: bool = True
+    ) -> Tuple[str, Optional[Dict[str, Any]], str]:
+        """
+        生成本地报告并将升级任务入队
+
+        Args:
+            image_path: 图片路径
+            content_hash: 图片内容哈希，用于合并相同图片的并发升级（默认按文件计算）
+            upgrade: 是否排入升级任务（过载降级时为 False：本地报告即最终结果，
+                本地报告生成失败时状态为 FAILED）
+
+        Returns:
+            (结果ID（即任务ID）, 本地报告或 None, 状态)
+        """
+        try:
+            with span('local_report'):
+                report = self.classifier.analyze(image_path)
+        except Exception as e:
+            # 例如 OpenCV 无法解码的 GIF，只能等大模型
+            print(f"⚠️  本地报告生成失败: {e}")
+            report = None
+
+        if (not self.upgrades or not upgrade) and report is not None:
+            return self.store.create(report, COMPLETE), report, COMPLETE
+        if not upgrade:
+            return self.store.create(None, FAILED), None, FAILED
+
+        status = PENDING_UPGRADE if report is not None else PENDING
+        result_id = self.store.create(report, status)
+        self.queue.put(result_id, {
+            'image_path': image_path,
+            'content_hash': content_hash or file_digest(image_path),
+            # 时限从入队时算起，排队时间也计入预算（用墙上时钟，跨进程可比较）
+            'expires_at': time.time() + self.upgrade_budget,
+            # 升级任务的追踪延续发起请求的追踪
+            'traceparent': current_traceparent()
+        })
+        return result_id, report, status
+
+    def _run_job(self, job: Job) -> bool:
+        """工作线程执行升级任务"""
+        remaining = job.payload['expires_at'] - time.time()
+        if remaining <= 0:
+            # 排队过久：放弃升级，保留本地报告
+            self.store.update(job.id, None, FAILED, '排队超时，未完成大模型分析')
+            return False
+        with trace_scope('upgrade', job.payload.get('traceparent'), result_id=job.id,
+                         queued_ms=round((time.time() - job.enqueued_at) * 1000, 1)):
+            return self._upgrade(job.id, job.payload['image_path'], job.payload['content_hash'], Deadline(remaining))
+
+    def _upgrade(self, result_id: str, image_path: str, content_hash: str, deadline: Deadline) -> bool:
+        """调用大模型，完成后写入新版本"""
+        start = time.perf_counter()
+        try:
+            with deadline_scope(deadline):
+                result, shared = self.flight.do(content_hash, lambda: self.analyzer.analyze_image(image_path))
+            if shared:
+                print(f"🔗 复用进行中的相同分析 ({result_id})")
+        except Exception as e:
+            print(f"❌ 后台升级失败 ({result_id}): {e}")
+            self.store.update(result_id, None, FAILED, str(e))
+            return False
+
+        print(f"✅ 报告已升级 ({result_id})，耗时 {time.perf_counter() - start:.1f}s")
+        self.store.update(result_id, result, COMPLETE)
+        return True
+
+    def job_info(self, result_id: str) -> Optional[Dict[str, Any]]:
+        """升级任务的状态和时刻（没有升级任务时返回 None）"""
+        return self.queue.info(result_id)
+
+    def queue_stats(self) -> Dict[str, Any]:
+        """任务队列统计：深度、执行中任务数、排队/执行耗时分位数"""
+        return self.workers.stats()
+
+    def shutdown(self):
+        """停止工作线程取新任务"""
+        self.workers.stop()
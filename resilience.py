@@ -0,0 +1,409 @@
+"""
+提供商调用的弹性保护层
+- 令牌桶限流：按各提供商的配额限制请求速率
+- 熔断器：提供商持续失败时快速失败，不再等待SDK超时
+- 指数退避重试：对可重试错误（限流、超时、5xx）带抖动地有限次重试
+- 流式调用在保护层内读到第一块再返回，连接错误和限流同样经过熔断、重试和耗时统计
+"""
+
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from cassette import get_cassette
+from deadline import DeadlineExceeded, current_deadline
+from metrics import PROVIDER_CALL_SECONDS, PROVIDER_ERRORS, PROVIDER_REJECTED
+from tracing import span, usage_attributes
+
+
+class ProviderUnavailableError(RuntimeError):
+    """提供商暂不可用（熔断或限流），调用未发出"""
+
+
+class CircuitOpenError(ProviderUnavailableError):
+    """熔断器处于打开状态"""
+
+
+class RateLimitedError(ProviderUnavailableError):
+    """本地限流：在允许的等待时间内拿不到令牌"""
+
+
+class ProviderHTTPError(RuntimeError):
+    """提供商返回了错误状态码（用于不抛异常的SDK，如 dashscope）"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+
+
+# 各提供商默认配额：(每秒请求数, 突发容量)，可用环境变量 <PROVIDER>_RPS / <PROVIDER>_BURST 覆盖
+DEFAULT_QUOTAS: Dict[str, Tuple[float, int]] = {
+    'deepseek': (10.0, 20),
+    'zhipu': (5.0, 10),
+    'qwen': (5.0, 10),
+    'claude': (1.0, 5),
+}
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+_RETRYABLE_NAMES = ('Timeout', 'Connection', 'RateLimit', 'InternalServer', 'ServiceUnavailable', 'Overloaded')
+
+
+def is_retryable(error: BaseException) -> bool:
+    """判断错误是否值得重试（不依赖具体SDK的异常类型）"""
+    if isinstance(error, (ProviderUnavailableError, DeadlineExceeded)):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if isinstance(status, int):
+        return status in _RETRYABLE_STATUS
+
+    name = type(error).__name__
+    return any(part in name for part in _RETRYABLE_NAMES)
+
+
+def _is_client_error(error: BaseException) -> bool:
+    """是否为不可重试的4xx客户端错误"""
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in _RETRYABLE_STATUS
+
+
+class TokenBucket:
+    """令牌桶限流器（线程安全）"""
+
+    def __init__(self, rate: float, capacity: int):
+        """
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量（允许的突发请求数）
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait: float = 0.0) -> bool:
+        """
+        获取一个令牌
+
+        Args:
+            max_wait: 最多等待的秒数
+
+        Returns:
+            是否拿到令牌
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    closed：正常放行；连续失败达到阈值后 → open：直接拒绝；
+    冷却时间过后 → half_open：放行一个探测请求，成功则恢复，失败则重新打开
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        """
+        Args:
+            failure_threshold: 连续失败多少次后熔断
+            recovery_timeout: 熔断后多久允许探测（秒）
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """当前是否允许发出请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            # half_open：只放行一个探测请求
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def release(self):
+        """请求未发出时归还 half_open 的探测名额"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+
+    def record_success(self):
+        """记录一次成功"""
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_client_error(self):
+        """
+        记录一次客户端错误（4xx）：提供商有响应，连续失败计数清零；
+        但请求本身有误，half_open 的探测不能据此判断提供商已恢复，只归还探测名额
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+            else:
+                self._failures = 0
+
+    def record_failure(self):
+        """记录一次失败"""
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class ProviderGuard:
+    """单个提供商的保护：限流 + 熔断 + 重试"""
+
+    def __init__(
+        self,
+        name: str,
+        limiter: TokenBucket,
+        breaker: CircuitBreaker,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        max_wait: float = 2.0
+    ):
+        """
+        Args:
+            name: 提供商名
+            limiter: 令牌桶
+            breaker: 熔断器
+            max_attempts: 最多尝试次数（含首次）
+            base_delay: 退避基准时间（秒）
+            max_delay: 单次退避上限（秒）
+            max_wait: 等待令牌的上限（秒），超过即快速失败
+        """
+        self.name = name
+        self.limiter = limiter
+        self.breaker = breaker
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        在保护下调用提供商
+
+        Raises:
+            CircuitOpenError: 熔断中，未发出请求
+            RateLimitedError: 本地限流，未发出请求
+            DeadlineExceeded: 请求的时限预算已用完
+            其他异常: 重试耗尽后抛出最后一次的错误
+        """
+        deadline = current_deadline()
+        model = kwargs.get('model', '')
+        attempt = 0
+        while True:
+            attempt += 1
+
+            max_wait = self.max_wait
+            if deadline is not None:
+                max_wait = min(max_wait, deadline.timeout())
+                if 'timeout' in kwargs:
+                    # 重试时SDK超时随剩余预算收紧
+                    kwargs['timeout'] = min(kwargs['timeout'], deadline.timeout())
+
+            if not self.breaker.allow():
+                PROVIDER_REJECTED.inc(provider=self.name, reason='circuit_open')
+                raise CircuitOpenError(f"{self.name} 熔断中，暂不调用")
+            if not self.limiter.acquire(max_wait):
+                # 没有真正发出请求，归还探测名额
+                self.breaker.release()
+                PROVIDER_REJECTED.inc(provider=self.name, reason='rate_limited')
+                raise RateLimitedError(f"{self.name} 请求过于频繁，已本地限流")
+
+            start = time.perf_counter()
+            try:
+                # 录制/回放模式下经 cassette 调用，默认直接调用
+                with span('provider.call', provider=self.name, model=model, attempt=attempt,
+                          stream=bool(kwargs.get('stream'))) as call_span:
+                    result = get_cassette().call(self.name, fn, *args, **kwargs)
+                    result = self._open_stream(fn, result, model, kwargs)
+                    call_span.set(**usage_attributes(result))
+            except Exception as e:
+                PROVIDER_CALL_SECONDS.observe(time.perf_counter() - start, provider=self.name, model=model, outcome='error')
+                PROVIDER_ERRORS.inc(provider=self.name, model=model, error=type(e).__name__)
+                if _is_client_error(e):
+                    # 请求本身有误（如400/401），不计入提供商失败
+                    self.breaker.record_client_error()
+                else:
+                    self.breaker.record_failure()
+                if attempt >= self.max_attempts or not is_retryable(e):
+                    raise
+                delay = self._backoff(attempt)
+                if deadline is not None and delay >= deadline.remaining():
+                    # 退避后已没有预算再试一次
+                    raise
+                print(f"⚠️  {self.name} 调用失败（第{attempt}次），{delay:.2f}s 后重试: {e}")
+                time.sleep(delay)
+                continue
+
+            # 流式调用计到收到第一块
+            PROVIDER_CALL_SECONDS.observe(time.perf_counter() - start, provider=self.name, model=model, outcome='ok')
+            self.breaker.record_success()
+            return result
+
+    def _open_stream(self, fn: Callable[..., Any], result: Any, model: str, kwargs: Dict[str, Any]) -> Any:
+        """
+        流式调用读到第一块再返回
+
+        OpenAI 兼容的流和 Anthropic 的 messages.stream 都是惰性的：不先读一块，
+        连接错误、429/529 要到调用方迭代时才出现，绕过熔断和重试。非流式调用原样返回。
+
+        Raises:
+            读取第一块时的错误（已关闭流）
+        """
+        if kwargs.get('stream') is True:
+            return _PrefetchedStream(self, model, result)
+        if getattr(fn, '__name__', None) == 'stream':
+            return _OpenedMessageStream(self, model, result)
+        return result
+
+    def _record_stream_error(self, error: BaseException, model: str):
+        """第一块之后的读取错误：已有输出不能重试，只计入熔断器"""
+        PROVIDER_ERRORS.inc(provider=self.name, model=model, error=type(error).__name__)
+        if _is_client_error(error):
+            self.breaker.record_client_error()
+        else:
+            self.breaker.record_failure()
+
+    def _backoff(self, attempt: int) -> float:
+        """带完全抖动的指数退避"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+_EMPTY = object()
+
+
+def _read_first(iterator: Iterator[Any]) -> Any:
+    """读取第一块，流为空时返回 _EMPTY"""
+    return next(iterator, _EMPTY)
+
+
+def _chain_first(guard: ProviderGuard, model: str, first: Any, iterator: Iterator[Any]) -> Iterator[Any]:
+    """先产出已读到的第一块，再继续读取；读取错误计入熔断器"""
+    if first is _EMPTY:
+        return
+    yield first
+    try:
+        yield from iterator
+    except Exception as e:
+        guard._record_stream_error(e, model)
+        raise
+
+
+class _PrefetchedStream:
+    """已读到第一块的 chat.completions 流"""
+
+    def __init__(self, guard: ProviderGuard, model: str, stream: Any):
+        self.stream = stream
+        iterator = iter(stream)
+        try:
+            first = _read_first(iterator)
+        except BaseException:
+            self.close()
+            raise
+        self._chunks = _chain_first(guard, model, first, iterator)
+
+    def __iter__(self) -> Iterator[Any]:
+        return self._chunks
+
+    def close(self):
+        close = getattr(self.stream, 'close', None)
+        if close:
+            close()
+
+
+class _OpenedMessageStream:
+    """已进入并读到第一段文本的 Anthropic messages.stream，用法同原上下文管理器"""
+
+    def __init__(self, guard: ProviderGuard, model: str, manager: Any):
+        self.manager = manager
+        stream = manager.__enter__()
+        texts = iter(stream.text_stream)
+        try:
+            first = _read_first(texts)
+        except BaseException as e:
+            manager.__exit__(type(e), e, e.__traceback__)
+            raise
+        self._texts = _chain_first(guard, model, first, texts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return self.manager.__exit__(*exc)
+
+    @property
+    def text_stream(self) -> Iterator[str]:
+        return self._texts
+
+
+_guards: Dict[str, ProviderGuard] = {}
+_guards_lock = threading.Lock()
+
+
+def get_guard(provider: str) -> ProviderGuard:
+    """获取提供商的保护对象（进程内共享，同一提供商的所有分析器共用配额）"""
+    with _guards_lock:
+        guard = _guards.get(provider)
+        if guard is None:
+            rate, burst = DEFAULT_QUOTAS.get(provider, (5.0, 10))
+            prefix = provider.upper().replace('-', '_')
+            rate = float(os.getenv(f'{prefix}_RPS', rate))
+            burst = int(os.getenv(f'{prefix}_BURST', burst))
+            guard = ProviderGuard(provider, TokenBucket(rate, burst), CircuitBreaker())
+            _guards[provider] = guard
+        return guard
+
+
+def reset_guards(provider: Optional[str] = None):
+    """清除保护状态（测试或配置变更后使用）"""
+    with _guards_lock:
+        if provider is None:
+            _guards.clear()
+        else:
+            _guards.pop(provider, None)
@@ -0,0 +1,184 @@
+"""
+API 响应的序列化与压缩
+- 序列化：安装了 orjson 时使用（比标准库快数倍），中文直接输出 UTF-8 而不是 \\uXXXX 转义
+- 压缩：按 Accept-Encoding 协商 brotli（安装了 brotli 时）或 gzip，小于阈值的响应不压缩；
+  SSE 等流式响应和文件下载不经过压缩
+- 不可变的响应（演示报告、已完成的分析结果）压缩一次后缓存字节，见 precomputed.py
+
+环境变量：
+    COMPRESS_MIN_BYTES=1024    小于该长度的响应不压缩
+"""
+
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Optional
+
+from flask import Request, Response
+from flask.json.provider import DefaultJSONProvider
+
+from metrics import CACHE_REQUESTS
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，没有则使用标准库
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # 可选依赖，没有则只协商 gzip
+    brotli = None
+
+# 值得压缩的内容类型（text/* 之外）
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'application/x-ndjson', 'image/svg+xml'
+}
+
+# 动态响应用中等压缩级别（耗时与压缩率的折中），预先生成的响应用最高级别
+DYNAMIC_LEVELS = {'br': 4, 'gzip': 6}
+STATIC_LEVELS = {'br': 11, 'gzip': 9}
+
+_ORJSON_OPTIONS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+
+def _default(obj: Any) -> Any:
+    """标准库不支持的类型：numpy 标量/数组、集合"""
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """序列化为紧凑的 UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask 的 JSON 提供者：jsonify 和 request.get_json 使用更快的编解码"""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            # 调用方指定了参数（如模板的 tojson），按标准库行为处理
+            return super().dumps(obj, **kwargs)
+        return dumps(obj).decode('utf-8')
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
+
+
+def min_compress_bytes() -> int:
+    return int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+
+
+def available_encodings() -> Iterable[str]:
+    """服务端支持的编码（按优先级）"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(request: Request, offered: Optional[Iterable[str]] = None) -> Optional[str]:
+    """
+    按客户端的 Accept-Encoding（含 q 值）选择编码
+
+    Args:
+        request: 当前请求
+        offered: 可选的编码（按优先级），默认为服务端支持的全部编码
+
+    Returns:
+        'br'、'gzip'，或 None 表示不压缩
+    """
+    return request.accept_encodings.best_match(list(offered or available_encodings()))
+
+
+def compress(body: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """
+    按编码压缩
+
+    Args:
+        body: 原始字节
+        encoding: 'br' 或 'gzip'
+        level: 压缩级别，默认为动态响应的级别
+    """
+    level = level if level is not None else DYNAMIC_LEVELS[encoding]
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    # mtime=0：相同内容压缩结果相同，便于缓存和比较
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def is_compressible(mimetype: Optional[str]) -> bool:
+    return bool(mimetype) and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES)
+
+
+def compress_response(response: Response, request: Request) -> Response:
+    """
+    after_request 钩子：按协商结果压缩动态响应
+
+    不处理流式响应（SSE 需要逐条即时送达）、文件下载、已编码或已自行协商的响应
+    """
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers or 'accept-encoding' in response.vary
+            or not is_compressible(response.mimetype)):
+        return response
+
+    body = response.get_data()
+    if len(body) < min_compress_bytes():
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request)
+    if encoding is None:
+        return response
+
+    response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+
+class ResponseCache:
+    """最近使用的预先生成响应（LRU，线程安全）"""
+
+    def __init__(self, max_entries: int = 256, name: str = 'responses'):
+        """
+        Args:
+            max_entries: 最多缓存的响应数
+            name: 命中率指标中的缓存名
+        """
+        self.max_entries = max_entries
+        self.name = name
+        self._entries: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        CACHE_REQUESTS.inc(cache=self.name, result='hit' if value is not None else 'miss')
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
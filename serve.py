@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+生产环境启动入口（预派生多进程）
+- 主进程导入并预加载应用、监听端口，然后 fork 出 N 个 worker，只读状态以写时复制共享
+- 每个 worker 在 fork 后创建自己的分析器（提供商客户端连接池）、任务线程
+- worker 处理的请求数或内存占用达到阈值后停止接收新请求，处理完进行中的请求再退出，
+  主进程随即补充新的 worker；SIGHUP 依次重启全部 worker，SIGTERM/SIGINT 优雅停止
+
+用法：
+    python serve.py --workers 4 --port 5001
+
+环境变量（命令行参数优先）：
+    WEB_WORKERS=4
+    MAX_REQUESTS=2000          每个 worker 处理多少请求后重启（0 表示不限）
+    MAX_REQUESTS_JITTER=200    随机增加的请求数，避免所有 worker 同时重启
+    MAX_WORKER_RSS_MB=1024     worker 常驻内存超过该值后重启（0 表示不限）
+    GRACEFUL_TIMEOUT=30        等待进行中请求完成的最长时间（秒）
+
+多个 worker 时任务和结果必须放在各 worker 共享的 SQLite 中（JOB_QUEUE=sqlite）：
+未设置 JOB_QUEUE 时自动使用 SQLite，显式设置为 memory 时拒绝启动
+"""
+
+import argparse
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from werkzeug.serving import BaseWSGIServer, make_server
+from werkzeug.wsgi import ClosingIterator
+
+
+# 主进程处理的信号（停止、重启）
+MASTER_SIGNALS = {signal.SIGTERM, signal.SIGINT, signal.SIGHUP}
+
+
+def rss_mb() -> float:
+    """当前进程的常驻内存（MB）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        import resource
+        # 非 Linux 平台只能取峰值（macOS 单位为字节）
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+class WorkerLifecycle:
+    """worker 内的请求计数与重启判断（包装 WSGI 应用）"""
+
+    def __init__(self, app, server: BaseWSGIServer, max_requests: int, max_rss_mb: float):
+        """
+        Args:
+            app: WSGI 应用
+            server: 本 worker 的服务器（重启时停止其接收循环）
+            max_requests: 处理多少请求后重启（0 表示不限）
+            max_rss_mb: 常驻内存阈值（0 表示不限）
+        """
+        self.app = app
+        self.server = server
+        self.max_requests = max_requests
+        self.max_rss_mb = max_rss_mb
+        self.handled = 0
+        self.in_flight = 0
+        # 已接受、尚未处理完的连接：接收循环停止前可能刚接受了连接，
+        # 其线程还在读取请求、尚未进入应用，不能只按 in_flight 判断是否空闲
+        self.connections = 0
+        self.stopping = False
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._track_connections(server)
+
+    def _track_connections(self, server: BaseWSGIServer):
+        process_request = server.process_request
+        process_request_thread = server.process_request_thread
+
+        def tracked_process_request(request, client_address):
+            # 在接收循环的线程中计数，serve_forever 返回前已计入
+            with self._lock:
+                self.connections += 1
+            try:
+                process_request(request, client_address)
+            except BaseException:
+                self._connection_closed()
+                raise
+
+        def tracked_process_request_thread(request, client_address):
+            try:
+                process_request_thread(request, client_address)
+            finally:
+                self._connection_closed()
+
+        server.process_request = tracked_process_request
+        server.process_request_thread = tracked_process_request_thread
+
+    def _connection_closed(self):
+        with self._lock:
+            self.connections -= 1
+            self._idle.notify_all()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.in_flight += 1
+        try:
+            result = self.app(environ, start_response)
+        except BaseException:
+            self._finished()
+            raise
+        # 流式响应（SSE）在迭代结束、连接关闭时才算处理完
+        return ClosingIterator(result, [self._finished])
+
+    def _finished(self):
+        with self._lock:
+            self.in_flight -= 1
+            self.handled += 1
+            handled = self.handled
+            self._idle.notify_all()
+
+        if self.max_requests and handled >= self.max_requests:
+            self.stop(f"已处理 {handled} 个请求")
+        elif self.max_rss_mb and rss_mb() > self.max_rss_mb:
+            self.stop(f"内存 {rss_mb():.0f} MB 超过阈值 {self.max_rss_mb:.0f} MB")
+
+    def stop(self, reason: str):
+        """停止接收新请求（不阻塞调用方）"""
+        with self._lock:
+            if self.stopping:
+                return
+            self.stopping = True
+        print(f"♻️  worker {os.getpid()} {reason}，优雅退出")
+        # shutdown() 会等待接收循环结束，不能在处理请求的线程里同步等待
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def wait_idle(self, timeout: float) -> bool:
+        """等待进行中的请求和已接受的连接处理完，超时返回 False"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self.in_flight > 0 or self.connections > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+
+def run_worker(server: BaseWSGIServer, app_module, slot: int, options: argparse.Namespace):
+    """fork 后在子进程中运行，不返回"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C 由主进程统一处理
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)  # 重启由主进程转为 SIGTERM
+    random.seed()
+
+    # 每个 worker 自己的分析器、客户端连接池和任务线程；上传清理只需一个 worker 运行
+    app_module.init_services(sweep_uploads=slot == 0)
+
+    jitter = random.randint(0, options.max_requests_jitter) if options.max_requests else 0
+    lifecycle = WorkerLifecycle(app_module.app, server, options.max_requests + jitter, options.max_rss_mb)
+    server.app = lifecycle
+    signal.signal(signal.SIGTERM, lambda signum, frame: lifecycle.stop("收到停止信号"))
+    # 启动期间收到的停止信号在这里送达，由上面的处理函数优雅停止
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, MASTER_SIGNALS)
+
+    print(f"👷 worker {os.getpid()} 已启动（槽位 {slot}）")
+    server.serve_forever(poll_interval=0.5)
+
+    if not lifecycle.wait_idle(options.graceful_timeout):
+        print(f"⚠️  worker {os.getpid()} 等待进行中的请求超时，强制退出")
+    app_module.progressive.shutdown()
+    sys.stdout.flush()
+    os._exit(0)
+
+
+class Master:
+    """主进程：维护固定数量的 worker"""
+
+    def __init__(self, server: BaseWSGIServer, app_module, options: argparse.Namespace):
+        self.server = server
+        self.app_module = app_module
+        self.options = options
+        self.workers: Dict[int, int] = {}  # pid -> 槽位
+        self.stopping = False
+
+    def spawn(self, slot: int):
+        # fork 前屏蔽主进程处理的信号：否则信号可能在子进程换上自己的处理函数之前到达，
+        # 被继承来的主进程处理函数处理（子进程会当自己是主进程，不停止服务）
+        signal.pthread_sigmask(signal.SIG_BLOCK, MASTER_SIGNALS)
+        pid = -1
+        try:
+            pid = os.fork()
+            if pid > 0:
+                self.workers[pid] = slot
+        finally:
+            # 主进程总要解除屏蔽（fork 失败时也是），否则再也收不到停止和重载信号；子进程在 run_worker 中解除
+            if pid != 0:
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, MASTER_SIGNALS)
+        if pid == 0:
+            try:
+                run_worker(self.server, self.app_module, slot, self.options)
+            finally:
+                sys.stdout.flush()
+                os._exit(1)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+
+        for slot in range(self.options.workers):
+            self.spawn(slot)
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            slot = self.workers.pop(pid, None)
+            if slot is None:
+                continue
+            if not self.stopping:
+                if os.WIFSIGNALED(status) or os.WEXITSTATUS(status) != 0:
+                    print(f"❌ worker {pid} 异常退出（状态 {status}），重新启动")
+                    time.sleep(1)  # 避免启动即崩溃时反复 fork
+                self.spawn(slot)
+
+        self.server.server_close()
+        print("👋 服务已停止")
+
+    def _on_stop(self, signum, frame):
+        if self.stopping:
+            # 第二次信号：不再等待
+            for pid in list(self.workers):
+                self._kill(pid, signal.SIGKILL)
+            return
+        self.stopping = True
+        print("🛑 正在停止所有 worker...")
+        for pid in list(self.workers):
+            self._kill(pid, signal.SIGTERM)
+        # 超过优雅退出时间仍未结束的 worker 强制终止
+        signal.signal(signal.SIGALRM, lambda s, f: [self._kill(p, signal.SIGKILL) for p in list(self.workers)])
+        signal.alarm(int(self.options.graceful_timeout) + 5)
+
+    def _on_reload(self, signum, frame):
+        print("🔄 重启所有 worker")
+        for pid in list(self.workers):
+            self._kill(pid, signal.SIGTERM)
+
+    @staticmethod
+    def _kill(pid: int, sig: int):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+
+def configure_job_queue(workers: int):
+    """
+    多个 worker 时使用共享的 SQLite 任务队列和结果存储
+
+    内存队列只在创建它的 worker 中可见：任务由一个 worker 创建，
+    落到其他 worker 的 /api/jobs/<id> 查询会返回 404
+
+    Raises:
+        SystemExit: 显式配置了只在单进程内可见的队列
+    """
+    if workers <= 1:
+        return
+    backend = os.getenv('JOB_QUEUE')
+    if backend is None:
+        # 在 fork 前设置，各 worker 的 init_services 据此创建 SQLite 队列
+        os.environ['JOB_QUEUE'] = 'sqlite'
+        print("🗄️  多个 worker：任务和结果使用共享的 SQLite（JOB_QUEUE=sqlite）")
+    elif backend.lower() != 'sqlite':
+        raise SystemExit(f"❌ JOB_QUEUE={backend} 只在单个进程内可见，--workers {workers} 时请使用 JOB_QUEUE=sqlite")
+
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='舌象分析服务（预派生多进程）')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '5001')))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_WORKERS', '4')), help='worker 进程数')
+    parser.add_argument('--max-requests', type=int, default=int(os.getenv('MAX_REQUESTS', '2000')),
+                        help='每个 worker 处理多少请求后重启（0 表示不限）')
+    parser.add_argument('--max-requests-jitter', type=int, default=int(os.getenv('MAX_REQUESTS_JITTER', '200')))
+    parser.add_argument('--max-rss-mb', type=float, default=float(os.getenv('MAX_WORKER_RSS_MB', '1024')),
+                        help='worker 常驻内存阈值（MB，0 表示不限）')
+    parser.add_argument('--graceful-timeout', type=float, default=float(os.getenv('GRACEFUL_TIMEOUT', '30')))
+    return parser.parse_args(argv)
+
+
+def main():
+    options = parse_args()
+    configure_job_queue(options.workers)
+
+    # 主进程导入应用并预加载只读状态，但不创建线程和连接（这些在 fork 后由各 worker 创建）
+    import app as app_module
+    app_module.preload()
+
+    # 多线程服务器：SSE 长连接不会占满 worker
+    server = make_server(options.host, options.port, app_module.app, threaded=True)
+    server.daemon_threads = True
+
+    print("=" * 60)
+    print(f"🚀 预派生模式: {options.workers} 个 worker，监听 http://{options.host}:{options.port}")
+    print(f"♻️  重启阈值: {options.max_requests or '不限'} 个请求 / {options.max_rss_mb or '不限'} MB")
+    print("=" * 60)
+
+    Master(server, app_module, options).run()
+
+
+if __name__ == "__main__":
+    main()
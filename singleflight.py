@@ -0,0 +1,207 @@
+"""
+请求合并（single-flight）
+同一内容（按哈希）的并发分析只执行一次，所有等待者共享结果：
+- 进程内：后来者等待第一个调用者完成
+- 跨进程（多个 worker）：用锁文件串行化，领头者把结果写入短期结果文件，其他进程直接读取
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from deadline import current_deadline
+
+try:
+    import fcntl
+except ImportError:  # Windows：只做进程内合并
+    fcntl = None
+
+
+class _Call:
+    """进行中的一次调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """按键合并并发调用"""
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        result_ttl: float = 30.0,
+        lock_timeout: float = 120.0,
+        cross_process: bool = True
+    ):
+        """
+        Args:
+            directory: 跨进程锁文件和结果文件的目录，默认读取环境变量 SINGLEFLIGHT_DIR
+            result_ttl: 结果文件的有效期（秒），覆盖等待者读取的窗口
+            lock_timeout: 等待其他进程的最长时间（秒），超时后自行计算
+            cross_process: 是否跨进程合并（False 时只做进程内合并）
+        """
+        if directory is None:
+            directory = os.getenv('SINGLEFLIGHT_DIR', os.path.join(tempfile.gettempdir(), 'tongue-singleflight'))
+        self.directory = directory if cross_process and fcntl is not None else None
+        self.result_ttl = result_ttl
+        self.lock_timeout = lock_timeout
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'executed': 0, 'shared_in_process': 0, 'shared_across_processes': 0}
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        执行或加入进行中的调用
+
+        Args:
+            key: 合并键（如图片内容哈希）
+            fn: 实际计算，跨进程共享时结果需可JSON序列化
+
+        Returns:
+            (结果, 是否为共享的结果)
+        """
+        with self._lock:
+            self._stats['calls'] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats['shared_in_process'] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        shared = False
+        try:
+            if self.directory:
+                call.result, shared = self._do_across_processes(key, fn)
+            else:
+                call.result = self._execute(fn)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, shared
+
+    def stats(self) -> Dict[str, int]:
+        """合并统计"""
+        with self._lock:
+            return dict(self._stats)
+
+    def _execute(self, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self._stats['executed'] += 1
+        return fn()
+
+    def _do_across_processes(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """用锁文件在多个 worker 之间合并"""
+        lock_path = os.path.join(self.directory, f"{key}.lock")
+        result_path = os.path.join(self.directory, f"{key}.json")
+
+        with open(lock_path, 'a') as lock_file:
+            acquired = self._acquire(lock_file)
+            try:
+                # 持锁后先看其他进程是否刚算完（等待者的典型路径）
+                cached = self._read_result(result_path)
+                if cached is not None:
+                    with self._lock:
+                        self._stats['shared_across_processes'] += 1
+                    return cached, True
+
+                result = self._execute(fn)
+                self._write_result(result_path, result)
+                return result, False
+            finally:
+                if acquired:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _acquire(self, lock_file) -> bool:
+        """获取文件锁，超时（不超过请求剩余的时限预算）返回 False（此时不持锁、各自计算）"""
+        timeout = self.lock_timeout
+        request_deadline = current_deadline()
+        if request_deadline is not None:
+            timeout = min(timeout, request_deadline.remaining())
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                # flock 不更新 mtime：持锁时刷新，清理时才能据此判断锁文件是否还在用
+                try:
+                    os.utime(lock_file.name)
+                except OSError:
+                    pass
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    print(f"⚠️  等待其他进程超时，自行计算: {os.path.basename(lock_file.name)}")
+                    return False
+                time.sleep(0.05)
+
+    def _read_result(self, path: str) -> Any:
+        try:
+            if time.time() - os.path.getmtime(path) > self.result_ttl:
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_result(self, path: str, result: Any):
+        """原子写入结果文件，并顺带清理过期文件"""
+        try:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"⚠️  结果无法跨进程共享: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._prune()
+
+    def _prune(self):
+        """删除过期的结果文件和长期未用的锁文件"""
+        now = time.time()
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                age = now - entry.stat().st_mtime
+                if entry.name.endswith('.json') and age > self.result_ttl * 10:
+                    os.remove(entry.path)
+                elif entry.name.endswith('.lock') and age > 86400:
+                    self._remove_idle_lock(entry.path)
+            except OSError:
+                continue
+
+    @staticmethod
+    def _remove_idle_lock(path: str):
+        """只删除没有进程持有的锁文件，否则持锁者和新来者会锁在不同的文件上"""
+        with open(path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            # 关闭文件时释放锁
+            os.remove(path)
@@ -0,0 +1,61 @@
+"""
+流式分析工具
+把模型的token流转换为按顶层字段推送的事件，并编码为Server-Sent Events
+
+事件：section（一个顶层字段）、done（完整结果）、error（失败）、
+reset（已推送的字段作废，之后重新推送完整报告）
+"""
+
+import json
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from json_utils import StreamingJSONParser
+
+
+def stream_report(
+    text_stream: Iterable[str],
+    parse_fallback: Callable[[str], Dict[str, Any]],
+    extra: Optional[Dict[str, Any]] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    消费模型的文本流，每完成一个顶层字段产出一个 section 事件
+
+    Args:
+        text_stream: 模型输出的文本片段迭代器
+        parse_fallback: 流式解析不完整时对全文的兜底解析函数
+        extra: 合并进最终结果的附加字段（provider、model等）
+
+    Returns:
+        事件迭代器：{'event': 'section', 'key', 'value'}，最后是 {'event': 'done', 'result'}
+    """
+    parser = StreamingJSONParser()
+    chunks = []
+
+    for text in text_stream:
+        chunks.append(text)
+        for key, value in parser.feed(text):
+            yield {'event': 'section', 'key': key, 'value': value}
+
+    if parser.done and not parser.errors:
+        result = dict(parser.sections)
+    else:
+        result = parse_fallback(''.join(chunks))
+
+    if extra:
+        result.update(extra)
+
+    yield {'event': 'done', 'result': result}
+
+
+def result_events(result: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """把已完成的结果（规则引擎等）按相同的事件格式产出"""
+    for key, value in result.items():
+        yield {'event': 'section', 'key': key, 'value': value}
+    yield {'event': 'done', 'result': result}
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """编码为一条SSE消息"""
+    payload = {k: v for k, v in event.items() if k != 'event'}
+    data = json.dumps(payload, ensure_ascii=False)
+    return f"event: {event['event']}\ndata: {data}\n\n"
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+本地桩大模型服务 - 压测用，不消耗真实配额
+兼容三种线路格式：
+- OpenAI / DeepSeek / 智谱AI：POST .../chat/completions（支持 stream=true 的 SSE）
+- Anthropic Claude：POST .../v1/messages（支持 stream=true 的 SSE）
+返回与真实模型相同格式的舌诊报告JSON，延迟、错误率、流式分片速度均可配置
+
+用法：
+    python stub_llm_server.py --port 8900 --latency lognormal:2.0,0.5 --error-rate 0.02
+
+    DEEPSEEK_BASE_URL=http://127.0.0.1:8900 DEEPSEEK_API_KEY=stub python app.py
+    ZHIPUAI_BASE_URL=http://127.0.0.1:8900/api/paas/v4 ZHIPU_API_KEY=stub.stub python app.py
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8900 ANTHROPIC_API_KEY=stub python professional_analyzer.py
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from tcm_knowledge import CONSTITUTIONS, typical_report
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """
+    解析延迟分布（秒）
+
+    支持：
+        fixed:1.5           固定延迟
+        uniform:0.5,3       均匀分布
+        lognormal:2.0,0.5   对数正态（中位数, sigma），模拟长尾
+        exp:1.0             指数分布（均值）
+    """
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',') if v]
+
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'lognormal':
+        median, sigma = values
+        return lambda: random.lognormvariate(math.log(median), sigma)
+    if kind == 'exp':
+        return lambda: random.expovariate(1 / values[0])
+    raise ValueError(f"不支持的延迟分布: {spec}")
+
+
+class StubConfig:
+    """桩服务的行为配置"""
+
+    def __init__(
+        self,
+        latency: Callable[[], float],
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        chunk_size: int = 24,
+        garbled_rate: float = 0.0
+    ):
+        """
+        Args:
+            latency: 每次请求的总延迟采样函数（流式时分摊到各分片）
+            error_rate: 返回 500 的概率
+            rate_limit_rate: 返回 429 的概率
+            chunk_size: 流式输出每个分片的字符数
+            garbled_rate: 返回截断（不完整）JSON 的概率
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.chunk_size = chunk_size
+        self.garbled_rate = garbled_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count(self) -> int:
+        with self._lock:
+            self.requests += 1
+            return self.requests
+
+
+def _report_text(garbled: bool) -> str:
+    """随机一种体质的典型报告，按模型习惯包在 ```json 代码块里"""
+    report = typical_report(random.choice(CONSTITUTIONS))
+    report.pop('provider', None)
+    report.pop('model', None)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if garbled:
+        text = text[:len(text) * 2 // 3]
+    return f"```json\n{text}\n```"
+
+
+def _chunks(text: str, size: int) -> Iterator[str]:
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """按路径区分 OpenAI 兼容格式与 Anthropic 格式"""
+
+    config: StubConfig
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # 压测时不逐条打印
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send_json(400, {'error': {'message': 'invalid json'}})
+
+        self.config.count()
+        if self.path.rstrip('/').endswith('/chat/completions'):
+            wire = 'openai'
+        elif self.path.rstrip('/').endswith('/messages'):
+            wire = 'anthropic'
+        else:
+            return self._send_json(404, {'error': {'message': f'unknown path {self.path}'}})
+
+        delay = self.config.latency()
+        roll = random.random()
+        if roll < self.config.error_rate:
+            time.sleep(delay)
+            return self._send_json(500, {'error': {'type': 'server_error', 'message': 'stub internal error'}})
+        if roll < self.config.error_rate + self.config.rate_limit_rate:
+            return self._send_json(429, {'error': {'type': 'rate_limit_error', 'message': 'stub rate limited'}})
+
+        text = _report_text(random.random() < self.config.garbled_rate)
+        model = body.get('model', 'stub-model')
+
+        if body.get('stream'):
+            self._stream(wire, model, text, delay)
+        else:
+            time.sleep(delay)
+            self._send_json(200, self._completion(wire, model, text))
+
+    @staticmethod
+    def _completion(wire: str, model: str, text: str) -> Dict[str, Any]:
+        """非流式响应体"""
+        if wire == 'anthropic':
+            return {
+                'id': f"msg_{uuid.uuid4().hex[:24]}",
+                'type': 'message',
+                'role': 'assistant',
+                'model': model,
+                'content': [{'type': 'text', 'text': text}],
+                'stop_reason': 'end_turn',
+                'stop_sequence': None,
+                'usage': {'input_tokens': 800, 'output_tokens': len(text) // 2}
+            }
+        return {
+            'id': f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': text},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 800, 'completion_tokens': len(text) // 2, 'total_tokens': 800 + len(text) // 2}
+        }
+
+    def _stream(self, wire: str, model: str, text: str, delay: float):
+        """按SSE逐片输出，总延迟分摊到各分片"""
+        pieces = list(_chunks(text, self.config.chunk_size))
+        per_chunk = delay / max(1, len(pieces))
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        try:
+            if wire == 'anthropic':
+                self._stream_anthropic(model, pieces, per_chunk)
+            else:
+                self._stream_openai(model, pieces, per_chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端取消（如对冲请求的落败方）
+
+    def _stream_openai(self, model: str, pieces, per_chunk: float):
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        for piece in pieces:
+            time.sleep(per_chunk)
+            self._sse(None, {
+                'id': chunk_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]
+            })
+        self._sse(None, {
+            'id': chunk_id,
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]
+        })
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+
+    def _stream_anthropic(self, model: str, pieces, per_chunk: float):
+        message_id = f"msg_{uuid.uuid4().hex[:24]}"
+        self._sse('message_start', {'type': 'message_start', 'message': {
+            'id': message_id, 'type': 'message', 'role': 'assistant', 'model': model,
+            'content': [], 'stop_reason': None, 'stop_sequence': None,
+            'usage': {'input_tokens': 800, 'output_tokens': 1}
+        }})
+        self._sse('content_block_start', {
+            'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}
+        })
+        for piece in pieces:
+            time.sleep(per_chunk)
+            self._sse('content_block_delta', {
+                'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': piece}
+            })
+        self._sse('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        self._sse('message_delta', {
+            'type': 'message_delta',
+            'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+            'usage': {'output_tokens': sum(len(p) for p in pieces) // 2}
+        })
+        self._sse('message_stop', {'type': 'message_stop'})
+
+    def _sse(self, event: Optional[str], data: Dict[str, Any]):
+        message = ''
+        if event:
+            message += f"event: {event}\n"
+        message += f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+        self.wfile.write(message.encode('utf-8'))
+        self.wfile.flush()
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(host: str, port: int, config: StubConfig) -> ThreadingHTTPServer:
+    """创建桩服务（port=0 时由系统分配端口）"""
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地桩大模型服务（OpenAI / 智谱 / Anthropic 线路格式）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', default='lognormal:2.0,0.5',
+                        help='延迟分布：fixed:S | uniform:A,B | lognormal:MEDIAN,SIGMA | exp:MEAN')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回500的概率')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='返回429的概率')
+    parser.add_argument('--garbled-rate', type=float, default=0.0, help='返回截断JSON的概率')
+    parser.add_argument('--chunk-size', type=int, default=24, help='流式分片的字符数')
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency=parse_latency(args.latency),
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        chunk_size=args.chunk_size,
+        garbled_rate=args.garbled_rate
+    )
+    server = make_server(args.host, args.port, config)
+
+    print("=" * 60)
+    print(f"🧪 桩大模型服务: http://{args.host}:{server.server_port}")
+    print(f"   延迟: {args.latency}，错误率: {args.error_rate}，429比例: {args.rate_limit_rate}")
+    print("=" * 60)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n👋 已停止，共处理 {config.requests} 个请求")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,558 @@
+"""
+中医体质知识库
+九种体质的典型舌象、体质说明和调理建议，供规则引擎组装报告
+"""
+
+import copy
+from typing import Any, Dict
+
+
+# 九种体质（《中医体质分类与判定》标准）
+CONSTITUTIONS = [
+    "平和质", "气虚质", "阳虚质", "阴虚质", "痰湿质",
+    "湿热质", "血瘀质", "气郁质", "特禀质"
+]
+
+CONSTITUTION_KNOWLEDGE: Dict[str, Dict[str, Any]] = {
+    "平和质": {
+        "name": "平和体质",
+        "typical_tongue": {
+            "tongue_body": {
+                "color": "淡红色",
+                "shape": "舌体大小适中",
+                "features": [
+                    "舌质柔软",
+                    "活动灵活",
+                    "无明显异常"
+                ]
+            },
+            "tongue_coating": {
+                "color": "薄白色",
+                "thickness": "薄",
+                "texture": "均匀分布，润泽适中"
+            }
+        },
+        "secondary": [],
+        "description": "恭喜！您的体质非常健康，气血阴阳平衡，身体状态良好。",
+        "health_score": 95,
+        "score_level": "优秀",
+        "advice": {
+            "diet": {
+                "recommended": [
+                    "🥦 新鲜绿叶蔬菜",
+                    "🍎 时令水果",
+                    "🐟 优质蛋白（鱼、鸡肉）",
+                    "🌾 全谷物（燕麦、糙米）"
+                ],
+                "avoid": [
+                    "❌ 过度油腻食物",
+                    "❌ 高糖饮料"
+                ]
+            },
+            "lifestyle": [
+                "💤 保持规律作息，每天7-8小时睡眠",
+                "🏃 每周3-5次中等强度运动",
+                "😊 保持心情愉悦，适度放松"
+            ],
+            "acupoints": [
+                "✋ 足三里（小腿外侧，增强免疫力）",
+                "✋ 三阴交（小腿内侧，调理气血）"
+            ]
+        },
+        "herbs": [
+            "🌿 枸杞（养肝明目）",
+            "🌿 红枣（补气养血）",
+            "🌿 山药（健脾益肺）"
+        ],
+        "summary": "健康状态优秀！继续保持良好的生活习惯。"
+    },
+    "气虚质": {
+        "name": "气虚体质",
+        "typical_tongue": {
+            "tongue_body": {
+                "color": "淡白色",
+                "shape": "舌体胖大",
+                "features": [
+                    "舌边有明显齿痕",
+                    "舌质偏嫩",
+                    "舌体略肿"
+                ]
+            },
+            "tongue_coating": {
+                "color": "白色",
+                "thickness": "薄",
+                "texture": "水滑，略显湿润"
+            }
+        },
+        "secondary": [
+            "脾虚倾向"
+        ],
+        "description": "您可能存在气虚的情况，容易疲劳乏力，需要补气健脾。",
+        "health_score": 72,
+        "score_level": "良好",
+        "advice": {
+            "diet": {
+                "recommended": [
+                    "🍠 山药（健脾补气）",
+                    "🌰 红枣（补中益气）",
+                    "🍯 蜂蜜（润肺养胃）",
+                    "🍖 瘦肉（补充蛋白质）",
+                    "🌾 小米粥（养胃健脾）"
+                ],
+                "avoid": [
+                    "❌ 生冷食物（冰淇淋、冷饮）",
+                    "❌ 过于辛辣刺激的食物"
+                ]
+            },
+            "lifestyle": [
+                "💤 避免熬夜，早睡早起（23点前入睡）",
+                "🏃 适度运动，避免过度劳累（太极、瑜伽）",
+                "😊 保持心情舒畅，减少压力"
+            ],
+            "acupoints": [
+                "✋ 气海穴（肚脐下方，补气培元）",
+                "✋ 足三里（补气健脾，增强体质）"
+            ]
+        },
+        "herbs": [
+            "🌿 黄芪（补气升阳，增强免疫力）",
+            "🌿 党参（补中益气，健脾生津）",
+            "🌿 白术（健脾益气，燥湿利水）"
+        ],
+        "summary": "气虚体质，注意补气健脾，避免过劳。"
+    },
+    "阳虚质": {
+        "name": "阳虚体质",
+        "typical_tongue": {
+            "tongue_body": {
+                "color": "淡白色",
+                "shape": "舌体胖嫩",
+                "features": [
+                    "舌质淡嫩",
+                    "舌边可见齿痕",
+                    "舌面水润"
+                ]
+            },
+            "tongue_coating": {
+                "color": "白色",
+                "thickness": "薄",
+                "texture": "白滑，水分较多"
+            }
+        },
+        "secondary": [
+            "气虚倾向"
+        ],
+        "description": "体内阳气不足，容易怕冷、手脚冰凉，需要温阳散寒。",
+        "health_score": 68,
+        "score_level": "良好",
+        "advice": {
+            "diet": {
+                "recommended": [
+                    "🍖 羊肉（温补阳气）",
+                    "🫚 生姜（温中散寒）",
+                    "🌰 核桃（温补肾阳）",
+                    "🥣 桂圆红枣粥（温补气血）",
+                    "🦐 虾（补肾助阳）"
+                ],
+                "avoid": [
+                    "❌ 生冷寒凉食物（冷饮、西瓜）",
+                    "❌ 凉茶、苦寒类饮品"
+                ]
+            },
+            "lifestyle": [
+                "💤 早睡晚起，避免熬夜耗伤阳气",
+                "🏃 多晒太阳，适度运动（快走、八段锦）",
+                "🧦 注意腰腹和足部保暖",
+                "🛁 睡前温水泡脚15-20分钟"
+            ],
+            "acupoints": [
+                "✋ 关元穴（肚脐下3寸，温补元阳）",
+                "✋ 命门穴（腰部正中，温肾壮阳）"
+            ]
+        },
+        "herbs": [
+            "🌿 肉桂（补火助阳，散寒止痛）",
+            "🌿 杜仲（补肝肾，强筋骨）",
+            "🌿 干姜（温中散寒）"
+        ],
+        "summary": "阳虚体质，注意温阳保暖，少吃生冷。"
+    },
+    "阴虚质": {
+        "name": "阴虚体质",
+        "typical_tongue": {
+            "tongue_body": {
+                "color": "红色偏深",
+                "shape": "舌体偏瘦",
+                "features": [
+                    "舌面有裂纹",
+                    "舌尖红",
+                    "舌质干燥"
+                ]
+            },
+            "tongue_coating": {
+                "color": "少苔或无苔",
+                "thickness": "薄或剥脱",
+                "texture": "干燥"
+            }
+        },
+        "secondary": [
+            "内热"
+        ],
+        "description": "体内阴液不足，虚火内生，容易口干、手脚心热。",
+        "health_score": 68,
+        "score_level": "良好",
+        "advice": {
+            "diet": {
+                "recommended": [
+                    "🥛 银耳（滋阴润肺）",
+                    "🫒 枸杞（滋阴补肾）",
+                    "🥥 椰子水（清热生津）",
+                    "🐚 海参（滋阴补肾）",
+                    "🍐 雪梨（润肺生津）"
+                ],
+                "avoid": [
+                    "❌ 辛辣刺激食物（辣椒、胡椒）",
+                    "❌ 煎炸烧烤食物",
+                    "❌ 过于温燥的食物"
+                ]
+            },
+            "lifestyle": [
+                "💤 保证充足睡眠，23点前入睡",
+                "🏃 避免剧烈运动，选择柔和运动（瑜伽、太极）",
+                "😊 保持心态平和，避免急躁",
+                "💧 多喝温水，保持体内水分"
+            ],
+            "acupoints": [
+                "✋ 太溪穴（脚内踝后，滋阴补肾）",
+                "✋ 三阴交（小腿内侧，滋阴养血）"
+            ]
+        },
+        "herbs": [
+            "🌿 麦冬（养阴生津，润肺清心）",
+            "🌿 沙参（养阴清肺，益胃生津）",
+            "🌿 石斛（益胃生津，滋阴清热）"
+        ],
+        "summary": "阴虚体质，注意滋阴润燥，避免熬夜。"
+    },
+    "痰湿质": {
+        "name": "痰湿体质",
+        "typical_tongue": {
+            "tongue_body": {
+                "color": "淡红色",
+                "shape": "舌体胖大",
+                "features": [
+                    "舌边有齿痕",
+                    "舌体肥厚"
+                ]
+            },
+            "tongue_coating": {
+                "color": "白色",
+                "thickness": "厚腻",
+                "texture": "白腻苔，黏滞不爽"
+            }
+        },
+        "secondary": [
+            "脾虚湿盛"
+        ],
+        "description": "体内水湿运化不畅，容易身体沉重、痰多、腹部肥满。",
+        "health_score": 63,
+        "score_level": "一般",
+        "advice": {
+            "diet": {
+                "recommended": [
+                    "🫘 薏米红豆汤（健脾祛湿）",
+                    "🥒 冬瓜（利水消肿）",
+                    "🍊 陈皮（理气化痰）",
+                    "🌾 山药小米粥（健脾养胃）",
+                    "🥬 白萝卜（化痰消食）"
+                ],
+                "avoid": [
+                    "❌ 肥甘厚味（肥肉、油炸）",
+                    "❌ 甜食和含糖饮料",
+                    "❌ 夜宵暴食"
+                ]
+            },
+            "lifestyle": [
+                "💤 避免久卧久坐，不宜贪睡",
+                "🏃 坚持有氧运动，微微出汗为宜",
+                "🏠 居住环境保持干燥通风",
+                "🍽️ 吃饭七分饱，细嚼慢咽"
+            ],
+            "acupoints": [
+                "✋ 丰隆穴（小腿外侧，化痰祛湿）",
+                "✋ 中脘穴（肚脐上4寸，健脾和胃）"
+            ]
+        },
+        "herbs": [
+            "🌿 茯苓（健脾渗湿）",
+            "🌿 陈皮（理气健脾，燥湿化痰）",
+            "🌿 白扁豆（健脾化湿）"
+        ],
+        "summary": "痰湿体质，建议健脾祛湿，饮食清淡多运动。"
+    },
+    "湿热质": {
+        "name": "湿热体质",
+        "typical_tongue": {
+            "tongue_body": {
+                "color": "红色",
+                "shape": "舌体略胖",
+                "features": [
+                    "舌质红",
+                    "舌体偏厚"
+                ]
+            },
+            "tongue_coating": {
+                "color": "黄色",
+                "thickness": "厚腻",
+                "texture": "黄腻苔，不易刮除"
+            }
+        },
+        "secondary": [
+            "脾虚湿盛"
+        ],
+        "description": "体内湿热交织，容易口苦、身体困重、皮肤油腻。",
+        "health_score": 60,
+        "score_level": "一般",
+        "advice": {
+            "diet": {
+                "recommended": [
+                    "🫘 薏米（健脾祛湿）",
+                    "🫛 绿豆（清热解毒）",
+                    "🥒 冬瓜（清热利水）",
+                    "🌽 玉米须茶（利尿祛湿）",
+                    "🍵 苦瓜（清热降火）"
+                ],
+                "avoid": [
+                    "❌ 油腻厚味食物",
+                    "❌ 甜食糖类",
+                    "❌ 酒类饮品",
+                    "❌ 辛辣刺激食物"
+                ]
+            },
+            "lifestyle": [
+                "💤 避免熬夜，保持规律作息",
+                "🏃 增加运动出汗，促进湿气排出",
+                "😊 保持环境通风干燥",
+                "🚿 避免长时间处于潮湿环境"
+            ],
+            "acupoints": [
+                "✋ 阴陵泉（小腿内侧，健脾利湿）",
+                "✋ 丰隆穴（小腿外侧，化痰祛湿）"
+            ]
+        },
+        "herbs": [
+            "🌿 茯苓（利水渗湿，健脾宁心）",
+            "🌿 泽泻（利水渗湿，泄热）",
+            "🌿 车前草（清热利尿，祛痰）"
+        ],
+        "summary": "湿热体质，建议清热祛湿，饮食清淡。"
+    },
+    "血瘀质": {
+        "name": "血瘀体质",
+        "typical_tongue": {
+            "tongue_body": {
+                "color": "暗紫色",
+                "shape": "舌体正常",
+                "features": [
+                    "舌下静脉曲张",
+                    "舌面有瘀点",
+                    "舌质暗沉"
+                ]
+            },
+            "tongue_coating": {
+                "color": "薄白",
+                "thickness": "薄",
+                "texture": "正常"
+            }
+        },
+        "secondary": [
+            "气滞倾向"
+        ],
+        "description": "存在血液循环不畅的迹象，需要活血化瘀，促进气血运行。",
+        "health_score": 65,
+        "score_level": "一般",
+        "advice": {
+            "diet": {
+                "recommended": [
+                    "🫐 黑木耳（活血化瘀）",
+                    "🍇 山楂（消食化瘀）",
+                    "🧅 洋葱（降脂活血）",
+                    "🐟 深海鱼（omega-3）",
+                    "🍵 玫瑰花茶（疏肝理气）"
+                ],
+                "avoid": [
+                    "❌ 高盐高脂食物",
+                    "❌ 油炸食品",
+                    "❌ 久坐不动"
+                ]
+            },
+            "lifestyle": [
+                "💤 保证充足睡眠，避免熬夜",
+                "🏃 增加有氧运动（快走、游泳、慢跑）",
+                "😊 保持心情舒畅，避免久坐",
+                "🚶 每小时起身活动5-10分钟"
+            ],
+            "acupoints": [
+                "✋ 血海穴（大腿内侧，活血调经）",
+                "✋ 膈俞穴（背部，活血化瘀）"
+            ]
+        },
+        "herbs": [
+            "🌿 三七（活血化瘀，止痛）",
+            "🌿 当归（补血活血，调经）",
+            "🌿 丹参（活血祛瘀，凉血消痈）"
+        ],
+        "summary": "血瘀体质，建议增加运动，活血化瘀。"
+    },
+    "气郁质": {
+        "name": "气郁体质",
+        "typical_tongue": {
+            "tongue_body": {
+                "color": "淡红色",
+                "shape": "舌体正常",
+                "features": [
+                    "舌边略红",
+                    "舌质偏暗"
+                ]
+            },
+            "tongue_coating": {
+                "color": "薄白",
+                "thickness": "薄",
+                "texture": "正常"
+            }
+        },
+        "secondary": [
+            "肝郁倾向"
+        ],
+        "description": "气机郁滞不畅，容易情绪低落、胸闷叹气、睡眠不佳。",
+        "health_score": 70,
+        "score_level": "良好",
+        "advice": {
+            "diet": {
+                "recommended": [
+                    "🌹 玫瑰花茶（疏肝解郁）",
+                    "🍊 柑橘类水果（理气开胃）",
+                    "🌼 菊花（清肝明目）",
+                    "🥬 芹菜（平肝清热）",
+                    "🍋 佛手（疏肝理气）"
+                ],
+                "avoid": [
+                    "❌ 浓茶咖啡过量",
+                    "❌ 暴饮暴食",
+                    "❌ 酒精饮品"
+                ]
+            },
+            "lifestyle": [
+                "💤 规律作息，睡前放下手机",
+                "🏃 多参加户外活动和集体运动",
+                "😊 培养兴趣爱好，多与朋友交流",
+                "🎵 听音乐、冥想，舒缓压力"
+            ],
+            "acupoints": [
+                "✋ 太冲穴（足背第一二跖骨间，疏肝理气）",
+                "✋ 膻中穴（两乳头连线中点，宽胸理气）"
+            ]
+        },
+        "herbs": [
+            "🌿 玫瑰花（行气解郁）",
+            "🌿 合欢花（解郁安神）",
+            "🌿 佛手（疏肝理气，和胃止痛）"
+        ],
+        "summary": "气郁体质，注意疏肝解郁，保持心情舒畅。"
+    },
+    "特禀质": {
+        "name": "特禀体质",
+        "typical_tongue": {
+            "tongue_body": {
+                "color": "淡红色",
+                "shape": "舌体正常",
+                "features": [
+                    "舌象无明显特异表现"
+                ]
+            },
+            "tongue_coating": {
+                "color": "薄白",
+                "thickness": "薄",
+                "texture": "正常"
+            }
+        },
+        "secondary": [
+            "过敏倾向"
+        ],
+        "description": "先天禀赋特殊，容易过敏（鼻炎、皮肤瘙痒等），需要规避过敏原。",
+        "health_score": 70,
+        "score_level": "良好",
+        "advice": {
+            "diet": {
+                "recommended": [
+                    "🥦 新鲜清淡的蔬菜",
+                    "🌾 糙米、燕麦等粗粮",
+                    "🍯 蜂蜜（非过敏人群，润肺）",
+                    "🍐 梨（润肺止咳）"
+                ],
+                "avoid": [
+                    "❌ 已知的过敏食物（海鲜、芒果等）",
+                    "❌ 辛辣刺激和腥膻发物"
+                ]
+            },
+            "lifestyle": [
+                "💤 规律作息，增强体质",
+                "🏃 适度运动，避开花粉季户外活动",
+                "🏠 保持室内清洁，勤晒被褥",
+                "😷 换季时注意防护"
+            ],
+            "acupoints": [
+                "✋ 足三里（小腿外侧，增强免疫力）",
+                "✋ 迎香穴（鼻翼旁，通利鼻窍）"
+            ]
+        },
+        "herbs": [
+            "🌿 黄芪（益气固表）",
+            "🌿 防风（祛风解表）",
+            "🌿 乌梅（敛肺生津）"
+        ],
+        "summary": "特禀体质，注意规避过敏原，增强体质。"
+    }
+}
+
+
+def normalize_constitution(name: str) -> str:
+    """
+    把模型或用户给出的体质名称归一化为标准名称
+
+    例如 "平和"、"平和体质"、"气虚质（脾虚）" → "平和质"、"气虚质"；无法识别时原样返回
+    """
+    for constitution in CONSTITUTIONS:
+        if constitution[:2] in (name or ''):
+            return constitution
+    return name
+
+
+def typical_report(constitution: str) -> Dict[str, Any]:
+    """
+    按体质的典型舌象组装一份完整报告（规则引擎演示用）
+
+    Args:
+        constitution: 标准体质名称
+
+    Returns:
+        与AI分析结果格式一致的报告
+    """
+    entry = CONSTITUTION_KNOWLEDGE[constitution]
+    tongue = copy.deepcopy(entry["typical_tongue"])
+    return {
+        "tongue_body": tongue["tongue_body"],
+        "tongue_coating": tongue["tongue_coating"],
+        "constitution": {
+            "primary": entry["name"],
+            "secondary": list(entry["secondary"]),
+            "description": entry["description"]
+        },
+        "health_score": entry["health_score"],
+        "score_level": entry["score_level"],
+        "advice": copy.deepcopy(entry["advice"]),
+        "herbs": list(entry["herbs"]),
+        "summary": entry["summary"],
+        "provider": "规则引擎",
+        "model": "rule-based"
+    }
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+测试准入控制：超出容量快速拒绝（带 Retry-After），低优先级先被拒绝，升级积压时降级为本地报告，并发释放只归还一次
+"""
+
+import threading
+
+import pytest
+
+from admission import ADMIT, BATCH, DEGRADE, DEMO, INTERACTIVE, REJECT, AdmissionController, Ticket
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+
+def test_lower_priorities_are_shed_first():
+    controller = AdmissionController(max_in_flight=4, target_seconds=1, max_backlog=0)
+    held = [controller.acquire(INTERACTIVE)]
+
+    demo = controller.acquire(DEMO)
+    assert demo.outcome == REJECT and demo.status_code == 429
+    held.append(controller.acquire(BATCH))
+    assert controller.acquire(BATCH).status_code == 429
+
+    held += [controller.acquire(INTERACTIVE), controller.acquire(INTERACTIVE)]
+    full = controller.acquire(INTERACTIVE)
+    assert full.outcome == REJECT and full.status_code == 503 and full.retry_after >= 1
+
+    for ticket in held:
+        ticket.release()
+        ticket.release()  # 重复归还无效果
+    assert controller.stats()['in_flight'] == 0
+    assert controller.acquire(DEMO).outcome == ADMIT
+
+
+class RacyTicket(Ticket):
+    """读取释放标志时等待另一线程也读到，使检查和设置之间的竞争必然发生"""
+
+    def __init__(self, *args, **kwargs):
+        self.barrier = threading.Barrier(2, timeout=0.5)
+        super().__init__(*args, **kwargs)
+
+    @property
+    def _released(self):
+        released = self.__dict__['released']
+        try:
+            self.barrier.wait()
+        except threading.BrokenBarrierError:
+            pass  # 另一线程被锁挡住，读不到这里
+        return released
+
+    @_released.setter
+    def _released(self, value):
+        self.__dict__['released'] = value
+
+
+def test_concurrent_release_returns_capacity_once():
+    """流式响应的生成器和连接关闭回调可能在不同线程同时释放同一个准入"""
+    controller = AdmissionController(max_in_flight=4, target_seconds=1, max_backlog=0)
+    controller.acquire()
+    ticket = RacyTicket(controller, INTERACTIVE, ADMIT)
+
+    threads = [threading.Thread(target=ticket.release) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert controller.stats()['in_flight'] == 0
+
+
+def test_slow_requests_shrink_the_limit():
+    controller = AdmissionController(max_in_flight=8, target_seconds=1, max_backlog=0)
+    controller.acquire().release(latency=4.0)
+    assert controller.limit() == 2
+    assert controller.retry_after() == 4
+
+    for _ in range(30):
+        controller.acquire().release(latency=0.1)
+    assert controller.limit() == 8
+
+
+def test_backlog_degrades():
+    depth = [0]
+    controller = AdmissionController(max_in_flight=4, max_backlog=10, backlog=lambda: depth[0])
+    assert controller.acquire().outcome == ADMIT
+    depth[0] = 10
+    assert controller.acquire().outcome == DEGRADE
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setitem(app_module.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    client = app_module.app.test_client()
+    client.get('/api/queue/stats')  # 创建服务
+    return client, app_module
+
+
+@pytest.fixture
+def image(tmp_path):
+    image = np.full((600, 800, 3), 40, np.uint8)
+    cv2.ellipse(image, (400, 300), (350, 280), 0, 0, 360, (170, 160, 230), -1)
+    path = str(tmp_path / 'tongue.jpg')
+    cv2.imwrite(path, image)
+    return path
+
+
+def test_api_rejects_with_retry_after(client, image, monkeypatch):
+    client, app_module = client
+    controller = AdmissionController(max_in_flight=1, max_backlog=0)
+    monkeypatch.setattr(app_module, 'admission', controller)
+    held = controller.acquire(INTERACTIVE)
+
+    with open(image, 'rb') as f:
+        response = client.post('/api/analyze', data={'tongue_image': (f, 'tongue.jpg')})
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.get_json()['success'] is False
+
+    held.release()
+    with open(image, 'rb') as f:
+        response = client.post('/api/analyze', data={'tongue_image': (f, 'tongue.jpg')})
+    assert response.status_code == 200
+    assert controller.stats()['in_flight'] == 0
+
+
+def test_api_degrades_to_local_report(client, image, monkeypatch):
+    client, app_module = client
+    monkeypatch.setattr(app_module, 'admission', AdmissionController(max_backlog=1, backlog=lambda: 5))
+    monkeypatch.setattr(app_module.progressive.analyzer, 'use_mock', False)
+
+    with open(image, 'rb') as f:
+        body = client.post('/api/analyze', data={'tongue_image': (f, 'tongue.jpg')}).get_json()
+    assert body['success'] and body['degraded']
+    assert body['status'] == 'complete'
+    assert body['data']['constitution']['primary']
+    assert app_module.progressive.job_info(body['job_id']) is None
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+测试批量分析接口：multipart / tar / zip 上传，NDJSON 逐行返回，单张失败不影响其他图片
+"""
+
+import io
+import json
+import tarfile
+import zipfile
+
+import pytest
+
+from batch import follow_upgrades
+from progressive import COMPLETE, PENDING_UPGRADE, ResultStore
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+
+def _jpeg(shade):
+    image = np.full((240, 320, 3), 40, np.uint8)
+    cv2.ellipse(image, (160, 120), (130, 100), 0, 0, 360, (shade, 150, 220), -1)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setitem(app_module.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    return app_module.app.test_client()
+
+
+def _lines(response):
+    assert response.mimetype == 'application/x-ndjson'
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_multipart_batch(client):
+    response = client.post('/api/analyze/batch?wait=0', data={'images': [
+        (io.BytesIO(_jpeg(150)), 'a.jpg'),
+        (io.BytesIO(b'not an image at all, just text'), 'notes.txt'),
+        (io.BytesIO(_jpeg(190)), 'b.jpg'),
+    ]})
+    assert response.status_code == 200
+    lines = _lines(response)
+
+    reports = {line['filename']: line for line in lines if line.get('event') == 'report'}
+    assert set(reports) == {'a.jpg', 'notes.txt', 'b.jpg'}
+    assert reports['a.jpg']['success'] and reports['b.jpg']['success']
+    assert reports['a.jpg']['data']['image_url'].startswith('/api/images/')
+    assert reports['a.jpg']['job_id']
+    assert not reports['notes.txt']['success']
+    assert reports['notes.txt']['index'] == 1
+
+    summary = lines[-1]['summary']
+    assert summary['images'] == 3
+    assert summary['succeeded'] == 2 and summary['failed'] == 1
+
+
+def test_tar_and_zip_batches(client):
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode='w:gz') as archive:
+        for name, content in (('session/1.jpg', _jpeg(150)), ('session/.DS_Store', b'x'), ('session/2.jpg', _jpeg(200))):
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+
+    response = client.post('/api/analyze/batch?wait=0', data=tar_buffer.getvalue(),
+                           content_type='application/gzip')
+    assert response.status_code == 200
+    summary = _lines(response)[-1]['summary']
+    assert summary['images'] == 2 and summary['succeeded'] == 2
+
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w') as archive:
+        archive.writestr('1.jpg', _jpeg(160))
+        archive.writestr('__MACOSX/._1.jpg', b'x')
+    response = client.post('/api/analyze/batch?wait=0', data=zip_buffer.getvalue(), content_type='application/zip')
+    lines = _lines(response)
+    assert [line['filename'] for line in lines if 'filename' in line] == ['1.jpg']
+
+
+def test_rejects_unsupported_body(client):
+    response = client.post('/api/analyze/batch', data=b'{}', content_type='application/json')
+    assert response.status_code == 415
+    empty = client.post('/api/analyze/batch', data={'images': (io.BytesIO(b''), '')})
+    assert empty.status_code == 400
+
+
+def test_follow_upgrades_reports_each_as_it_finishes():
+    store = ResultStore()
+    first = store.create({'summary': '本地'}, PENDING_UPGRADE)
+    second = store.create({'summary': '本地'}, PENDING_UPGRADE)
+    store.update(first, {'summary': '大模型'}, COMPLETE)
+
+    pending = {
+        first: {'index': 0, 'filename': 'a.jpg', 'version': 1},
+        second: {'index': 1, 'filename': 'b.jpg', 'version': 1},
+    }
+    updates = list(follow_upgrades(store, pending, timeout=0.3, poll_interval=0.05))
+    assert [u['filename'] for u in updates] == ['a.jpg']
+    assert updates[0]['data']['summary'] == '大模型'
+    assert list(pending) == [second]
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+测试 DeepSeek 批量重分析：编号对应到正确的图片、缺失或解析失败的部分二分重试、
+递归止于单张调用、提供商不可用时不再拆分
+"""
+
+import json
+import re
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import batch_reanalyze
+import resilience
+from analyzer import TongueAnalyzer
+from resilience import reset_guards
+from tcm_knowledge import typical_report
+
+_BATCH_LINE = re.compile(r'^\[(\d+)\] 舌质：([^；]+)；', re.M)
+_SINGLE_COLOR = re.compile(r'舌质颜色：(\S+) \(')
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class StubDeepSeek:
+    """
+    按提示词中的编号返回报告的 chat.completions 桩客户端：报告的 summary 为该图片的舌质标记，
+    便于检查结果是否对应到正确的图片
+
+    Args:
+        drop: 第一次批量调用时省略的编号
+        garble_batches: 批量调用一律返回截断的 JSON
+        garble_first: 只有第一次批量调用返回截断的 JSON
+        error: 每次调用都抛出的错误
+    """
+
+    def __init__(self, drop=(), garble_batches=False, garble_first=False, error=None):
+        self.drop = set(drop)
+        self.garble_batches = garble_batches
+        self.garble_first = garble_first
+        self.error = error
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, timeout=None, **request):
+        prompt = request['messages'][-1]['content']
+        lines = _BATCH_LINE.findall(prompt)
+        self.calls.append([marker for _, marker in lines] if lines else _SINGLE_COLOR.search(prompt).group(1))
+        if self.error is not None:
+            raise self.error
+
+        if not lines:
+            report = dict(typical_report('平和质'), summary=self.calls[-1])
+            return self._response(json.dumps(report, ensure_ascii=False))
+
+        first = sum(isinstance(call, list) for call in self.calls) == 1
+        reports = [
+            dict(typical_report('湿热质'), id=int(index), summary=marker)
+            for index, marker in lines
+            if not (first and int(index) in self.drop)
+        ]
+        # 打乱顺序：结果必须按 id 而不是位置对应
+        text = json.dumps(list(reversed(reports)), ensure_ascii=False)
+        if self.garble_batches or (first and self.garble_first):
+            text = text[:len(text) // 2]
+        return self._response(f"```json\n{text}\n```")
+
+    @staticmethod
+    def _response(content):
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=100, completion_tokens=50)
+        )
+
+
+def _features(path):
+    marker = path.rsplit('/', 1)[-1].split('.')[0]
+    return {
+        'tongue_color': {'type': marker, 'description': '测试'},
+        'coating': {'description': '薄白苔', 'thickness': '薄', 'color': '白'},
+        'shape': {'description': '正常'},
+        'texture': {'description': '正常'},
+        'summary': '测试特征'
+    }
+
+
+@pytest.fixture
+def make_analyzer(monkeypatch):
+    reset_guards()
+    monkeypatch.setattr(resilience.time, 'sleep', lambda seconds: None)
+
+    def make(stub):
+        monkeypatch.setattr(TongueAnalyzer, '_create_client', lambda self, provider, api_key: stub)
+        analyzer = TongueAnalyzer(api_key='test-key', provider='deepseek', hedge_providers=[], tiered=False)
+        analyzer.feature_extractor = SimpleNamespace(extract_features=_features)
+        return analyzer
+
+    yield make
+    reset_guards()
+
+
+def _paths(count):
+    return [f'/uploads/img{i}.jpg' for i in range(count)]
+
+
+def test_reports_map_back_by_id(make_analyzer):
+    stub = StubDeepSeek()
+    analyzer = make_analyzer(stub)
+    paths = _paths(10)
+
+    results = analyzer.analyze_batch(paths, batch_size=8)
+
+    assert list(results) == paths
+    for path in paths:
+        assert results[path]['summary'] == _features(path)['tongue_color']['type']
+        assert results[path]['provider'] == 'deepseek' and 'id' not in results[path]
+    assert [len(call) for call in stub.calls] == [8, 2]
+    assert analyzer.last_batch_stats['requests'] == 2
+    assert analyzer.last_batch_stats['prompt_tokens'] == 200
+
+
+def test_missing_entry_retries_only_that_image(make_analyzer):
+    stub = StubDeepSeek(drop={3})
+    analyzer = make_analyzer(stub)
+    paths = _paths(4)
+
+    results = analyzer.analyze_batch(paths)
+
+    assert stub.calls == [['img0', 'img1', 'img2', 'img3'], 'img2']
+    assert all(results[path]['summary'] == _features(path)['tongue_color']['type'] for path in paths)
+    assert analyzer.last_batch_stats['splits'] == 1
+
+
+def test_garbled_batch_splits_in_half(make_analyzer):
+    stub = StubDeepSeek(garble_first=True)
+    analyzer = make_analyzer(stub)
+
+    results = analyzer.analyze_batch(_paths(4))
+
+    assert stub.calls[1:] == [['img0', 'img1'], ['img2', 'img3']]
+    assert all(result['provider'] == 'deepseek' for result in results.values())
+
+
+def test_recursion_stops_at_single_calls(make_analyzer):
+    stub = StubDeepSeek(garble_batches=True)
+    analyzer = make_analyzer(stub)
+    paths = _paths(4)
+
+    results = analyzer.analyze_batch(paths)
+
+    # 4 → 2+2 → 1+1+1+1：单张走单张分析，不再继续拆分
+    assert len(stub.calls) == 7
+    assert sorted(call for call in stub.calls if isinstance(call, str)) == ['img0', 'img1', 'img2', 'img3']
+    assert all(results[path]['summary'] == _features(path)['tongue_color']['type'] for path in paths)
+
+
+def test_provider_outage_does_not_split(make_analyzer):
+    stub = StubDeepSeek(error=StatusError(503))
+    analyzer = make_analyzer(stub)
+    paths = _paths(8)
+
+    results = analyzer.analyze_batch(paths)
+
+    # 一个批次：只有保护层的重试（3次），没有拆分
+    assert len(stub.calls) == 3 and all(len(call) == 8 for call in stub.calls)
+    assert analyzer.last_batch_stats['splits'] == 0
+    assert analyzer.last_batch_stats['fallbacks'] == 8
+    assert all(results[path]['constitution']['primary'] for path in paths)
+
+
+def test_cli_writes_one_report_per_image(make_analyzer, tmp_path, monkeypatch):
+    stub = StubDeepSeek()
+    analyzer = make_analyzer(stub)
+    (tmp_path / 'ab' / 'cd').mkdir(parents=True)
+    (tmp_path / 'derivatives').mkdir()
+    for name in ('ab/cd/one.jpg', 'two.png', 'derivatives/one_thumbnail.webp'):
+        (tmp_path / name).write_bytes(b'image')
+
+    assert batch_reanalyze.find_images(str(tmp_path)) == [str(tmp_path / 'ab/cd/one.jpg'), str(tmp_path / 'two.png')]
+
+    monkeypatch.setattr(batch_reanalyze, 'TongueAnalyzer', lambda provider: analyzer)
+    monkeypatch.setattr(sys, 'argv', ['batch_reanalyze.py', str(tmp_path)])
+    batch_reanalyze.main()
+
+    with open(tmp_path / 'ab/cd/one_deepseek_analysis.json', encoding='utf-8') as f:
+        assert json.load(f)['summary'] == 'one'
+    with open(tmp_path / 'two_deepseek_analysis.json', encoding='utf-8') as f:
+        assert json.load(f)['summary'] == 'two'
+    assert len(stub.calls) == 1
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+测试提供商调用的录制/回放
+"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from cassette import RECORD, REPLAY, Cassette, CassetteMissError, ReplayedError, use_cassette
+from resilience import get_guard, reset_guards
+
+
+class FakeCompletions:
+    """按请求返回固定内容的 chat.completions 桩，可模拟流式和错误"""
+
+    def __init__(self, fail_first=False):
+        self.calls = 0
+        self.fail_first = fail_first
+
+    def create(self, stream=False, **request):
+        self.calls += 1
+        if self.fail_first and self.calls == 1:
+            error = RuntimeError('overloaded')
+            error.status_code = 503
+            raise error
+        content = json.dumps({'constitution': {'primary': '平和质'}, 'echo': request['messages'][0]['content']})
+        if stream:
+            return iter([
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content[:10]))]),
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content[10:]))]),
+            ])
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=SimpleNamespace(prompt_tokens=10))
+
+
+class FailingCompletions:
+    def create(self, **request):
+        raise AssertionError('回放模式不应访问提供商')
+
+
+@pytest.fixture(autouse=True)
+def _reset():
+    reset_guards()
+    yield
+    use_cassette(None)
+    reset_guards()
+
+
+def _request(text):
+    return {'model': 'deepseek-chat', 'messages': [{'role': 'user', 'content': text}]}
+
+
+def test_record_then_replay(tmp_path):
+    path = str(tmp_path / 'run.jsonl.gz')
+    live = FakeCompletions()
+
+    use_cassette(Cassette(path, RECORD))
+    recorded = get_guard('deepseek').call(live.create, **_request('a' * 5000))
+    chunks = [c.choices[0].delta.content for c in get_guard('deepseek').call(live.create, stream=True, **_request('b'))]
+
+    use_cassette(Cassette(path, REPLAY))
+    offline = FailingCompletions()
+    replayed = get_guard('deepseek').call(offline.create, **_request('a' * 5000))
+    replayed_chunks = [c.choices[0].delta.content for c in get_guard('deepseek').call(offline.create, stream=True, **_request('b'))]
+
+    assert replayed.choices[0].message.content == recorded.choices[0].message.content
+    assert replayed.usage.prompt_tokens == 10
+    assert replayed_chunks == chunks
+
+    with pytest.raises(CassetteMissError):
+        get_guard('deepseek').call(offline.create, **_request('never recorded'))
+
+
+def test_errors_and_retries_are_replayed_in_order(tmp_path, monkeypatch):
+    monkeypatch.setattr('resilience.time.sleep', lambda seconds: None)
+    path = str(tmp_path / 'run.jsonl.gz')
+
+    use_cassette(Cassette(path, RECORD))
+    get_guard('deepseek').call(FakeCompletions(fail_first=True).create, **_request('x'))
+
+    use_cassette(Cassette(path, REPLAY))
+    cassette = Cassette(path, REPLAY)
+    with pytest.raises(ReplayedError) as e:
+        cassette.call('deepseek', FailingCompletions().create, **_request('x'))
+    assert e.value.status_code == 503
+
+    # 经过保护层时，录制的失败触发重试，第二次得到录制的成功响应
+    result = get_guard('deepseek').call(FailingCompletions().create, **_request('x'))
+    assert 'constitution' in result.choices[0].message.content
+
+
+def test_cassette_is_compact(tmp_path):
+    path = tmp_path / 'run.jsonl.gz'
+    use_cassette(Cassette(str(path), RECORD))
+    get_guard('deepseek').call(FakeCompletions().create, **_request('i' * 200_000))
+    assert path.stat().st_size < 2000
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+测试本地体质分类器（规则引擎快速通道）
+"""
+
+import time
+
+import pytest
+
+from constitution_classifier import EVIDENCE, ConstitutionClassifier
+from tcm_knowledge import CONSTITUTIONS
+
+
+def _features(color='淡红舌', thickness='薄白苔', coating='白苔', shape='舌形正常', complexity=50.0):
+    return {
+        'tongue_color': {'type': color, 'saturation': 100.0, 'description': ''},
+        'coating': {'thickness': thickness, 'color': coating, 'description': f'{coating}，{thickness}'},
+        'shape': {'type': shape, 'description': shape},
+        'texture': {'complexity': complexity, 'has_teeth_marks': complexity > 200, 'features': []}
+    }
+
+
+def test_evidence_covers_all_constitutions():
+    assert set(EVIDENCE) == set(CONSTITUTIONS)
+
+
+@pytest.mark.parametrize('features, expected', [
+    (_features(), '平和质'),
+    (_features(color='淡白舌', shape='舌体圆润', complexity=250), '气虚质'),
+    (_features(color='红舌', shape='舌体瘦长', coating='黄苔'), '阴虚质'),
+    (_features(color='红舌', thickness='厚苔', coating='黄苔'), '湿热质'),
+    (_features(color='紫舌'), '血瘀质'),
+])
+def test_typical_tongues(features, expected):
+    result = ConstitutionClassifier(temperature=1.0).classify(features)
+    assert result['primary'] == expected
+    assert abs(sum(result['probabilities'].values()) - 1) < 1e-9
+
+
+def test_temperature_softens_confidence():
+    sharp = ConstitutionClassifier(temperature=1.0).classify(_features())
+    soft = ConstitutionClassifier(temperature=3.0).classify(_features())
+    assert soft['primary'] == sharp['primary']
+    assert soft['confidence'] < sharp['confidence']
+
+
+def test_temperature_from_environment(monkeypatch):
+    monkeypatch.setenv('CLASSIFIER_TEMPERATURE', '2.5')
+    assert ConstitutionClassifier().temperature == 2.5
+    assert ConstitutionClassifier(temperature=1.5).temperature == 1.5
+    with pytest.raises(ValueError):
+        ConstitutionClassifier(temperature=0)
+
+
+def test_analyze_image_offline(tmp_path):
+    cv2 = pytest.importorskip('cv2')
+    np = pytest.importorskip('numpy')
+
+    image = np.full((3000, 4000, 3), 40, np.uint8)
+    cv2.ellipse(image, (2000, 1500), (900, 1200), 0, 0, 360, (150, 130, 210), -1)
+    image_path = str(tmp_path / 'tongue.jpg')
+    cv2.imwrite(image_path, image)
+
+    classifier = ConstitutionClassifier()
+    classifier.analyze(image_path)  # 预热
+    start = time.perf_counter()
+    report = classifier.analyze(image_path)
+
+    assert (time.perf_counter() - start) < 0.2
+    assert report['provider'] == '规则引擎'
+    assert report['constitution']['primary'].endswith('体质')
+    assert report['advice']['diet']
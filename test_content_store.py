@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+测试内容寻址存储：分片路径、去重、保留期清理
+"""
+
+import hashlib
+import os
+import time
+
+from content_store import ContentStore
+
+
+def test_objects_are_sharded_by_hash(tmp_path):
+    store = ContentStore(str(tmp_path), retention_days=30)
+    path, digest, created = store.put(b'tongue', 'jpg')
+
+    assert digest == hashlib.sha256(b'tongue').hexdigest()
+    assert path == os.path.join(str(tmp_path), digest[:2], digest[2:4], f"{digest}.jpg")
+    assert created
+    with open(path, 'rb') as f:
+        assert f.read() == b'tongue'
+    assert not [name for name in os.listdir(os.path.dirname(path)) if name.endswith('.tmp')]
+
+
+def test_duplicate_upload_is_stored_once_and_refreshed(tmp_path):
+    store = ContentStore(str(tmp_path), retention_days=30)
+    path, _, _ = store.put(b'tongue', 'jpg')
+    os.utime(path, (time.time() - 3600, time.time() - 3600))
+
+    again, _, created = store.put(b'tongue', 'jpg')
+
+    assert again == path and not created
+    assert time.time() - os.path.getmtime(path) < 60
+
+
+def test_sweep_removes_expired_objects_and_empty_shards(tmp_path):
+    store = ContentStore(str(tmp_path), retention_days=1)
+    old, _, _ = store.put(b'old', 'jpg')
+    fresh, _, _ = store.put(b'fresh', 'png')
+    os.utime(old, (time.time() - 2 * 86400, time.time() - 2 * 86400))
+    legacy = tmp_path / 'tongue_20251210_153223.jpg'
+    legacy.write_bytes(b'legacy')
+
+    stats = store.sweep()
+
+    assert stats['removed'] == 1 and stats['freed_bytes'] == 3
+    assert not os.path.exists(old) and not os.path.exists(os.path.dirname(os.path.dirname(old)))
+    assert os.path.exists(fresh)
+    assert legacy.exists()
+
+
+def test_zero_retention_keeps_objects_but_clears_stale_temp_files(tmp_path):
+    store = ContentStore(str(tmp_path), retention_days=0)
+    path, _, _ = store.put(b'keep', 'jpg')
+    os.utime(path, (0, 0))
+    tmp = f"{path}.123.456.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(b'partial')
+    os.utime(tmp, (time.time() - 7200, time.time() - 7200))
+
+    store.sweep()
+
+    assert os.path.exists(path)
+    assert not os.path.exists(tmp)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+测试请求时限预算：逐级传递、SDK超时、预算不足时降级
+"""
+
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from analyzer import TongueAnalyzer
+from deadline import Deadline, DeadlineExceeded, check_stage, deadline_scope, request_timeout
+from resilience import CircuitBreaker, ProviderGuard, TokenBucket
+
+
+class StubDeepSeek:
+    """记录每次调用 timeout 参数的 chat.completions 桩客户端"""
+
+    def __init__(self):
+        self.timeouts = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, timeout=None, **request):
+        self.timeouts.append(timeout)
+        content = json.dumps({'constitution': {'primary': '湿热质'}}, ensure_ascii=False)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+@pytest.fixture
+def analyzer(monkeypatch):
+    stub = StubDeepSeek()
+    monkeypatch.setattr(TongueAnalyzer, '_create_client', lambda self, provider, api_key: stub)
+    analyzer = TongueAnalyzer(api_key='test-key', provider='deepseek', hedge_providers=[], tiered=False)
+    return analyzer, stub
+
+
+def test_nested_scope_keeps_earlier_deadline():
+    with deadline_scope(Deadline(1)) as outer:
+        with deadline_scope(Deadline(60)) as inner:
+            assert inner is outer
+            assert request_timeout(30) <= 1
+    assert request_timeout(30) == 30
+
+
+def test_expired_deadline_raises_and_records_stages():
+    deadline = Deadline(0.05)
+    with deadline_scope(deadline):
+        check_stage('decode')
+        time.sleep(0.06)
+        with pytest.raises(DeadlineExceeded):
+            check_stage('provider')
+    assert [stage for stage, _ in deadline.stages] == ['decode', 'provider']
+
+
+def test_provider_call_gets_remaining_budget(tmp_path, analyzer):
+    cv2 = pytest.importorskip('cv2')
+    np = pytest.importorskip('numpy')
+    analyzer, stub = analyzer
+    image = np.full((600, 800, 3), 40, np.uint8)
+    cv2.ellipse(image, (400, 300), (350, 280), 0, 0, 360, (170, 160, 230), -1)
+    path = str(tmp_path / 'tongue.jpg')
+    cv2.imwrite(path, image)
+
+    with deadline_scope(Deadline(8)) as deadline:
+        result = analyzer.analyze_image(path)
+
+    assert result['provider'] == 'deepseek'
+    assert 0 < stub.timeouts[0] <= 8
+    assert [stage for stage, _ in deadline.stages] == ['decode', 'extract_features', 'provider']
+
+
+def test_nearly_exhausted_budget_degrades_to_local(analyzer):
+    analyzer, stub = analyzer
+
+    with deadline_scope(Deadline(0.5)):
+        result = analyzer.analyze_image('demo_damp_heat.jpg')
+
+    assert stub.timeouts == []
+    assert result['degraded'] is True
+    assert result['provider'] == '规则引擎'
+
+
+def test_guard_does_not_retry_past_deadline():
+    calls = []
+
+    def flaky(timeout=None):
+        calls.append(timeout)
+        raise TimeoutError('upstream timeout')
+
+    guard = ProviderGuard('test', TokenBucket(100, 100), CircuitBreaker(), max_attempts=5, base_delay=10, max_delay=10)
+    guard._backoff = lambda attempt: 10
+
+    with deadline_scope(Deadline(1)):
+        with pytest.raises(TimeoutError):
+            guard.call(flaky, timeout=request_timeout(60))
+
+    assert len(calls) == 1
+    assert calls[0] <= 1
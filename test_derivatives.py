@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+测试派生图片：存档版本去除 EXIF，缩略图为 WebP，模型输入按长边缩小，缺失时按需生成
+"""
+
+import base64
+import hashlib
+import os
+import struct
+
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+from content_store import ContentStore
+from derivatives import DerivativeStore, model_input_path, store_for
+from image_utils import strip_metadata
+
+
+def _exif_segment(orientation: int) -> bytes:
+    """只含方向标签的 APP1 段（大端 TIFF）"""
+    ifd = struct.pack('>H', 1) + struct.pack('>HHI', 0x0112, 3, 1) + struct.pack('>H', orientation) + b'\0\0'
+    tiff = b'MM' + struct.pack('>HI', 42, 8) + ifd + struct.pack('>I', 0)
+    payload = b'Exif\0\0' + tiff
+    return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+
+@pytest.fixture
+def jpeg():
+    image = np.full((1500, 2000, 3), 40, np.uint8)
+    cv2.ellipse(image, (1000, 750), (700, 600), 0, 0, 360, (170, 160, 230), -1)
+    ok, encoded = cv2.imencode('.jpg', image)
+    return encoded.tobytes()
+
+
+def _save(tmp_path, content):
+    path, _, _ = ContentStore(str(tmp_path)).put(content, 'jpg')
+    return path
+
+
+def test_strip_metadata_removes_exif(jpeg):
+    tagged = jpeg[:2] + _exif_segment(1) + jpeg[2:]
+    stripped, orientation = strip_metadata(tagged, 'jpg')
+    assert orientation == 1
+    assert b'Exif' not in stripped
+    assert stripped == jpeg
+
+
+def _webp_with_metadata(orientation: int) -> bytes:
+    """扩展格式（VP8X）的 WebP，带 EXIF 和 XMP 块"""
+    ok, encoded = cv2.imencode('.webp', np.full((48, 64, 3), 120, np.uint8))
+    image = encoded.tobytes()[12:]  # VP8/VP8L 块
+    exif = _exif_segment(orientation)[4:]  # Exif\0\0 + TIFF
+    xmp = b'<x:xmpmeta><exif:GPSLatitude>31,14N</exif:GPSLatitude></x:xmpmeta>'
+
+    def chunk(kind, payload):
+        return kind + struct.pack('<I', len(payload)) + payload + b'\0' * (len(payload) & 1)
+
+    vp8x = bytes([0x0C, 0, 0, 0]) + (63).to_bytes(3, 'little') + (47).to_bytes(3, 'little')
+    body = b'WEBP' + chunk(b'VP8X', vp8x) + image + chunk(b'EXIF', exif) + chunk(b'XMP ', xmp)
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def test_webp_archive_has_no_exif_or_xmp(tmp_path):
+    tagged = _webp_with_metadata(1)
+    stripped, orientation = strip_metadata(tagged, 'webp')
+    assert orientation == 1
+    assert b'EXIF' not in stripped and b'XMP ' not in stripped and b'GPS' not in stripped
+    assert stripped[8:12] == b'WEBP' and struct.unpack('<I', stripped[4:8])[0] == len(stripped) - 8
+    assert stripped[20] & 0x0C == 0  # VP8X 中的 EXIF/XMP 标志已清除
+    assert cv2.imdecode(np.frombuffer(stripped, np.uint8), cv2.IMREAD_COLOR).shape[:2] == (48, 64)
+
+    path, _, _ = ContentStore(str(tmp_path)).put(tagged, 'webp')
+    with open(store_for(path).ensure(path, 'archive'), 'rb') as f:
+        assert f.read() == stripped
+
+
+def test_gif_comments_and_xmp_are_removed():
+    gif = (b'GIF89a' + struct.pack('<HH', 1, 1) + bytes([0x80, 0, 0]) + b'\0\0\0\xff\xff\xff'
+           + b'\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00'
+           + b'\x21\xff\x0bXMP DataXMP\x05GPS!!\x00'
+           + b'\x21\xfe\x07comment\x00'
+           + b'\x2c' + struct.pack('<HHHH', 0, 0, 1, 1) + b'\x00\x02\x02\x44\x01\x00'
+           + b'\x3b')
+    stripped, orientation = strip_metadata(gif, 'gif')
+    assert orientation == 1
+    assert b'NETSCAPE2.0' in stripped
+    assert b'XMP' not in stripped and b'comment' not in stripped
+    assert stripped.endswith(b'\x2c' + struct.pack('<HHHH', 0, 0, 1, 1) + b'\x00\x02\x02\x44\x01\x00\x3b')
+
+
+def test_rotated_archive_is_reencoded_upright(tmp_path, jpeg):
+    source = _save(tmp_path, jpeg[:2] + _exif_segment(6) + jpeg[2:])
+    archive = store_for(source).ensure(source, 'archive')
+    with open(archive, 'rb') as f:
+        content = f.read()
+    assert b'Exif' not in content
+    # 方向 6：顺时针旋转 90°，宽高互换
+    assert cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_COLOR).shape[:2] == (2000, 1500)
+
+
+def test_thumbnail_and_model_sizes(tmp_path, jpeg, monkeypatch):
+    monkeypatch.setenv('DERIVATIVE_MODEL_SIDE', '800')
+    source = _save(tmp_path, jpeg)
+    store = store_for(source)
+
+    thumbnail = store.ensure(source, 'thumbnail')
+    assert thumbnail.endswith('_thumbnail.webp')
+    assert max(cv2.imread(thumbnail).shape[:2]) == 256
+
+    model = model_input_path(source)
+    assert model.endswith('_model.jpg')
+    assert max(cv2.imread(model).shape[:2]) == 800
+
+
+def test_generated_lazily_and_cached_by_content_hash(tmp_path, jpeg):
+    source = _save(tmp_path, jpeg)
+    digest = hashlib.sha256(jpeg).hexdigest()
+    store = store_for(source)
+    path = store.path_for(digest, 'model', 'jpg')
+
+    assert path.startswith(str(tmp_path / 'derivatives'))
+    assert not os.path.exists(path)
+    assert store.ensure(source, 'model') == path
+    mtime = os.stat(path).st_mtime_ns
+    assert store.ensure(source, 'model') == path
+    assert os.stat(path).st_mtime_ns == mtime
+
+
+def test_background_generation(tmp_path, jpeg):
+    source = _save(tmp_path, jpeg)
+    store = DerivativeStore(str(tmp_path / 'derivatives'), workers=1)
+    store.submit(source)
+    store.shutdown()
+    digest = hashlib.sha256(jpeg).hexdigest()
+    for kind in ('thumbnail', 'model', 'archive'):
+        assert os.path.exists(store.path_for(digest, kind, 'jpg'))
+
+
+def test_unaddressed_path_uses_original(tmp_path, jpeg):
+    path = tmp_path / 'tongue.jpg'
+    path.write_bytes(jpeg)
+    assert model_input_path(str(path)) == str(path)
+
+
+def test_claude_request_sends_model_input(tmp_path):
+    from professional_analyzer import ProfessionalTongueAnalyzer
+
+    image = np.full((1500, 2000, 3), 40, np.uint8)
+    ok, png = cv2.imencode('.png', image)
+    path, _, _ = ContentStore(str(tmp_path)).put(png.tobytes(), 'png')
+
+    request = ProfessionalTongueAnalyzer.__new__(ProfessionalTongueAnalyzer)._build_claude_request(path)
+    source = request['messages'][0]['content'][0]['source']
+
+    assert source['media_type'] == 'image/jpeg'
+    with open(model_input_path(path), 'rb') as f:
+        assert base64.b64decode(source['data']) == f.read()
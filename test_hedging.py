@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+测试跨提供商对冲请求（本地桩提供商 + 注入延迟）
+"""
+
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from analyzer import TongueAnalyzer
+from hedging import HedgedExecutor, HedgeError, LatencyTracker
+
+
+def _tracker(initial_delay=0.05):
+    return LatencyTracker(initial_delay=initial_delay, min_delay=0.01, min_samples=3)
+
+
+def _sleeping(result, delay, cancelled=None):
+    """桩提供商：等待 delay 秒（可被取消）后返回 result"""
+    def attempt(cancel):
+        if cancel.wait(delay):
+            if cancelled is not None:
+                cancelled.set()
+            raise RuntimeError('cancelled')
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return attempt
+
+
+def test_fast_primary_is_not_hedged():
+    """主提供商在时限内返回时不补发请求"""
+    executor = HedgedExecutor(_tracker(initial_delay=0.5))
+    calls = []
+
+    def backup(cancel):
+        calls.append('backup')
+        return {'constitution': 'backup'}
+
+    provider, result = executor.run([
+        ('primary', _sleeping({'constitution': 'primary'}, 0.01)),
+        ('backup', backup),
+    ])
+
+    assert provider == 'primary'
+    assert calls == []
+    assert executor.metrics.snapshot()['hedged'] == 0
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    """主提供商超时后补发，先返回者胜出，慢的一方被取消"""
+    executor = HedgedExecutor(_tracker(initial_delay=0.05))
+    cancelled = threading.Event()
+
+    start = time.monotonic()
+    provider, result = executor.run([
+        ('primary', _sleeping({'constitution': 'primary'}, 2.0, cancelled)),
+        ('backup', _sleeping({'constitution': 'backup'}, 0.02)),
+    ])
+    elapsed = time.monotonic() - start
+
+    assert provider == 'backup'
+    assert result == {'constitution': 'backup'}
+    assert elapsed < 1.0
+    assert cancelled.wait(1.0)
+
+    stats = executor.metrics.snapshot()
+    assert stats['hedged'] == 1
+    assert stats['hedge_wins'] == 1
+    assert stats['hedge_rate'] == 1.0
+
+
+def test_invalid_primary_fails_over_immediately():
+    """主提供商返回不合法结果时立即尝试下一个"""
+    executor = HedgedExecutor(_tracker(initial_delay=5.0))
+
+    start = time.monotonic()
+    provider, _ = executor.run(
+        [
+            ('primary', _sleeping({'raw_response': '...'}, 0.01)),
+            ('backup', _sleeping({'constitution': 'ok'}, 0.01)),
+        ],
+        validate=lambda result: 'constitution' in result
+    )
+
+    assert provider == 'backup'
+    assert time.monotonic() - start < 1.0
+
+
+def test_all_providers_fail():
+    """全部失败时抛出 HedgeError"""
+    executor = HedgedExecutor(_tracker())
+    with pytest.raises(HedgeError):
+        executor.run([
+            ('primary', _sleeping(RuntimeError('down'), 0.01)),
+            ('backup', _sleeping(RuntimeError('down'), 0.01)),
+        ])
+    assert executor.metrics.snapshot()['failures'] == 1
+
+
+def test_deadline_adapts_to_observed_latency():
+    """时限随观测到的耗时分位数变化"""
+    tracker = LatencyTracker(percentile=0.9, min_samples=3, initial_delay=3.0, min_delay=0.01)
+    assert tracker.deadline('deepseek') == 3.0
+    for seconds in (0.1, 0.2, 0.3, 0.4, 0.5):
+        tracker.record('deepseek', seconds)
+    assert tracker.deadline('deepseek') == 0.5
+
+
+class StubChatClient:
+    """兼容 chat.completions 流式接口的本地桩客户端"""
+
+    def __init__(self, report, delay, chunk_size=16):
+        self.report = report
+        self.delay = delay
+        self.chunk_size = chunk_size
+        self.closed = threading.Event()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, stream=False, **request):
+        text = json.dumps(self.report, ensure_ascii=False)
+        return StubStream(text, self.delay, self.chunk_size, self.closed)
+
+
+class StubStream:
+    def __init__(self, text, delay, chunk_size, closed):
+        self.text = text
+        self.delay = delay
+        self.chunk_size = chunk_size
+        self.closed = closed
+
+    def __iter__(self):
+        chunks = range(0, len(self.text), self.chunk_size)
+        per_chunk = self.delay / max(1, len(chunks))
+        for i in chunks:
+            time.sleep(per_chunk)
+            delta = SimpleNamespace(content=self.text[i:i + self.chunk_size])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+    def close(self):
+        self.closed.set()
+
+
+def test_analyzer_hedges_to_faster_provider(tmp_path, monkeypatch):
+    """TongueAnalyzer 在主提供商变慢时由备选提供商返回结果"""
+    cv2 = pytest.importorskip('cv2')
+    np = pytest.importorskip('numpy')
+
+    image_path = str(tmp_path / 'tongue.jpg')
+    cv2.imwrite(image_path, np.full((64, 64, 3), (120, 110, 190), np.uint8))
+
+    slow = StubChatClient({'constitution': {'primary': '气虚质'}}, delay=2.0)
+    fast = StubChatClient({'constitution': {'primary': '平和质'}}, delay=0.05)
+    stubs = {'zhipu': slow, 'deepseek': fast}
+    monkeypatch.setattr(TongueAnalyzer, '_create_client', lambda self, provider, api_key: stubs[provider])
+    monkeypatch.setenv('AI_API_KEY', 'test-key')
+
+    analyzer = TongueAnalyzer(api_key='test-key', provider='zhipu', hedge_providers=['deepseek'])
+    analyzer.hedger = HedgedExecutor(_tracker(initial_delay=0.1))
+
+    result = analyzer.analyze_image(image_path)
+
+    assert result['constitution']['primary'] == '平和质'
+    assert result['provider'] == 'deepseek'
+    assert slow.closed.wait(2.0)
+    assert analyzer.hedge_stats()['hedge_wins'] == 1
+
+
+def test_latency_saved_uses_primary_latency_estimate():
+    """节省的时间按主提供商的 P95 耗时估计，而不是被取消的请求退出的时刻"""
+    tracker = LatencyTracker(percentile=0.5, min_samples=3, min_delay=0.01)
+    for seconds in (0.05, 0.05, 0.05, 2.0, 2.0):
+        tracker.record('primary', seconds)
+    executor = HedgedExecutor(tracker)
+
+    provider, _ = executor.run([
+        ('primary', _sleeping({'constitution': 'primary'}, 2.0)),
+        ('backup', _sleeping({'constitution': 'backup'}, 0.02)),
+    ])
+
+    assert provider == 'backup'
+    saved = executor.metrics.snapshot()['latency_saved_seconds']
+    assert 1.5 < saved < 2.0
+
+
+def test_hedged_primary_latency_is_recorded():
+    """被对冲取消的慢请求也计入耗时样本，时限不会只按胜出的快请求收缩"""
+    tracker = _tracker(initial_delay=0.05)
+    executor = HedgedExecutor(tracker)
+
+    executor.run([
+        ('primary', _sleeping({'constitution': 'primary'}, 2.0)),
+        ('backup', _sleeping({'constitution': 'backup'}, 0.05)),
+    ])
+
+    [primary] = tracker._samples['primary']
+    assert primary >= 0.05  # 至少到对冲时限
+    assert len(tracker._samples['backup']) == 1
+
+
+def test_pool_queueing_does_not_trigger_hedge():
+    """在线程池中排队的时间不计入提供商耗时"""
+    executor = HedgedExecutor(_tracker(initial_delay=0.1), max_workers=1)
+    busy = executor._pool.submit(time.sleep, 0.3)
+
+    provider, _ = executor.run([
+        ('primary', _sleeping({'constitution': 'primary'}, 0.01)),
+        ('backup', _sleeping({'constitution': 'backup'}, 0.01)),
+    ])
+
+    busy.result()
+    assert provider == 'primary'
+    assert executor.metrics.snapshot()['hedged'] == 0
+
+
+def test_feature_extraction_failure_leaves_vision_providers(tmp_path, monkeypatch):
+    """特征提取失败时 DeepSeek 退出对冲，直接看图的提供商照常分析"""
+    zhipu = StubChatClient({'constitution': {'primary': '气虚质'}}, delay=0.01)
+    deepseek = StubChatClient({'constitution': {'primary': '平和质'}}, delay=0.01)
+    stubs = {'zhipu': zhipu, 'deepseek': deepseek}
+    monkeypatch.setattr(TongueAnalyzer, '_create_client', lambda self, provider, api_key: stubs[provider])
+    monkeypatch.setattr(TongueAnalyzer, '_build_zhipu_request', lambda self, image_path: {'messages': []})
+    monkeypatch.setenv('AI_API_KEY', 'test-key')
+
+    def broken(image_path):
+        raise ValueError('无法解码图片')
+
+    analyzer = TongueAnalyzer(api_key='test-key', provider='zhipu', hedge_providers=['deepseek'], tiered=False)
+    analyzer.hedger = HedgedExecutor(_tracker(initial_delay=0.1))
+    monkeypatch.setattr(analyzer, '_feature_extractor', lambda: SimpleNamespace(extract_features=broken))
+
+    result = analyzer.analyze_image(str(tmp_path / 'tongue.jpg'))
+
+    assert result['provider'] == 'zhipu-ai'
+    assert result['constitution']['primary'] == '气虚质'
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+测试上传图片的缓存地址：响应只含URL，图片按内容哈希长期缓存，缩略图按需生成
+"""
+
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setitem(app_module.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def uploaded(tmp_path, client):
+    image = np.full((600, 800, 3), 40, np.uint8)
+    cv2.ellipse(image, (400, 300), (350, 280), 0, 0, 360, (170, 160, 230), -1)
+    path = str(tmp_path / 'source.jpg')
+    cv2.imwrite(path, image)
+
+    with open(path, 'rb') as f:
+        body = client.post('/api/analyze', data={'tongue_image': (f, 'tongue.jpg')}).get_json()
+    assert body['success']
+    return body['data']
+
+
+def test_response_links_image_instead_of_embedding(uploaded):
+    assert uploaded['image_url'].startswith('/api/images/')
+    assert uploaded['thumbnail_url'] == uploaded['image_url'] + '/thumbnail'
+    assert 'base64' not in str(uploaded)
+
+
+def test_image_is_immutable_and_conditional(client, uploaded):
+    response = client.get(uploaded['image_url'])
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert 'immutable' in response.headers['Cache-Control']
+    etag = response.headers['ETag']
+
+    revalidated = client.get(uploaded['image_url'], headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+
+
+def test_thumbnail_is_small_webp(client, uploaded):
+    response = client.get(uploaded['thumbnail_url'])
+    assert response.status_code == 200
+    assert response.mimetype == 'image/webp'
+    thumbnail = cv2.imdecode(np.frombuffer(response.data, np.uint8), cv2.IMREAD_COLOR)
+    assert max(thumbnail.shape[:2]) == 256
+    assert response.headers['ETag'] != client.get(uploaded['image_url']).headers['ETag']
+
+
+def test_unknown_names_are_rejected(client):
+    assert client.get('/api/images/..%2Fapp.py').status_code == 404
+    assert client.get(f"/api/images/{'0' * 64}.jpg").status_code == 404
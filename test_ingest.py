@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+测试流式上传：魔数校验、大小上限、像素预算、原始请求体上传
+"""
+
+import io
+import os
+import struct
+
+import pytest
+
+from content_store import ContentStore
+from ingest import UploadRejected, ingest_image
+
+
+class CountingStream(io.BytesIO):
+    """记录已读取字节数的流"""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.consumed = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.consumed += len(chunk)
+        return chunk
+
+
+def _png_header(width, height):
+    """只有文件头的PNG：尺寸可读，但无法解码"""
+    ihdr = struct.pack('>II', width, height) + b'\x08\x02\x00\x00\x00'
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + ihdr + b'\x00' * 4
+
+
+def test_non_image_is_rejected_after_first_chunk(tmp_path):
+    stream = CountingStream(b'<?php echo 1; ?>' + b'x' * (1 << 20))
+
+    with pytest.raises(UploadRejected) as error:
+        ingest_image(stream, ContentStore(str(tmp_path)))
+
+    assert error.value.status_code == 415
+    assert stream.consumed <= 32
+    assert not (tmp_path / 'incoming').exists()
+
+
+def test_oversized_body_is_rejected_and_not_stored(tmp_path):
+    stream = io.BytesIO(_png_header(10, 10) + b'\x00' * 10000)
+
+    with pytest.raises(UploadRejected) as error:
+        ingest_image(stream, ContentStore(str(tmp_path)), max_bytes=4096, chunk_size=1024)
+
+    assert error.value.status_code == 413
+    assert os.listdir(tmp_path / 'incoming') == []
+
+
+def test_pixel_budget_is_checked_from_header(tmp_path):
+    store = ContentStore(str(tmp_path))
+
+    with pytest.raises(UploadRejected) as error:
+        ingest_image(io.BytesIO(_png_header(100000, 100000)), store, max_pixels=40_000_000)
+    assert error.value.status_code == 413
+    assert '100000×100000' in str(error.value)
+
+    path, digest, created = ingest_image(io.BytesIO(_png_header(640, 480)), store, max_pixels=40_000_000)
+    assert created and path.endswith(f"{digest}.png")
+
+
+def test_api_accepts_raw_image_body(tmp_path, monkeypatch):
+    cv2 = pytest.importorskip('cv2')
+    np = pytest.importorskip('numpy')
+    import app as app_module
+
+    monkeypatch.setitem(app_module.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    client = app_module.app.test_client()
+
+    image = np.full((600, 800, 3), 40, np.uint8)
+    cv2.ellipse(image, (400, 300), (350, 280), 0, 0, 360, (170, 160, 230), -1)
+    content = cv2.imencode('.png', image)[1].tobytes()
+
+    # 扩展名与内容不符时以内容为准
+    response = client.post('/api/analyze', data=content, content_type='image/jpeg')
+    body = response.get_json()
+    assert body['success']
+    assert body['data']['image_url'].endswith('.png')
+
+    rejected = client.post('/api/analyze', data=b'not an image', content_type='application/octet-stream')
+    assert rejected.status_code == 415
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+测试任务队列：先进先出、跨连接只取一次、工作线程统计、SQLite 结果共享
+"""
+
+import threading
+import time
+
+import pytest
+
+from job_queue import DONE, FAILED, QUEUED, RUNNING, MemoryJobQueue, SQLiteJobQueue, WorkerPool
+from progressive import COMPLETE, PENDING_UPGRADE, SQLiteResultStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def job_queue(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryJobQueue()
+    return SQLiteJobQueue(str(tmp_path / 'jobs.sqlite3'))
+
+
+def test_jobs_are_taken_in_order(job_queue):
+    for i in range(3):
+        job_queue.put(f'job-{i}', {'n': i})
+    assert job_queue.depth() == 3
+
+    job = job_queue.take(timeout=0.1)
+    assert job.id == 'job-0' and job.payload == {'n': 0}
+    assert job_queue.info('job-0')['state'] == RUNNING
+    assert job_queue.depth() == 2
+
+    job_queue.finish('job-0', ok=True)
+    assert job_queue.info('job-0')['state'] == DONE
+    assert job_queue.info('job-1')['state'] == QUEUED
+
+
+def test_empty_queue_times_out(job_queue):
+    start = time.perf_counter()
+    assert job_queue.take(timeout=0.2) is None
+    assert time.perf_counter() - start >= 0.15
+
+
+def test_worker_pool_records_wait_and_run(job_queue):
+    done = threading.Event()
+    seen = []
+
+    def handler(job):
+        seen.append(job.id)
+        if len(seen) == 2:
+            done.set()
+        return job.payload['ok']
+
+    pool = WorkerPool(job_queue, handler, workers=1)
+    job_queue.put('ok', {'ok': True})
+    job_queue.put('bad', {'ok': False})
+    assert done.wait(5)
+    time.sleep(0.1)
+    pool.stop()
+
+    stats = pool.stats()
+    assert seen == ['ok', 'bad']
+    assert stats['done'] == 1 and stats['failed'] == 1 and stats['depth'] == 0
+    assert stats['wait']['count'] == 2 and stats['run']['count'] == 2
+    assert job_queue.info('bad')['state'] == FAILED
+
+
+def test_sqlite_job_is_claimed_once_across_connections(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    producer = SQLiteJobQueue(path)
+    consumers = [SQLiteJobQueue(path) for _ in range(4)]
+    for i in range(20):
+        producer.put(f'job-{i}', {})
+
+    claimed = []
+    lock = threading.Lock()
+
+    def drain(consumer):
+        while True:
+            job = consumer.take(timeout=0.05)
+            if job is None:
+                return
+            with lock:
+                claimed.append(job.id)
+
+    threads = [threading.Thread(target=drain, args=(c,)) for c in consumers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == sorted(f'job-{i}' for i in range(20))
+
+
+def test_sqlite_results_are_shared_between_stores(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    writer, reader = SQLiteResultStore(path), SQLiteResultStore(path, poll_interval=0.02)
+    result_id = writer.create({'a': 1}, PENDING_UPGRADE)
+
+    threading.Timer(0.1, writer.update, (result_id, {'a': 2}, COMPLETE)).start()
+    view = reader.wait(result_id, since=1, timeout=5)
+
+    assert view['status'] == COMPLETE and view['version'] == 2
+    assert view['diff'] == {'changed': {'a': 2}, 'removed': []}
+
+
+def test_sqlite_maintenance_prunes_finished_and_requeues_stale(tmp_path):
+    job_queue = SQLiteJobQueue(str(tmp_path / 'jobs.sqlite3'), stale_after=60, retention=60)
+    for job_id in ('old', 'recent', 'crashed'):
+        job_queue.put(job_id, {})
+    for _ in range(3):
+        job_queue.take(timeout=0.1)
+    job_queue.finish('old', ok=True)
+    job_queue.finish('recent', ok=False)
+    with job_queue._lock:
+        job_queue._conn.execute("UPDATE jobs SET finished_at = finished_at - 120 WHERE id = 'old'")
+        job_queue._conn.execute("UPDATE jobs SET started_at = started_at - 120 WHERE id = 'crashed'")
+
+    # 工作线程按维护间隔调用 maintain，不需要重启进程
+    seen = []
+    pool = WorkerPool(job_queue, lambda job: seen.append(job.id) or True, workers=1, maintenance_interval=0.05)
+    deadline = time.monotonic() + 5
+    while not seen and time.monotonic() < deadline:
+        time.sleep(0.05)
+    pool.stop()
+
+    assert job_queue.info('old') is None
+    assert job_queue.info('recent')['state'] == FAILED
+    assert seen == ['crashed']
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+测试AI响应JSON提取与修复
+"""
+
+import json
+
+import pytest
+
+from json_utils import JSONExtractionError, StreamingJSONParser, extract_json
+
+
+def test_extract_fenced_and_unfenced():
+    """围栏和无围栏输出都能提取"""
+    assert extract_json('好的：\n```json\n{"a": 1}\n```\n以上') == {'a': 1}
+    assert extract_json('结果如下 {"a": {"b": [1, 2]}} 请参考') == {'a': {'b': [1, 2]}}
+    assert extract_json('[{"day": 1}, {"day": 2}]') == [{'day': 1}, {'day': 2}]
+
+
+def test_skip_brace_in_preamble():
+    """说明文字里的花括号不会被当成结果，也不会返回内部子对象"""
+    assert extract_json('返回{体质}字段：{"a": {"b": 1}, "c": "x"}') == {'a': {'b': 1}, 'c': 'x'}
+
+
+def test_repair_trailing_commas():
+    """修复尾随逗号"""
+    assert extract_json('{"a": [1, 2,], "b": 1,}') == {'a': [1, 2], 'b': 1}
+
+
+def test_repair_smart_quotes_and_fullwidth_punctuation():
+    """结构位置的弯引号、全角标点被修复，字符串内容里的保持不变"""
+    result = extract_json('{“a”： “他”， "b": "说“好”，对"}')
+    assert result == {'a': '他', 'b': '说“好”，对'}
+
+
+def test_repair_truncated_tail():
+    """截断的结尾被补齐"""
+    assert extract_json('{"a": {"b": [1, 2') == {'a': {'b': [1, 2]}}
+    assert extract_json('{"summary": "健康状') == {'summary': '健康状'}
+    assert extract_json('{"a": 1, "b":') == {'a': 1, 'b': None}
+    assert extract_json('{"a": 1,') == {'a': 1}
+
+
+def test_extract_failure_raises():
+    """找不到JSON时抛出异常"""
+    with pytest.raises(JSONExtractionError):
+        extract_json('抱歉，我无法分析这张图片')
+
+
+def test_streaming_parser_emits_sections_in_order():
+    """流式解析按顶层字段依次产出"""
+    report = {
+        'tongue_body': {'color': '淡红', 'features': ['{括号}', '引号\\"']},
+        'health_score': 85,
+        'summary': '健康，继续保持',
+    }
+    text = '```json\n' + json.dumps(report, ensure_ascii=False, indent=2) + '\n```'
+
+    parser = StreamingJSONParser()
+    keys = []
+    for i in range(0, len(text), 5):
+        keys.extend(key for key, _ in parser.feed(text[i:i + 5]))
+
+    assert keys == ['tongue_body', 'health_score', 'summary']
+    assert parser.done
+    assert parser.sections == report
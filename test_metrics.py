@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+测试指标：Prometheus 文本格式、提供商调用和解析失败计数、/metrics 端点
+"""
+
+import pytest
+
+from metrics import JSON_PARSE, PROVIDER_ERRORS, Registry
+from resilience import CircuitBreaker, ProviderGuard, TokenBucket
+
+
+def test_exposition_format():
+    registry = Registry()
+    requests = registry.counter('demo_requests_total', '请求数', ('route',))
+    latency = registry.histogram('demo_seconds', '耗时', ('route',), buckets=(0.1, 1.0))
+    requests.inc(route='/a')
+    requests.inc(2, route='/a')
+    latency.observe(0.05, route='/a')
+    latency.observe(0.5, route='/a')
+    latency.observe(5, route='/a')
+    registry.register_collector(lambda: [('demo_depth', 'gauge', '深度', [({}, 3)])])
+
+    text = registry.expose()
+    assert '# TYPE demo_requests_total counter' in text
+    assert 'demo_requests_total{route="/a"} 3' in text
+    assert 'demo_seconds_bucket{route="/a",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{route="/a",le="1"} 2' in text
+    assert 'demo_seconds_bucket{route="/a",le="+Inf"} 3' in text
+    assert 'demo_seconds_count{route="/a"} 3' in text
+    assert 'demo_seconds_sum{route="/a"} 5.55' in text
+    assert 'demo_depth 3' in text
+
+
+def test_provider_errors_and_parse_failures_are_counted():
+    guard = ProviderGuard('metrics-test', TokenBucket(100, 100), CircuitBreaker(), max_attempts=1)
+
+    def failing(**kwargs):
+        raise ConnectionError('boom')
+
+    before = PROVIDER_ERRORS.value(provider='metrics-test', model='m1', error='ConnectionError')
+    with pytest.raises(ConnectionError):
+        guard.call(failing, model='m1')
+    assert PROVIDER_ERRORS.value(provider='metrics-test', model='m1', error='ConnectionError') == before + 1
+
+    from analyzer import TongueAnalyzer
+    failed = JSON_PARSE.value(result='failed')
+    TongueAnalyzer(api_key=None)._parse_json_response('不是JSON')
+    assert JSON_PARSE.value(result='failed') == failed + 1
+
+
+def test_metrics_endpoint(tmp_path, monkeypatch):
+    cv2 = pytest.importorskip('cv2')
+    np = pytest.importorskip('numpy')
+    import app as app_module
+
+    monkeypatch.setitem(app_module.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    client = app_module.app.test_client()
+
+    image = np.full((300, 400, 3), 40, np.uint8)
+    cv2.ellipse(image, (200, 150), (170, 130), 0, 0, 360, (170, 160, 230), -1)
+    path = str(tmp_path / 'source.jpg')
+    cv2.imwrite(path, image)
+    with open(path, 'rb') as f:
+        assert client.post('/api/analyze', data={'tongue_image': (f, 'tongue.jpg')}).status_code == 200
+    client.get('/api/demo-analyze/healthy')
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert 'tongue_http_request_duration_seconds_count{route="/api/analyze",method="POST",status="200"}' in text
+    assert 'route="/api/demo-analyze/<case_id>"' in text
+    assert 'tongue_extractor_stage_duration_seconds_bucket{stage="decode"' in text
+    assert 'tongue_job_queue_depth ' in text
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+测试演示接口的预生成响应：不调用分析器，支持 ETag 重新验证和 gzip 压缩
+"""
+
+import gzip
+import json
+
+import pytest
+
+
+@pytest.fixture
+def client(monkeypatch):
+    import app as app_module
+
+    app_module.init_services(sweep_uploads=False)
+
+    def fail(image_path):
+        raise AssertionError('演示接口不应调用分析器')
+
+    monkeypatch.setattr(app_module.analyzer, 'analyze_image', fail)
+    return app_module.app.test_client()
+
+
+def test_demo_report_is_precomputed_and_conditional(client):
+    response = client.get('/api/demo-analyze/qi_deficiency')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['success']
+    assert body['data']['constitution']['primary'] == '气虚体质'
+
+    etag = response.headers['ETag']
+    revalidated = client.get('/api/demo-analyze/qi_deficiency', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+
+    other = client.get('/api/demo-analyze/healthy')
+    assert other.headers['ETag'] != etag
+
+
+def test_demo_report_gzip(client):
+    plain = client.get('/api/demo-analyze/damp_heat')
+    compressed = client.get('/api/demo-analyze/damp_heat', headers={'Accept-Encoding': 'gzip, br'})
+
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert len(compressed.data) < len(plain.data)
+    assert json.loads(gzip.decompress(compressed.data)) == plain.get_json()
+    # 压缩和未压缩的表示 ETag 不同，但都能用于重新验证
+    assert compressed.headers['ETag'] != plain.headers['ETag']
+    assert client.get('/api/demo-analyze/damp_heat', headers={'If-None-Match': compressed.headers['ETag']}).status_code == 304
+
+
+def test_unknown_demo_case(client):
+    response = client.get('/api/demo-analyze/unknown')
+    assert response.status_code == 404
+    assert not response.get_json()['success']
+
+
+def test_demo_page_is_precomputed(client):
+    response = client.get('/demo')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/html'
+    assert '气虚星球' in response.get_data(as_text=True)
+    assert client.get('/', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
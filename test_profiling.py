@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+测试抽样剖析：抽中的请求写出调用栈和内存分配折叠栈，慢请求只保留调用栈，超出保留数时删除最早的
+"""
+
+import json
+import os
+import time
+import tracemalloc
+
+import pytest
+
+import profiling
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    blocks = []
+    while time.perf_counter() < end:
+        blocks.append(bytearray(4096))
+        time.sleep(0.0002)
+    return blocks
+
+
+def _profiles(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+
+
+def test_sampled_request_writes_flamegraph_files(tmp_path):
+    profiler = profiling.Profiler(str(tmp_path), rate=1, slow=0, interval=0.002)
+    profile = profiler.begin(path='/api/analyze', trace_id='abc')
+    blocks = _busy(0.1)
+    profiler.finish(profile, status=200)
+    profiler.flush()
+
+    [name] = _profiles(tmp_path)
+    with open(tmp_path / name, encoding='utf-8') as f:
+        metadata = json.load(f)
+    assert metadata['reason'] == 'sampled' and metadata['status'] == 200 and metadata['trace_id'] == 'abc'
+    assert metadata['samples'] > 5 and metadata['duration_ms'] >= 100
+    assert metadata['top_allocations'][0]['location'].endswith(f"test_profiling.py:{_busy.__code__.co_firstlineno + 4}")
+    assert not tracemalloc.is_tracing()
+
+    with open(tmp_path / metadata['files']['cpu'], encoding='utf-8') as f:
+        stacks = [line.rsplit(' ', 1) for line in f]
+    assert sum(int(count) for _, count in stacks) == metadata['samples']
+    assert any(stack.split(';')[-1].startswith('_busy (test_profiling.py') for stack, _ in stacks)
+
+    with open(tmp_path / metadata['files']['alloc'], encoding='utf-8') as f:
+        allocations = [line.rsplit(' ', 1) for line in f]
+    assert sum(int(size) for _, size in allocations) >= len(blocks) * 4096
+    del blocks
+
+
+def test_only_slow_requests_are_kept(tmp_path):
+    profiler = profiling.Profiler(str(tmp_path), rate=0, slow=0.05, interval=0.002, max_profiles=2)
+    fast = profiler.begin()
+    profiler.finish(fast)
+    for _ in range(3):
+        profile = profiler.begin()
+        _busy(0.06)
+        profiler.finish(profile)
+    profiler.flush()
+
+    names = _profiles(tmp_path)
+    assert len(names) == 2
+    with open(tmp_path / names[-1], encoding='utf-8') as f:
+        metadata = json.load(f)
+    assert metadata['reason'] == 'slow' and 'alloc' not in metadata['files']
+    assert len(os.listdir(tmp_path)) == 4
+
+
+def test_analyze_endpoint_is_profiled(tmp_path, monkeypatch):
+    import app as app_module
+
+    directory = tmp_path / 'profiles'
+    monkeypatch.setenv('PROFILE_SAMPLE_RATE', '1')
+    monkeypatch.setenv('PROFILE_DIR', str(directory))
+    monkeypatch.setitem(app_module.app.config, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    profiling.reset_profiler()
+    try:
+        image = np.full((600, 800, 3), 40, np.uint8)
+        cv2.ellipse(image, (400, 300), (350, 280), 0, 0, 360, (170, 160, 230), -1)
+        path = str(tmp_path / 'tongue.jpg')
+        cv2.imwrite(path, image)
+
+        client = app_module.app.test_client()
+        client.get('/api/queue/stats')
+        with open(path, 'rb') as f:
+            assert client.post('/api/analyze', data={'tongue_image': (f, 'tongue.jpg')}).status_code == 200
+        profiling.get_profiler().flush()
+    finally:
+        profiling.reset_profiler()
+
+    [name] = _profiles(directory)
+    with open(directory / name, encoding='utf-8') as f:
+        metadata = json.load(f)
+    assert metadata['endpoint'] == 'analyze_tongue' and metadata['status'] == 200
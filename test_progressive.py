@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+测试渐进式分析：本地报告立即返回，大模型结果以差异形式升级
+"""
+
+import threading
+import time
+
+import pytest
+
+from progressive import COMPLETE, FAILED, PENDING_UPGRADE, ProgressiveAnalyzer, ResultStore, diff_reports
+from singleflight import SingleFlight
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+
+class SlowAnalyzer:
+    """等待放行后返回固定结果的桩分析器"""
+
+    use_mock = False
+
+    def __init__(self, result=None, error=None):
+        self.result = result or {'constitution': {'primary': '气虚体质'}, 'provider': 'deepseek'}
+        self.error = error
+        self.release = threading.Event()
+
+    def analyze_image(self, image_path):
+        self.release.wait(5)
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def _progressive(analyzer, tmp_path):
+    return ProgressiveAnalyzer(analyzer, flight=SingleFlight(directory=str(tmp_path / 'flight')))
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    image = np.full((600, 800, 3), 40, np.uint8)
+    cv2.ellipse(image, (400, 300), (350, 280), 0, 0, 360, (170, 160, 230), -1)
+    path = str(tmp_path / 'tongue.jpg')
+    cv2.imwrite(path, image)
+    return path
+
+
+def test_diff_reports():
+    diff = diff_reports({'a': 1, 'b': 2, 'c': 3}, {'a': 1, 'b': 5, 'd': 4})
+    assert diff == {'changed': {'b': 5, 'd': 4}, 'removed': ['c']}
+
+
+def test_local_report_then_upgrade(image_path, tmp_path):
+    slow = SlowAnalyzer()
+    progressive = _progressive(slow, tmp_path)
+
+    start = time.perf_counter()
+    result_id, report, status = progressive.start(image_path)
+    assert time.perf_counter() - start < 0.5
+    assert status == PENDING_UPGRADE
+    assert report['provider'] == '规则引擎'
+
+    view = progressive.store.get(result_id, since=1)
+    assert view['version'] == 1 and view['diff'] is None
+
+    slow.release.set()
+    view = progressive.store.wait(result_id, since=1, timeout=5)
+    assert view['status'] == COMPLETE
+    assert view['version'] == 2
+    assert view['diff']['changed']['constitution'] == {'primary': '气虚体质'}
+    assert 'extracted_features' in view['diff']['removed']
+
+
+def test_failed_upgrade_keeps_local_report(image_path, tmp_path):
+    slow = SlowAnalyzer(error=RuntimeError('provider down'))
+    progressive = _progressive(slow, tmp_path)
+    result_id, _, _ = progressive.start(image_path)
+
+    slow.release.set()
+    view = progressive.store.wait(result_id, since=1, timeout=5)
+    assert view['status'] == FAILED
+    assert view['version'] == 1
+    assert 'provider down' in view['error']
+
+
+def test_store_evicts_oldest():
+    store = ResultStore(max_items=2)
+    first = store.create({'a': 1}, COMPLETE)
+    store.create({'a': 2}, COMPLETE)
+    store.create({'a': 3}, COMPLETE)
+    assert store.get(first) is None
+
+
+def test_api_returns_local_report_with_result_id(image_path, tmp_path, monkeypatch):
+    import app as app_module
+
+    slow = SlowAnalyzer()
+    monkeypatch.setattr(app_module, 'progressive', _progressive(slow, tmp_path))
+    monkeypatch.setitem(app_module.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    client = app_module.app.test_client()
+
+    with open(image_path, 'rb') as f:
+        response = client.post('/api/analyze', data={'tongue_image': (f, 'tongue.jpg')})
+    body = response.get_json()
+    assert body['success'] and body['status'] == PENDING_UPGRADE
+    assert body['data']['constitution']['primary']
+
+    assert body['job_id'] == body['result_id']
+
+    slow.release.set()
+    events = client.get(f"/api/jobs/{body['job_id']}/events?since=1").get_data(as_text=True)
+    assert 'event: upgrade' in events and 'event: done' in events
+
+    poll = client.get(f"/api/jobs/{body['job_id']}?since=2").get_json()
+    assert poll['status'] == COMPLETE and poll['diff'] is None
+    assert poll['job']['enqueued_at'] <= poll['job']['started_at']
+
+    # 工作线程写入结果后才标记任务结束
+    for _ in range(50):
+        stats = client.get('/api/queue/stats').get_json()['data']
+        if stats['done']:
+            break
+        time.sleep(0.01)
+    assert stats['done'] == 1 and stats['depth'] == 0
+
+
+def test_identical_uploads_share_one_upgrade(image_path, tmp_path):
+    slow = SlowAnalyzer()
+    calls = []
+    analyze = slow.analyze_image
+    slow.analyze_image = lambda path: calls.append(path) or analyze(path)
+    progressive = _progressive(slow, tmp_path)
+
+    first, _, _ = progressive.start(image_path)
+    second, _, _ = progressive.start(image_path)
+    time.sleep(0.1)
+    slow.release.set()
+
+    for result_id in (first, second):
+        view = progressive.store.wait(result_id, since=1, timeout=5)
+        assert view['status'] == COMPLETE
+        assert view['diff']['changed']['constitution'] == {'primary': '气虚体质'}
+    assert len(calls) == 1
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+测试提供商保护层：令牌桶、熔断器状态转换、重试次数和退避上限、流式调用的首块预读（使用假时钟）
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import resilience
+from resilience import (CircuitBreaker, CircuitOpenError, ProviderGuard, ProviderHTTPError, RateLimitedError,
+                        TokenBucket, _is_client_error, is_retryable)
+
+
+class FakeClock:
+    """替换 resilience.time：sleep 只推进时钟"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    perf_counter = monotonic
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(resilience, 'time', clock)
+    return clock
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class ResponseError(Exception):
+    """状态码在 response 上的SDK异常（如 openai.APIStatusError）"""
+
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.response = SimpleNamespace(status_code=status_code)
+
+
+class Provider:
+    """按顺序返回结果或抛出错误的桩调用"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def _guard(breaker=None, limiter=None, max_attempts=3):
+    return ProviderGuard(
+        'test', limiter or TokenBucket(100, 100), breaker or CircuitBreaker(2, 10),
+        max_attempts=max_attempts, base_delay=0.5, max_delay=8.0, max_wait=0
+    )
+
+
+def test_token_bucket_refills_over_time(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    assert bucket.acquire() and bucket.acquire()
+    assert not bucket.acquire()
+
+    assert bucket.acquire(max_wait=1)
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+    clock.advance(10)
+    assert bucket.acquire() and bucket.acquire()  # 补充不超过容量
+    assert not bucket.acquire(max_wait=0.1)
+
+
+def test_breaker_opens_probes_once_and_recovers(clock):
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=10)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+    clock.advance(10)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()  # 只放行一个探测请求
+
+    # 探测失败：重新打开并重新计时
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.advance(5)
+    assert not breaker.allow()
+    clock.advance(5)
+    assert breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_rate_limited_call_releases_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10)
+    breaker.record_failure()
+    clock.advance(10)
+    limiter = TokenBucket(rate=0.001, capacity=1)
+    limiter.acquire()
+    provider = Provider('ok')
+
+    with pytest.raises(RateLimitedError):
+        _guard(breaker, limiter).call(provider)
+    assert provider.calls == 0
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()  # 探测名额已归还
+
+
+def test_client_error_on_probe_does_not_close_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10)
+    breaker.record_failure()
+    clock.advance(10)
+    guard = _guard(breaker)
+
+    with pytest.raises(StatusError):
+        guard.call(Provider(StatusError(400)))
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert guard.call(Provider('ok')) == 'ok'
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_client_error_resets_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=10)
+    guard = _guard(breaker, max_attempts=1)
+    for error in (StatusError(503), StatusError(400), StatusError(503)):
+        with pytest.raises(StatusError):
+            guard.call(Provider(error))
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retryable_errors_are_retried_with_backoff(clock, monkeypatch):
+    monkeypatch.setattr(resilience.random, 'uniform', lambda low, high: high)
+    provider = Provider(StatusError(503), TimeoutError('slow'), 'ok')
+    assert _guard(CircuitBreaker(5, 10)).call(provider) == 'ok'
+    assert provider.calls == 3
+    assert clock.sleeps == [0.5, 1.0]
+
+    exhausted = Provider(StatusError(529))
+    with pytest.raises(StatusError):
+        _guard(CircuitBreaker(5, 10)).call(exhausted)
+    assert exhausted.calls == 3
+
+
+def test_non_retryable_errors_fail_immediately(clock):
+    for error in (StatusError(400), ValueError('bad json'), RateLimitedError('local')):
+        provider = Provider(error)
+        with pytest.raises(type(error)):
+            _guard().call(provider)
+        assert provider.calls == 1
+    assert clock.sleeps == []
+
+
+def test_open_breaker_rejects_without_calling(clock):
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10)
+    breaker.record_failure()
+    provider = Provider('ok')
+    with pytest.raises(CircuitOpenError):
+        _guard(breaker).call(provider)
+    assert provider.calls == 0
+
+
+@pytest.mark.parametrize('error, retryable, client_error', [
+    (StatusError(429), True, False),
+    (StatusError(503), True, False),
+    (StatusError(400), False, True),
+    (StatusError(401), False, True),
+    (ProviderHTTPError(408, 'timeout'), True, False),
+    (ResponseError(404), False, True),
+    (ResponseError(502), True, False),
+    (ConnectionError(), True, False),
+    (type('APIConnectionError', (Exception,), {})(), True, False),
+    (CircuitOpenError(), False, False),
+    (ValueError(), False, False),
+])
+def test_error_classification(error, retryable, client_error):
+    assert is_retryable(error) is retryable
+    assert _is_client_error(error) is client_error
+
+
+def test_backoff_is_bounded():
+    guard = _guard()
+    for attempt in range(1, 10):
+        ceiling = min(guard.max_delay, guard.base_delay * 2 ** (attempt - 1))
+        delays = [guard._backoff(attempt) for _ in range(200)]
+        assert all(0 <= delay <= ceiling for delay in delays)
+    assert max(guard._backoff(10) for _ in range(200)) <= 8.0
+
+
+class StubStream:
+    """chat.completions 流：迭代到第 fail_at 块时抛出错误"""
+
+    def __init__(self, chunks, fail_at=None, error=None):
+        self.chunks = chunks
+        self.fail_at = fail_at
+        self.error = error
+        self.closed = False
+
+    def __iter__(self):
+        for index, chunk in enumerate(self.chunks):
+            if index == self.fail_at:
+                raise self.error
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class StubManager:
+    """Anthropic messages.stream 返回的上下文管理器"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.exits = []
+
+    def __enter__(self):
+        return SimpleNamespace(text_stream=iter(self.stream))
+
+    def __exit__(self, *exc):
+        self.exits.append(exc[0])
+        return False
+
+
+def test_stream_error_before_first_chunk_is_retried(clock):
+    broken = StubStream(['a'], fail_at=0, error=StatusError(529))
+    provider = Provider(broken, StubStream(['a', 'b']))
+    breaker = CircuitBreaker(2, 10)
+
+    result = _guard(breaker).call(provider, stream=True)
+
+    assert provider.calls == 2 and broken.closed
+    assert list(result) == ['a', 'b']
+    assert breaker._failures == 0
+
+
+def test_stream_error_after_first_chunk_counts_against_breaker(clock):
+    stream = StubStream(['a', 'b'], fail_at=1, error=ConnectionError('reset'))
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10)
+    result = _guard(breaker).call(Provider(stream), stream=True)
+
+    chunks = iter(result)
+    assert next(chunks) == 'a'
+    with pytest.raises(ConnectionError):
+        next(chunks)
+    assert breaker.state == CircuitBreaker.OPEN
+    result.close()
+    assert stream.closed
+
+
+def test_message_stream_is_entered_inside_guard(clock):
+    broken = StubManager(StubStream(['x'], fail_at=0, error=ResponseError(529)))
+    healthy = StubManager(StubStream(['x', 'y']))
+    provider = Provider(broken, healthy)
+    provider.__name__ = 'stream'  # 按方法名识别 messages.stream
+
+    with _guard().call(provider, model='claude') as stream:
+        assert list(stream.text_stream) == ['x', 'y']
+
+    assert provider.calls == 2
+    assert broken.exits == [ResponseError] and healthy.exits == [None]
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+测试响应编码：UTF-8 紧凑序列化、按 Accept-Encoding 压缩、已结束结果的响应缓存
+"""
+
+import gzip
+import json
+
+import pytest
+
+from response_encoding import ResponseCache, dumps
+from tcm_knowledge import typical_report
+
+
+class _FinishedProgressive:
+    """只返回一份已完成结果的渐进式分析器替身"""
+
+    def __init__(self):
+        self.calls = 0
+
+    @property
+    def store(self):
+        return self
+
+    def get(self, result_id, since=0):
+        self.calls += 1
+        return {'status': 'complete', 'version': 2, 'diff': typical_report('气虚质'), 'error': None}
+
+    def job_info(self, result_id):
+        return {'state': 'done', 'enqueued_at': 1.0, 'started_at': 2.0, 'finished_at': 3.0}
+
+
+@pytest.fixture
+def client():
+    import app as app_module
+
+    app_module.init_services(sweep_uploads=False)
+    return app_module.app.test_client()
+
+
+def test_dumps_is_compact_utf8():
+    np = pytest.importorskip('numpy')
+    body = dumps({'名称': '平和质', 'score': np.float64(0.5), 'values': np.array([1, 2])})
+    assert '平和质'.encode('utf-8') in body
+    assert b' ' not in body
+    assert json.loads(body) == {'名称': '平和质', 'score': 0.5, 'values': [1, 2]}
+
+
+def test_small_response_is_not_compressed(client):
+    stats = client.get('/api/queue/stats', headers={'Accept-Encoding': 'gzip'})
+    # 队列统计只有几十字节，不值得压缩
+    assert 'Content-Encoding' not in stats.headers
+
+
+def test_dynamic_response_negotiates_gzip(client, monkeypatch):
+    monkeypatch.setenv('COMPRESS_MIN_BYTES', '16')
+    plain = client.get('/api/queue/stats')
+    compressed = client.get('/api/queue/stats', headers={'Accept-Encoding': 'gzip;q=1, br;q=0'})
+
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert json.loads(gzip.decompress(compressed.data))['success'] == plain.get_json()['success']
+    assert 'Content-Encoding' not in client.get('/api/queue/stats', headers={'Accept-Encoding': 'identity'}).headers
+
+
+def test_finished_result_served_from_cache(client, monkeypatch):
+    import app as app_module
+
+    fake = _FinishedProgressive()
+    monkeypatch.setattr(app_module, 'progressive', fake)
+    monkeypatch.setattr(app_module, '_finished_results', ResponseCache(8))
+
+    first = client.get('/api/jobs/abc?since=1')
+    assert first.get_json()['diff']['constitution']['primary'] == '气虚体质'
+    etag = first.headers['ETag']
+
+    again = client.get('/api/jobs/abc?since=1')
+    assert again.data == first.data
+    assert client.get('/api/jobs/abc?since=1', headers={'If-None-Match': etag}).status_code == 304
+    assert fake.calls == 1
+
+
+def test_response_cache_evicts_least_recent():
+    cache = ResponseCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
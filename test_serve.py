@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+测试预派生服务：多个 worker 处理请求，达到请求数阈值后优雅重启，SIGTERM 优雅停止，fork 失败不留下信号屏蔽
+"""
+
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'fork'), reason='需要 fork')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _get(url, timeout=5):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.status
+
+
+def _start(tmp_path, *args):
+    port = _free_port()
+    env = dict(os.environ, PYTHONUNBUFFERED='1', SINGLEFLIGHT_DIR=str(tmp_path / 'flight'),
+               JOB_QUEUE_PATH=str(tmp_path / 'jobs.sqlite3'))
+    for name in ('ZHIPU_API_KEY', 'GLM_API_KEY', 'DEEPSEEK_API_KEY', 'AI_API_KEY', 'JOB_QUEUE'):
+        env.pop(name, None)
+    process = subprocess.Popen(
+        # 在临时目录中运行：上传文件写入临时目录下的 uploads/
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'serve.py'),
+         '--host', '127.0.0.1', '--port', str(port), *args],
+        cwd=str(tmp_path), env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 20
+    while True:
+        try:
+            _get(f"{base}/api/demo-analyze/healthy")
+            return process, base
+        except OSError:
+            if time.monotonic() > deadline:
+                process.kill()
+                raise
+            time.sleep(0.1)
+
+
+def _stop(process):
+    process.send_signal(signal.SIGTERM)
+    output, _ = process.communicate(timeout=30)
+    return output
+
+
+def test_workers_recycle_and_stop_gracefully(tmp_path):
+    process, base = _start(tmp_path, '--workers', '2', '--max-requests', '3', '--max-requests-jitter', '0',
+                           '--graceful-timeout', '5')
+    try:
+        statuses = [_get(f"{base}/api/demo-analyze/healthy") for _ in range(12)]
+        assert statuses == [200] * 12
+    finally:
+        output = _stop(process)
+
+    assert process.returncode == 0
+    assert '已处理 3 个请求' in output
+    assert output.count('已启动') >= 4  # 初始的 2 个加上重启补充的
+
+
+def test_job_is_visible_from_other_workers(tmp_path):
+    cv2 = pytest.importorskip('cv2')
+    np = pytest.importorskip('numpy')
+    image = np.full((600, 800, 3), 40, np.uint8)
+    cv2.ellipse(image, (400, 300), (350, 280), 0, 0, 360, (170, 160, 230), -1)
+    jpeg = cv2.imencode('.jpg', image)[1].tobytes()
+
+    # 每个 worker 只处理一个请求：创建任务的 worker 随即退出，之后的查询都由其他 worker 处理
+    process, base = _start(tmp_path, '--workers', '2', '--max-requests', '1', '--max-requests-jitter', '0',
+                           '--graceful-timeout', '5')
+    try:
+        boundary = 'tongue-test'
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="tongue_image"; filename="t.jpg"\r\n'
+                f'Content-Type: image/jpeg\r\n\r\n').encode() + jpeg + f'\r\n--{boundary}--\r\n'.encode()
+        post = urllib.request.Request(f"{base}/api/analyze", data=body,
+                                      headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        with urllib.request.urlopen(post, timeout=10) as response:
+            job_id = json.load(response)['job_id']
+
+        statuses = [_get(f"{base}/api/jobs/{job_id}") for _ in range(5)]
+        assert statuses == [200] * 5
+    finally:
+        output = _stop(process)
+
+    assert 'JOB_QUEUE=sqlite' in output
+
+
+def test_fork_failure_unblocks_master_signals(monkeypatch):
+    import serve
+
+    def fail():
+        raise OSError('Resource temporarily unavailable')
+
+    monkeypatch.setattr(serve.os, 'fork', fail)
+    master = serve.Master(server=None, app_module=None, options=None)
+    with pytest.raises(OSError):
+        master.spawn(0)
+
+    assert not serve.MASTER_SIGNALS & signal.pthread_sigmask(signal.SIG_BLOCK, [])
+    assert master.workers == {}
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+测试请求合并：线程间和进程间共享同一次计算、等锁不超过请求时限、只清理无人持有的锁文件
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from deadline import Deadline, deadline_scope
+from singleflight import SingleFlight, fcntl
+
+
+def test_concurrent_threads_share_one_call():
+    flight = SingleFlight(cross_process=False)
+    calls = []
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return {'constitution': '平和质'}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do('abc', compute))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert all(result == {'constitution': '平和质'} for result, _ in results)
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+
+
+def test_errors_propagate_to_waiters():
+    flight = SingleFlight(cross_process=False)
+    release = threading.Event()
+    errors = []
+
+    def compute():
+        release.wait(5)
+        raise RuntimeError('provider down')
+
+    def call():
+        try:
+            flight.do('abc', compute)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join()
+    assert errors == ['provider down'] * 3
+
+
+def _worker(directory, counter_path, queue):
+    flight = SingleFlight(directory=directory)
+
+    def compute():
+        with open(counter_path, 'a') as f:
+            f.write('x')
+        time.sleep(0.5)
+        return {'pid': os.getpid()}
+
+    queue.put(flight.do('same-image', compute))
+
+
+@pytest.mark.skipif(fcntl is None, reason='需要 fcntl')
+def test_processes_share_one_call(tmp_path):
+    counter = tmp_path / 'calls'
+    counter.write_text('')
+    queue = multiprocessing.get_context('fork').Queue()
+    processes = [
+        multiprocessing.get_context('fork').Process(target=_worker, args=(str(tmp_path), str(counter), queue))
+        for _ in range(3)
+    ]
+    for p in processes:
+        p.start()
+    results = [queue.get(timeout=10) for _ in processes]
+    for p in processes:
+        p.join()
+
+    assert counter.read_text() == 'x'
+    assert len({result['pid'] for result, _ in results}) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True]
+
+
+@pytest.mark.skipif(fcntl is None, reason='需要 fcntl')
+def test_lock_wait_is_capped_by_request_deadline(tmp_path):
+    flight = SingleFlight(directory=str(tmp_path))
+    with open(tmp_path / 'abc.lock', 'a') as held:
+        fcntl.flock(held, fcntl.LOCK_EX)  # 另一个 worker 正在计算
+        start = time.monotonic()
+        with deadline_scope(Deadline(0.2)):
+            result, shared = flight.do('abc', lambda: {'pid': os.getpid()})
+
+    assert time.monotonic() - start < 2
+    assert result == {'pid': os.getpid()} and not shared
+
+
+@pytest.mark.skipif(fcntl is None, reason='需要 fcntl')
+def test_prune_keeps_held_lock_files(tmp_path):
+    flight = SingleFlight(directory=str(tmp_path))
+    old = time.time() - 2 * 86400
+    lock_path = tmp_path / 'abc.lock'
+
+    flight.do('abc', lambda: 1)
+    assert time.time() - lock_path.stat().st_mtime < 60  # 持锁时刷新 mtime
+
+    with open(lock_path, 'a') as held:
+        fcntl.flock(held, fcntl.LOCK_EX)
+        os.utime(lock_path, (old, old))
+        flight._prune()
+        assert lock_path.exists()
+
+    flight._prune()
+    assert not lock_path.exists()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+测试流式分析接口（SSE）：按字段顺序推送 section、最后推送 done 携带完整结果、
+出错时推送 error 事件、客户端断开时关闭提供商的HTTP流、
+大模型流中途失败时先推送 reset 再推送规则引擎报告
+"""
+
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import resilience
+from analyzer import TongueAnalyzer
+from free_analyzer import FreeTongueAnalyzer
+from resilience import reset_guards
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+REPORT = {
+    'tongue_body': {'color': '淡红'},
+    'constitution': {'primary': '平和质'},
+    'health_score': 88,
+    'summary': '整体良好'
+}
+
+
+class StubStream:
+    """智谱流式响应：按分片产出，可在第 fail_after 个分片后抛出错误"""
+
+    def __init__(self, text, chunk_size=12, fail_after=None):
+        self.pieces = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        self.fail_after = fail_after
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        for index, piece in enumerate(self.pieces):
+            if self.fail_after is not None and index >= self.fail_after:
+                raise ConnectionError('stream reset')
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+    def close(self):
+        self.closed.set()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    import app as app_module
+
+    reset_guards('zhipu')
+    monkeypatch.setitem(app_module.app.config, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    client = app_module.app.test_client()
+    client.get('/api/queue/stats')  # 创建服务
+
+    def use(stream):
+        analyzer = FreeTongueAnalyzer.__new__(FreeTongueAnalyzer)
+        analyzer.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(
+            create=lambda **request: stream
+        )))
+        monkeypatch.setattr(app_module, 'analyzer', analyzer)
+
+    image = np.full((600, 800, 3), 40, np.uint8)
+    cv2.ellipse(image, (400, 300), (350, 280), 0, 0, 360, (170, 160, 230), -1)
+    path = str(tmp_path / 'tongue.jpg')
+    cv2.imwrite(path, image)
+
+    def post(**kwargs):
+        with open(path, 'rb') as f:
+            return client.post('/api/analyze/stream', data={'tongue_image': (f, 'tongue.jpg')}, **kwargs)
+
+    yield use, post
+    reset_guards('zhipu')
+
+
+def _events(body):
+    events = []
+    for message in body.decode('utf-8').strip().split('\n\n'):
+        name, data = message.split('\n', 1)
+        events.append((name[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+def test_sections_arrive_in_order_then_done(client):
+    use, post = client
+    stream = StubStream(f"```json\n{json.dumps(REPORT, ensure_ascii=False)}\n```")
+    use(stream)
+
+    response = post()
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = _events(response.data)
+
+    assert [name for name, _ in events] == ['section'] * len(REPORT) + ['done']
+    assert [data['key'] for _, data in events[:-1]] == list(REPORT)
+    assert events[1][1]['value'] == {'primary': '平和质'}
+    result = events[-1][1]['result']
+    assert result['constitution'] == REPORT['constitution'] and result['provider'] == 'zhipu-ai'
+    assert result['thumbnail_url'].endswith('/thumbnail')
+    assert stream.closed.is_set()
+
+
+def test_provider_error_mid_stream_sends_error_event(client):
+    use, post = client
+    stream = StubStream(json.dumps(REPORT, ensure_ascii=False), chunk_size=8, fail_after=5)
+    use(stream)
+
+    events = _events(post().data)
+
+    assert events[-1] == ('error', {'error': 'stream reset'})
+    assert all(name == 'section' for name, _ in events[:-1])
+    assert stream.closed.is_set()
+
+
+def test_client_disconnect_closes_provider_stream(client):
+    use, post = client
+    stream = StubStream(json.dumps(REPORT, ensure_ascii=False), chunk_size=4)
+    use(stream)
+
+    response = post(buffered=False)
+    chunks = response.iter_encoded()
+    assert next(chunks).startswith(b'event: section')
+    response.close()
+
+    assert stream.closed.is_set()
+
+
+@pytest.fixture
+def stream_analyzer(tmp_path, monkeypatch):
+    reset_guards('zhipu')
+    monkeypatch.setattr(resilience.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(TongueAnalyzer, '_build_zhipu_request', lambda self, image_path: {'messages': []})
+    image = np.full((600, 800, 3), 40, np.uint8)
+    cv2.ellipse(image, (400, 300), (350, 280), 0, 0, 360, (170, 160, 230), -1)
+    path = str(tmp_path / 'tongue.jpg')
+    cv2.imwrite(path, image)
+
+    def analyze(stream):
+        client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **request: stream)))
+        monkeypatch.setattr(TongueAnalyzer, '_create_client', lambda self, provider, api_key: client)
+        analyzer = TongueAnalyzer(api_key='test-key', provider='zhipu', hedge_providers=[], tiered=False)
+        return list(analyzer.analyze_image_stream(path))
+
+    yield analyze
+    reset_guards('zhipu')
+
+
+def test_failure_after_sections_resets_before_fallback(stream_analyzer):
+    events = stream_analyzer(StubStream(json.dumps(REPORT, ensure_ascii=False), chunk_size=8, fail_after=5))
+
+    names = [event['event'] for event in events]
+    reset = names.index('reset')
+    assert reset > 0 and set(names[:reset]) == {'section'}
+    assert events[reset]['reason'] == 'stream reset'
+    fallback = events[reset + 1:]
+    assert fallback[-1]['event'] == 'done'
+    assert [event['key'] for event in fallback[:-1]] == list(fallback[-1]['result'])
+    assert fallback[-1]['result'].get('provider') != 'zhipu-ai'
+
+
+def test_failure_before_any_section_falls_back_without_reset(stream_analyzer):
+    events = stream_analyzer(StubStream(json.dumps(REPORT, ensure_ascii=False), fail_after=0))
+
+    assert 'reset' not in [event['event'] for event in events]
+    assert events[-1]['event'] == 'done'
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+测试压测用的桩大模型服务
+"""
+
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from json_utils import extract_json
+from stub_llm_server import StubConfig, make_server, parse_latency
+
+
+@pytest.fixture
+def stub():
+    config = StubConfig(latency=parse_latency('fixed:0.01'))
+    server = make_server('127.0.0.1', 0, config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server, config
+    server.shutdown()
+
+
+def _post(server, path, body):
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{server.server_port}{path}",
+        data=json.dumps(body).encode('utf-8'),
+        headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return response.read().decode('utf-8')
+
+
+def test_openai_completion_contains_report(stub):
+    server, _ = stub
+    body = json.loads(_post(server, '/chat/completions', {'model': 'deepseek-chat'}))
+    report = extract_json(body['choices'][0]['message']['content'])
+    assert 'constitution' in report
+
+
+def test_openai_stream_reassembles(stub):
+    server, _ = stub
+    text = ''
+    for line in _post(server, '/api/paas/v4/chat/completions', {'stream': True}).splitlines():
+        if line.startswith('data: ') and line != 'data: [DONE]':
+            text += json.loads(line[6:])['choices'][0]['delta'].get('content', '')
+    assert 'constitution' in extract_json(text)
+
+
+def test_anthropic_stream_reassembles(stub):
+    server, _ = stub
+    text = ''
+    for line in _post(server, '/v1/messages', {'stream': True}).splitlines():
+        if line.startswith('data: '):
+            event = json.loads(line[6:])
+            if event['type'] == 'content_block_delta':
+                text += event['delta']['text']
+    assert 'constitution' in extract_json(text)
+
+
+def test_injected_errors(stub):
+    server, config = stub
+    config.rate_limit_rate = 1.0
+    with pytest.raises(urllib.error.HTTPError) as e:
+        _post(server, '/v1/messages', {})
+    assert e.value.code == 429
+
+
+def test_latency_distributions():
+    assert parse_latency('fixed:1.5')() == 1.5
+    assert 0.5 <= parse_latency('uniform:0.5,1')() <= 1
+    assert parse_latency('lognormal:2,0.5')() > 0
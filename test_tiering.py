@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+测试分级分析：本地有把握时不调用大模型，异常图片升级
+"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from analyzer import TongueAnalyzer
+from tiering import TierPolicy, out_of_distribution
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+
+class StubDeepSeek:
+    """记录调用次数的 chat.completions 桩客户端"""
+
+    def __init__(self):
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **request):
+        self.calls += 1
+        content = json.dumps({'constitution': {'primary': '湿热质'}}, ensure_ascii=False)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+def _image(tmp_path, name, bgr):
+    image = np.full((600, 800, 3), 40, np.uint8)
+    cv2.ellipse(image, (400, 300), (350, 280), 0, 0, 360, bgr, -1)
+    path = str(tmp_path / name)
+    cv2.imwrite(path, image)
+    return path
+
+
+@pytest.fixture
+def tiered(monkeypatch):
+    stub = StubDeepSeek()
+    monkeypatch.setattr(TongueAnalyzer, '_create_client', lambda self, provider, api_key: stub)
+    analyzer = TongueAnalyzer(
+        api_key='test-key',
+        provider='deepseek',
+        hedge_providers=[],
+        tiered=True,
+        tier_policy=TierPolicy(min_confidence=0.6, min_margin=0.25)
+    )
+    return analyzer, stub
+
+
+def test_confident_image_stays_local(tmp_path, tiered):
+    analyzer, stub = tiered
+    result = analyzer.analyze_image(_image(tmp_path, 'pink.jpg', (170, 160, 230)))
+
+    assert result['tier'] == 'local'
+    assert result['constitution']['primary'] == '平和体质'
+    assert stub.calls == 0
+    assert analyzer.tier_stats()['tiers']['local']['count'] == 1
+
+
+def test_unusual_image_escalates(tmp_path, tiered):
+    analyzer, stub = tiered
+    path = _image(tmp_path, 'green.jpg', (60, 180, 60))
+
+    result = analyzer.analyze_image(path)
+
+    assert stub.calls == 1
+    assert result['tier'] == 'llm'
+    assert result['constitution']['primary'] == '湿热质'
+    assert '色调不像舌体' in result['escalation_reason']
+    stats = analyzer.tier_stats()
+    assert stats['local_rate'] == 0.0
+    assert stats['escalation_reasons'] == {'图片异常: 色调不像舌体': 1}
+
+
+def test_dark_image_is_out_of_distribution():
+    features = {
+        'tongue_color': {'hue': 5.0, 'saturation': 120.0, 'brightness': 30.0},
+        'shape': {'area_ratio': 0.3}
+    }
+    assert out_of_distribution(features) == ['画面过暗']
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+测试请求级追踪：嵌套区间、traceparent 延续、采样导出和 OTLP 编码
+"""
+
+import json
+
+import pytest
+
+import tracing
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+
+@pytest.fixture
+def trace_file(tmp_path, monkeypatch):
+    path = tmp_path / 'traces.jsonl'
+    monkeypatch.setenv('TRACE_EXPORTER', 'jsonl')
+    monkeypatch.setenv('TRACE_FILE', str(path))
+    monkeypatch.setenv('TRACE_SAMPLE_RATE', '1')
+    tracing.reset_exporter()
+    yield path
+    tracing.reset_exporter()
+
+
+def _exported(path):
+    tracing.get_exporter().flush()
+    return tracing.load_traces(str(path)) if path.exists() else []
+
+
+def test_spans_nest_and_sampling(trace_file, monkeypatch):
+    with tracing.trace_scope('job') as trace:
+        with tracing.span('outer', image_bytes=10) as outer:
+            with tracing.span('inner') as inner:
+                inner.set(completion_tokens=5)
+            stream = tracing.open_span('stream')
+            stream.finish()
+        parent = tracing.current_traceparent()
+
+    assert parent == f"00-{trace.trace_id}-{trace.root.span_id}-01"
+    exported = _exported(trace_file)[0]
+    spans = {item['name']: item for item in exported['spans']}
+    assert spans['outer']['parent_id'] == spans['job']['span_id']
+    assert spans['inner']['parent_id'] == outer.span_id
+    assert spans['inner']['attributes'] == {'completion_tokens': 5}
+    assert spans['stream']['parent_id'] == outer.span_id
+    assert tracing.current_span() is tracing._NOOP
+
+    # 未抽中的快速追踪不导出，出错的追踪总是导出
+    monkeypatch.setenv('TRACE_SAMPLE_RATE', '0')
+    with tracing.trace_scope('fast', parent):
+        pass
+    with pytest.raises(RuntimeError):
+        with tracing.trace_scope('broken'):
+            raise RuntimeError('boom')
+    names = [(t['name'], t['trace_id']) for t in _exported(trace_file)]
+    assert ('fast', trace.trace_id) in names  # 上游已采样
+    assert names[-1][0] == 'broken'
+
+
+def test_disabled_is_noop(monkeypatch):
+    monkeypatch.setenv('TRACE_EXPORTER', 'none')
+    tracing.reset_exporter()
+    assert tracing.start_trace('request') is None
+    with tracing.span('stage') as stage:
+        stage.set(a=1)
+    assert stage is tracing._NOOP
+
+
+def test_analyze_request_is_traced(trace_file, tmp_path, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setitem(app_module.app.config, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    client = app_module.app.test_client()
+    image = np.full((600, 800, 3), 40, np.uint8)
+    cv2.ellipse(image, (400, 300), (350, 280), 0, 0, 360, (170, 160, 230), -1)
+    path = str(tmp_path / 'tongue.jpg')
+    cv2.imwrite(path, image)
+
+    trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+    with open(path, 'rb') as f:
+        response = client.post(
+            '/api/analyze', data={'tongue_image': (f, 'tongue.jpg')},
+            headers={'traceparent': f'00-{trace_id}-00f067aa0ba902b7-01'}
+        )
+    assert response.status_code == 200
+    assert response.headers['X-Trace-Id'] == trace_id
+
+    request_trace = [t for t in _exported(trace_file) if t['name'] == 'POST /api/analyze'][-1]
+    assert request_trace['trace_id'] == trace_id
+    spans = {item['name']: item for item in request_trace['spans']}
+    assert spans['POST /api/analyze']['parent_id'] == '00f067aa0ba902b7'
+    assert spans['POST /api/analyze']['attributes']['status'] == 200
+    assert spans['ingest']['attributes']['image_bytes'] > 0
+    assert spans['extract.decode']['attributes']['width'] > 0
+    for stage in ('extract.color', 'extract.coating', 'extract.shape', 'extract.texture'):
+        assert spans[stage]['parent_id'] == spans['local_report']['span_id']
+
+
+def test_otlp_encoding():
+    trace = tracing.Trace('request', sampled=True)
+    trace._add('provider.call', trace.root.span_id, {'provider': 'zhipu', 'prompt_tokens': 12})
+    trace.finish()
+
+    exporter = tracing.OTLPExporter.__new__(tracing.OTLPExporter)
+    exporter.service_name = 'tongue'
+    encoded = exporter.encode([trace.to_dict()])
+    spans = encoded['resourceSpans'][0]['scopeSpans'][0]['spans']
+    assert [span['name'] for span in spans] == ['request', 'provider.call']
+    assert spans[1]['parentSpanId'] == spans[0]['spanId']
+    assert {'key': 'prompt_tokens', 'value': {'intValue': '12'}} in spans[1]['attributes']
+    json.dumps(encoded)
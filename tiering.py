@@ -0,0 +1,133 @@
+"""
+分级分析策略
+先用本地特征分类器判断，置信度足够且图片在常见范围内时直接返回；
+置信度不足或图片异常（过暗、过曝、色调不像舌体、舌体过小）时升级到大模型
+
+注意：分类器的置信度未经校准，默认阈值（0.6 / 0.25）是未经验证的初始值，
+并不对应某个准确率；应在积累带LLM报告的图片后用 benchmark_classifier.py 评估并调整
+"""
+
+import os
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+
+class TierPolicy:
+    """升级判定：给出需要升级到大模型的原因，无需升级时返回 None"""
+
+    def __init__(
+        self,
+        min_confidence: Optional[float] = None,
+        min_margin: Optional[float] = None
+    ):
+        """
+        Args:
+            min_confidence: 主体质概率（未校准）不低于该值才直接返回，默认读取环境变量 TIER_MIN_CONFIDENCE（0.6，未经验证）
+            min_margin: 主体质与第二名的概率差不低于该值才直接返回，默认读取 TIER_MIN_MARGIN（0.25，未经验证）
+        """
+        self.min_confidence = min_confidence if min_confidence is not None else float(
+            os.getenv('TIER_MIN_CONFIDENCE', 0.6))
+        self.min_margin = min_margin if min_margin is not None else float(
+            os.getenv('TIER_MIN_MARGIN', 0.25))
+
+    def escalation_reason(
+        self,
+        classification: Dict[str, Any],
+        features: Dict[str, Any]
+    ) -> Optional[str]:
+        """
+        判断是否需要升级
+
+        Args:
+            classification: ConstitutionClassifier.classify 的结果
+            features: 提取的舌象特征
+
+        Returns:
+            升级原因；可以直接使用本地结果时返回 None
+        """
+        anomalies = out_of_distribution(features)
+        if anomalies:
+            return '图片异常: ' + '、'.join(anomalies)
+        if classification['confidence'] < self.min_confidence:
+            return f"置信度不足 ({classification['confidence']:.2f})"
+        if classification['margin'] < self.min_margin:
+            return f"体质区分度不足 ({classification['margin']:.2f})"
+        return None
+
+
+def out_of_distribution(features: Dict[str, Any]) -> List[str]:
+    """
+    检查图片是否超出本地分类器可靠的范围
+
+    Returns:
+        异常项列表，正常时为空
+    """
+    color = features['tongue_color']
+    anomalies = []
+
+    if color['brightness'] < 60:
+        anomalies.append('画面过暗')
+    elif color['brightness'] > 245 and color['saturation'] < 15:
+        anomalies.append('画面过曝')
+
+    # OpenCV 色调范围 0-180：舌色集中在红-紫（<20 或 >120），黄绿蓝色调多半不是舌体
+    if 25 < color['hue'] < 110 and color['saturation'] > 40:
+        anomalies.append('色调不像舌体')
+
+    if features['shape'].get('area_ratio', 1.0) < 0.05:
+        anomalies.append('未检测到完整舌体')
+
+    return anomalies
+
+
+class TierMetrics:
+    """分级统计：各层请求数、耗时分位数和升级原因"""
+
+    def __init__(self, window: int = 500):
+        """
+        Args:
+            window: 每层保留的耗时样本数
+        """
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+        self.escalation_reasons: Dict[str, int] = {}
+        self.window = window
+
+    def record(self, tier: str, seconds: float, reason: Optional[str] = None):
+        """
+        记录一次请求
+
+        Args:
+            tier: 'local'（本地直接返回）、'llm'（升级到大模型）或 'fallback'（升级失败回退本地）
+            seconds: 端到端耗时
+            reason: 升级原因
+        """
+        with self._lock:
+            self._counts[tier] = self._counts.get(tier, 0) + 1
+            self._latencies.setdefault(tier, deque(maxlen=self.window)).append(seconds)
+            if reason:
+                # 只按原因类别统计（去掉括号里的具体数值）
+                category = reason.split(' (')[0]
+                self.escalation_reasons[category] = self.escalation_reasons.get(category, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """导出统计数据"""
+        with self._lock:
+            total = sum(self._counts.values())
+            tiers = {}
+            for tier, samples in self._latencies.items():
+                ordered = sorted(samples)
+                tiers[tier] = {
+                    'count': self._counts[tier],
+                    'p50_ms': round(ordered[len(ordered) // 2] * 1000, 1),
+                    'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+                    'mean_ms': round(sum(ordered) / len(ordered) * 1000, 1)
+                }
+            return {
+                'requests': total,
+                'local_rate': self._counts.get('local', 0) / total if total else 0.0,
+                'tiers': tiers,
+                'escalation_reasons': dict(self.escalation_reasons)
+            }
@@ -5,15 +5,33 @@
 
 import cv2
 import numpy as np
-from typing import Dict, Any, Tuple, List
+from typing import Dict, Any, Tuple, List, Optional
+
+from deadline import check_stage
+from image_utils import probe_image_size
+from metrics import EXTRACTOR_STAGE_SECONDS
+from tracing import span
+
+# JPEG 可在解码时直接按 1/2、1/4、1/8 缩小，比完整解码后再缩放快得多
+_REDUCED_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
 
 
 class TongueFeatureExtractor:
     """舌象特征提取器"""
 
-    def __init__(self):
-        """初始化特征提取器"""
-        pass
+    def __init__(self, max_side: Optional[int] = None):
+        """
+        初始化特征提取器
+
+        Args:
+            max_side: 分析前把图片长边缩小到不超过该值（None 表示按原图分析）。
+                本地快速通道用它把千万像素的手机照片控制在几十毫秒内
+        """
+        self.max_side = max_side
 
     def extract_features(self, image_path: str) -> Dict[str, Any]:
         """
@@ -26,15 +44,24 @@ class TongueFeatureExtractor:
             特征字典
         """
         # 读取图片
-        image = cv2.imread(image_path)
+        check_stage('decode')
+        with EXTRACTOR_STAGE_SECONDS.time(stage='decode'), span('extract.decode') as decode_span:
+            image = self._read_image(image_path)
+            if image is not None:
+                decode_span.set(height=image.shape[0], width=image.shape[1])
         if image is None:
             raise ValueError(f"无法读取图片: {image_path}")
+        check_stage('extract_features')
 
         # 提取各项特征
-        tongue_color = self._analyze_tongue_color(image)
-        coating_features = self._analyze_coating(image)
-        shape_features = self._analyze_shape(image)
-        texture_features = self._analyze_texture(image)
+        with EXTRACTOR_STAGE_SECONDS.time(stage='color'), span('extract.color'):
+            tongue_color = self._analyze_tongue_color(image)
+        with EXTRACTOR_STAGE_SECONDS.time(stage='coating'), span('extract.coating'):
+            coating_features = self._analyze_coating(image)
+        with EXTRACTOR_STAGE_SECONDS.time(stage='shape'), span('extract.shape'):
+            shape_features = self._analyze_shape(image)
+        with EXTRACTOR_STAGE_SECONDS.time(stage='texture'), span('extract.texture'):
+            texture_features = self._analyze_texture(image)
 
         return {
             "tongue_color": tongue_color,
@@ -46,6 +73,30 @@ class TongueFeatureExtractor:
             )
         }
 
+    def _read_image(self, image_path: str) -> Optional[np.ndarray]:
+        """读取图片，设置了 max_side 时按比例缩小解码"""
+        if not self.max_side:
+            return cv2.imread(image_path)
+
+        flag = cv2.IMREAD_COLOR
+        size = probe_image_size(image_path)
+        if size:
+            long_side = max(size)
+            for factor, reduced_flag in _REDUCED_FLAGS:
+                if long_side // factor >= self.max_side:
+                    flag = reduced_flag
+                    break
+
+        image = cv2.imread(image_path, flag)
+        if image is None:
+            return None
+
+        h, w = image.shape[:2]
+        scale = self.max_side / max(h, w)
+        if scale < 1:
+            image = cv2.resize(image, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        return image
+
     def _analyze_tongue_color(self, image: np.ndarray) -> Dict[str, Any]:
         """
         分析舌质颜色
@@ -178,6 +229,7 @@ class TongueFeatureExtractor:
         if len(contours) == 0:
             return {
                 "type": "正常舌形",
+                "area_ratio": 0.0,
                 "description": "舌形大小适中"
             }
 
@@ -206,6 +258,7 @@ class TongueFeatureExtractor:
             "type": shape_type,
             "circularity": float(circularity),
             "area": float(area),
+            "area_ratio": float(area / gray.size),
             "description": shape_type
         }
 
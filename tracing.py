@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+"""
+请求级追踪
+每个请求一个追踪ID，沿 Flask 请求 → 分析器 → 特征提取各阶段 → 提供商调用 → JSON 解析
+记录嵌套的区间（span）：耗时和负载大小（图片字节数、提示/生成 token 数）。
+平均值说明不了个别慢请求，追踪记录能看到一次请求的时间具体花在哪里
+
+- 追踪ID沿用请求头 traceparent（W3C Trace Context），响应头 X-Trace-Id 返回给客户端
+- 当前区间保存在 contextvars 中：对冲请求的线程池复制上下文，区间自动挂到同一追踪下；
+  后台升级任务通过任务参数携带父区间，与发起请求属于同一追踪
+- 采样在请求结束时决定：按比例抽样，另外慢请求和出错的请求总是导出
+- 导出在后台线程进行，不占用请求时间：本地 JSONL 文件（每行一个追踪）或 OTLP/HTTP JSON 收集器
+
+环境变量：
+    TRACE_EXPORTER=none               none（关闭）、jsonl 或 otlp
+    TRACE_FILE=logs/traces.jsonl      jsonl 导出文件
+    TRACE_OTLP_ENDPOINT=http://127.0.0.1:4318/v1/traces
+    TRACE_SAMPLE_RATE=0.1             按比例导出的追踪比例
+    TRACE_SLOW_SECONDS=2              耗时超过该值的追踪总是导出（0 表示不按耗时导出）
+
+查看：python tracing.py [--file logs/traces.jsonl] [追踪ID]   不给追踪ID时列出最慢的追踪
+"""
+
+import argparse
+import contextvars
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+
+def _new_id(length: int) -> str:
+    return uuid.uuid4().hex[:length]
+
+
+class Span:
+    """追踪中的一个区间"""
+
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, trace: 'Trace', name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = _new_id(16)
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any):
+        """补充属性（如响应返回后才知道的 token 数）"""
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+    def finish(self, error: Optional[str] = None):
+        """结束区间（open_span 打开的区间由调用方结束）"""
+        if self.end is None:
+            self.end = time.time()
+        if error:
+            self.error = error
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def to_dict(self) -> Dict[str, Any]:
+        item = {
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'offset_ms': round((self.start - self.trace.root.start) * 1000, 2),
+            'duration_ms': round(self.duration * 1000, 2),
+            'attributes': self.attributes
+        }
+        if self.error:
+            item['error'] = self.error
+        return item
+
+
+class _NoopSpan:
+    """未开启追踪时的区间：所有操作都不做事"""
+
+    def set(self, **attributes: Any):
+        pass
+
+    def finish(self, error: Optional[str] = None):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Trace:
+    """一次请求（或一个后台任务）的全部区间"""
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: Optional[str] = None,
+        parent_id: Optional[str] = None,
+        sampled: bool = False,
+        attributes: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Args:
+            name: 根区间名
+            trace_id: 追踪ID（延续上游追踪时传入）
+            parent_id: 上游的父区间ID
+            sampled: 上游已决定采样
+            attributes: 根区间的属性
+        """
+        self.trace_id = trace_id or _new_id(32)
+        self.sampled = sampled
+        self._lock = threading.Lock()
+        self.spans: List[Span] = []
+        self.root = self._add(name, parent_id, attributes or {})
+        self._token: Optional[contextvars.Token] = None
+
+    def _add(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]) -> Span:
+        span = Span(self, name, parent_id, attributes)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def activate(self) -> 'Trace':
+        """把根区间设为当前区间"""
+        self._token = _current.set(self.root)
+        return self
+
+    def finish(self, error: Optional[str] = None):
+        """结束追踪，按采样规则导出"""
+        if self._token is not None:
+            try:
+                _current.reset(self._token)
+            except ValueError:
+                _current.set(None)  # 在另一个上下文中结束
+            self._token = None
+        if self.root.end is not None:
+            return
+        self.root.end = time.time()
+        if error:
+            self.root.error = error
+        exporter = get_exporter()
+        if exporter is not None and _should_export(self):
+            exporter.submit(self.to_dict())
+
+    def traceparent(self, span: Optional[Span] = None) -> str:
+        """传给下游（后台任务、外部服务）的 W3C traceparent"""
+        span = span or self.root
+        return f"00-{self.trace_id}-{span.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            'trace_id': self.trace_id,
+            'name': self.root.name,
+            'start': self.root.start,
+            'duration_ms': round(self.root.duration * 1000, 2),
+            'error': self.root.error,
+            'spans': [span.to_dict() for span in spans]
+        }
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('trace_span', default=None)
+
+
+def enabled() -> bool:
+    return get_exporter() is not None
+
+
+def sample_rate() -> float:
+    return float(os.getenv('TRACE_SAMPLE_RATE', '0.1'))
+
+
+def slow_seconds() -> float:
+    return float(os.getenv('TRACE_SLOW_SECONDS', '2'))
+
+
+def _should_export(trace: Trace) -> bool:
+    if trace.sampled or trace.root.error:
+        return True
+    threshold = slow_seconds()
+    return threshold > 0 and trace.root.duration >= threshold
+
+
+def start_trace(name: str, traceparent: Optional[str] = None, **attributes: Any) -> Optional[Trace]:
+    """
+    开始一个追踪并设为当前追踪
+
+    Args:
+        name: 根区间名（如 'POST /api/analyze'）
+        traceparent: 上游的 W3C traceparent（请求头或后台任务参数）
+        attributes: 根区间的属性
+
+    Returns:
+        追踪对象（结束时调用 finish）；未开启追踪时返回 None
+    """
+    if not enabled():
+        return None
+    trace_id = parent_id = None
+    sampled = random.random() < sample_rate()
+    match = _TRACEPARENT.match(traceparent or '')
+    if match:
+        trace_id, parent_id = match.group(1), match.group(2)
+        sampled = sampled or bool(int(match.group(3), 16) & 1)
+    return Trace(name, trace_id, parent_id, sampled, attributes).activate()
+
+
+@contextmanager
+def trace_scope(name: str, traceparent: Optional[str] = None, **attributes: Any) -> Iterator[Optional[Trace]]:
+    """在代码块内开始并结束一个追踪（后台任务使用）"""
+    trace = start_trace(name, traceparent, **attributes)
+    error = None
+    try:
+        yield trace
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if trace is not None:
+            trace.finish(error)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """
+    在当前追踪下记录一个区间（没有当前追踪时不做任何事）
+
+    Yields:
+        区间对象，可用 set() 补充属性
+    """
+    parent = _current.get()
+    if parent is None or parent.trace.root.end is not None:
+        yield _NOOP
+        return
+    child = parent.trace._add(name, parent.span_id, {k: v for k, v in attributes.items() if v is not None})
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        child.end = time.time()
+        _current.reset(token)
+
+
+def open_span(name: str, **attributes: Any) -> Any:
+    """
+    打开一个区间但不设为当前区间，由调用方 finish
+
+    用于生成器：生成器在 yield 之间把控制权交还调用方，也可能在另一个上下文中被关闭，
+    不能像 span() 那样在生成器内切换当前区间
+
+    Returns:
+        区间对象；没有当前追踪时返回不做事的区间
+    """
+    parent = _current.get()
+    if parent is None or parent.trace.root.end is not None:
+        return _NOOP
+    return parent.trace._add(name, parent.span_id, {k: v for k, v in attributes.items() if v is not None})
+
+
+def current_span() -> Any:
+    """当前区间（没有时返回不做事的区间）"""
+    return _current.get() or _NOOP
+
+
+def current_traceparent() -> Optional[str]:
+    """当前区间的 traceparent（没有当前追踪时返回 None）"""
+    current = _current.get()
+    return current.trace.traceparent(current) if current is not None else None
+
+
+def current_trace_id() -> Optional[str]:
+    current = _current.get()
+    return current.trace.trace_id if current is not None else None
+
+
+def usage_attributes(response: Any) -> Dict[str, Any]:
+    """
+    从SDK响应中读取 token 用量
+
+    OpenAI 兼容接口（智谱、DeepSeek）为 prompt_tokens / completion_tokens，
+    dashscope 为 input_tokens / output_tokens；没有用量信息时返回空字典
+    """
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return {}
+    if isinstance(usage, dict):
+        get = usage.get
+    else:
+        def get(key):
+            return getattr(usage, key, None)
+    prompt = get('prompt_tokens') if get('prompt_tokens') is not None else get('input_tokens')
+    completion = get('completion_tokens') if get('completion_tokens') is not None else get('output_tokens')
+    return {key: value for key, value in (('prompt_tokens', prompt), ('completion_tokens', completion))
+            if isinstance(value, int)}
+
+
+# ---- 导出 ----
+
+class _BackgroundExporter:
+    """在后台线程中导出追踪（队列满时丢弃，不阻塞请求）"""
+
+    def __init__(self, max_queue: int = 1000):
+        self._queue: 'queue.Queue[Dict[str, Any]]' = queue.Queue(max_queue)
+        self._thread = threading.Thread(target=self._run, name='trace-export', daemon=True)
+        self._thread.start()
+
+    def submit(self, trace: Dict[str, Any]):
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            pass
+
+    def flush(self, timeout: float = 5.0):
+        """等待已提交的追踪导出完毕（测试和退出前使用）"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.export(batch)
+            except Exception as e:
+                print(f"⚠️  追踪导出失败: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def export(self, traces: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+
+class JSONLExporter(_BackgroundExporter):
+    """追加写入本地 JSONL 文件，每行一个追踪"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        super().__init__()
+
+    def export(self, traces: List[Dict[str, Any]]):
+        lines = ''.join(json.dumps(trace, ensure_ascii=False, separators=(',', ':')) + '\n' for trace in traces)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+
+
+class OTLPExporter(_BackgroundExporter):
+    """以 OTLP/HTTP JSON 格式发送到收集器（如 OpenTelemetry Collector 的 4318 端口）"""
+
+    def __init__(self, endpoint: str, service_name: str = 'tongue', timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+        super().__init__()
+
+    def export(self, traces: List[Dict[str, Any]]):
+        body = json.dumps(self.encode(traces), ensure_ascii=False).encode('utf-8')
+        request = urllib.request.Request(
+            self.endpoint, data=body, headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def encode(self, traces: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """转换为 OTLP ExportTraceServiceRequest 的 JSON 表示"""
+        spans = []
+        for trace in traces:
+            start_ns = int(trace['start'] * 1e9)
+            for item in trace['spans']:
+                begin = start_ns + int(item['offset_ms'] * 1e6)
+                span = {
+                    'traceId': trace['trace_id'],
+                    'spanId': item['span_id'],
+                    'name': item['name'],
+                    'kind': 1,
+                    'startTimeUnixNano': str(begin),
+                    'endTimeUnixNano': str(begin + int(item['duration_ms'] * 1e6)),
+                    'attributes': [_otlp_attribute(key, value) for key, value in item['attributes'].items()],
+                    'status': {'code': 2, 'message': item['error']} if item.get('error') else {}
+                }
+                if item['parent_id']:
+                    span['parentSpanId'] = item['parent_id']
+                spans.append(span)
+        return {'resourceSpans': [{
+            'resource': {'attributes': [_otlp_attribute('service.name', self.service_name)]},
+            'scopeSpans': [{'scope': {'name': 'tongue.tracing'}, 'spans': spans}]
+        }]}
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+_exporter: Optional[_BackgroundExporter] = None
+_exporter_pid: Optional[int] = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter() -> Optional[_BackgroundExporter]:
+    """
+    按环境变量创建导出器（每个进程一个：预派生模式下 fork 后的 worker 各自创建导出线程）
+
+    Returns:
+        未开启追踪（TRACE_EXPORTER=none）时返回 None
+    """
+    global _exporter, _exporter_pid
+    kind = os.getenv('TRACE_EXPORTER', 'none').lower()
+    if kind == 'none':
+        return None
+    if _exporter is not None and _exporter_pid == os.getpid():
+        return _exporter
+    with _exporter_lock:
+        if _exporter is None or _exporter_pid != os.getpid():
+            if kind == 'jsonl':
+                _exporter = JSONLExporter(os.getenv('TRACE_FILE', 'logs/traces.jsonl'))
+            elif kind == 'otlp':
+                _exporter = OTLPExporter(os.getenv('TRACE_OTLP_ENDPOINT', 'http://127.0.0.1:4318/v1/traces'))
+            else:
+                raise ValueError(f"不支持的追踪导出方式: {kind}")
+            _exporter_pid = os.getpid()
+        return _exporter
+
+
+def reset_exporter():
+    """丢弃当前导出器（配置变更后或测试中使用）"""
+    global _exporter, _exporter_pid
+    with _exporter_lock:
+        _exporter = None
+        _exporter_pid = None
+
+
+# ---- 查看 ----
+
+def load_traces(path: str) -> List[Dict[str, Any]]:
+    traces = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                traces.append(json.loads(line))
+    return traces
+
+
+def format_trace(trace: Dict[str, Any]) -> str:
+    """按父子关系缩进、按开始时间排序的区间列表"""
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    ids = {item['span_id'] for item in trace['spans']}
+    for item in trace['spans']:
+        parent = item['parent_id'] if item['parent_id'] in ids else None
+        children.setdefault(parent, []).append(item)
+
+    lines = [f"追踪 {trace['trace_id']}  {trace['name']}  {trace['duration_ms']:.1f}ms"]
+
+    def walk(parent: Optional[str], depth: int):
+        for item in sorted(children.get(parent, []), key=lambda s: s['offset_ms']):
+            attributes = ' '.join(f"{key}={value}" for key, value in item['attributes'].items())
+            error = f"  ❌ {item['error']}" if item.get('error') else ''
+            lines.append(f"{'  ' * depth}{item['offset_ms']:>9.1f}ms {item['duration_ms']:>9.1f}ms  "
+                         f"{item['name']}  {attributes}{error}")
+            walk(item['span_id'], depth + 1)
+
+    walk(None, 0)
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='查看导出的追踪')
+    parser.add_argument('trace_id', nargs='?', help='追踪ID（不提供时列出最慢的追踪）')
+    parser.add_argument('--file', default=os.getenv('TRACE_FILE', 'logs/traces.jsonl'))
+    parser.add_argument('--top', type=int, default=10, help='列出最慢的追踪数')
+    args = parser.parse_args()
+
+    traces = load_traces(args.file)
+    if args.trace_id:
+        # 同一追踪ID可能有多条记录（请求本身和后台升级任务）
+        matched = [trace for trace in traces if trace['trace_id'] == args.trace_id]
+        if not matched:
+            print(f"❌ 未找到追踪 {args.trace_id}")
+            return
+        for trace in sorted(matched, key=lambda t: t['start']):
+            print(format_trace(trace))
+        return
+
+    for trace in sorted(traces, key=lambda t: t['duration_ms'], reverse=True)[:args.top]:
+        print(f"{trace['duration_ms']:>10.1f}ms  {trace['trace_id']}  {trace['name']}")
+
+
+if __name__ == "__main__":
+    main()